@@ -1,5 +1,9 @@
 import sys
-import queue
+import copy
+import heapq
+import os
+import pickle
+import tempfile
 import pandas as pd
 import mplfinance as mpf
 import matplotlib.pyplot as plt
@@ -12,7 +16,37 @@ import buffer as buffer_module
 import strategy
 import portfolio as portfolio_module
 import execution
+import events as events_module
+import dispatcher
 import performance
+import profiling
+
+# bump when the state saved by BackTester.save_checkpoint changes
+CHECKPOINT_VERSION = 1
+
+
+def register_handlers(events, symbol, strategy, buffer, portfolio, executor, profiler=None):
+    """
+    Wires the components of one strategy to its dispatcher: a MarketEvent goes to the strategy and then
+    to the portfolio, signals to the portfolio, orders to the executor and fills (or failed orders) back to the portfolio
+    :param profiler: profiling.Profiler, if given every handler is timed
+    """
+    handlers = [
+        # event fired by data_handler.update_bars(), contains new data
+        (events_module.MarketEvent, 'calculate_signals',
+         lambda event: strategy.calculate_signals(symbol, events, event, buffer)),
+        (events_module.MarketEvent, 'update_timeindex', portfolio.update_timeindex),
+        (events_module.MarketEvent, 'executor_on_market', executor.on_market),  # fills orders in flight
+        (events_module.SignalEvent, 'process_signal', portfolio.process_signal),  # puts an order event on the queue
+        (events_module.OrderEvent, 'execute_order', executor.execute_order),
+        (events_module.FillEvent, 'update_fill', lambda event: portfolio.update_fill(event, verbose=False)),
+        (events_module.OrderFailedEvent, 'update_failed_order', portfolio.update_failed_order),
+    ]
+    for event_class, name, handler in handlers:
+        if profiler is not None:
+            handler = profiler.wrap(name, handler)
+        events.register(event_class, handler)
+
 
 class BackTester():
     """
@@ -20,7 +54,7 @@ class BackTester():
     """
     def __init__(self, strategy: strategy.Strategy,
                  symbol: str, interval: str,
-                 initial_capital=10000, bet_size=1):
+                 initial_capital=10000, bet_size=1, columnar_buffer=False, cache=None):
         """
         :param strategy: the strategy to be tested
         :param symbol: the symbol to test on, for example 'BTCUSDT'
@@ -29,6 +63,9 @@ class BackTester():
         :param end: time of backtester stop, e.g. '30-Mar-2019 00:00:00'
         :param initial_capital: well, the capital to start with
         :param bet_size: what portion of the initial capital is used per each trade
+        :param columnar_buffer: store the run log in a ColumnarDataBuffer (numpy arrays) instead of a dict of dicts,
+        much lighter on memory for long backtests
+        :param cache: candle_cache.CandleCache to load candles through instead of going to the database every run
         """
         self.symbol = symbol
         self.interval = interval
@@ -36,10 +73,14 @@ class BackTester():
         self.initial_capital = initial_capital
         self.bet_size = bet_size
         self.strategy = strategy
+        self.columnar_buffer = columnar_buffer
+        self.cache = cache
 
         self.interval_ts = hlp.interval_to_milliseconds(interval)
+        self.last_close_time = None  # close time of the last bar run_test or extend processed
 
-    def run_test(self, start: str, end: str, draw=False, print_results=True, imported_data=False):
+    def run_test(self, start: str, end: str, draw=False, print_results=True, imported_data=False, chunk_size=None,
+                 batch_size=1, stop_condition=None, profile=False, executor_factory=None):
         """
         :param start:
         :param end:
@@ -47,6 +88,17 @@ class BackTester():
         :param print_results:
         :param imported_data_data: you can initialise backtester with historical data in case you have it. Otherwise data
         will be downloaded.
+        :param chunk_size: if set, downloaded data is streamed in chunks of chunk_size candles, loaded in the
+        background while the backtest runs, instead of loading the whole range before the first bar
+        :param batch_size: number of bars pushed per MarketEvent, results are the same as bar by bar
+        :param stop_condition: callable taking the performance.PerformanceTracker of the run, checked after every
+        MarketEvent. The backtest stops early if it returns True, e.g. lambda tracker: tracker.max_drawdown < -50,
+        results are calculated on the bars processed so far and self.stopped is set
+        :param profile: time every handler of the event loop, the report is kept in self.profile_report
+        (see profiling.Profiler.get_report) and printed if print_results
+        :param executor_factory: callable taking the events dispatcher and returning the execution handler,
+        e.g. lambda events: execution.LatencyExecutionHandler(events, latency=200, seed=0),
+        default execution.SimulatedExecutionHandler
         :return:
         """
 
@@ -55,48 +107,216 @@ class BackTester():
         self.start_ts = hlp.date_to_milliseconds(start)
         self.end_ts = hlp.date_to_milliseconds(end)
 
-        events = queue.Queue()
-        buffer = buffer_module.DataBuffer(self.symbol)
+        # empty imported candles are not downloaded instead
+        has_imported_data = imported_data is not None and imported_data is not False
+        events = dispatcher.EventDispatcher()
+        if self.columnar_buffer:
+            capacity = len(imported_data) if has_imported_data else 1024
+            buffer = buffer_module.ColumnarDataBuffer(self.symbol, interval_ts=self.interval_ts, capacity=capacity)
+        else:
+            buffer = buffer_module.DataBuffer(self.symbol, interval_ts=self.interval_ts)
 
-        data_handler = data.HistoricDataHandler(events, buffer, self.symbol, self.interval,
-                                                self.start_ts, self.end_ts, delete_previous_data=False,
-                                                imported_data=imported_data)
+        if chunk_size and not has_imported_data:
+            data_handler = data.StreamingHistoricDataHandler(events, buffer, self.symbol, self.interval,
+                                                             self.start_ts, self.end_ts, chunk_size=chunk_size,
+                                                             cache=self.cache)
+        else:
+            data_handler = data.HistoricDataHandler(events, buffer, self.symbol, self.interval,
+                                                    self.start_ts, self.end_ts, delete_previous_data=False,
+                                                    imported_data=imported_data, cache=self.cache)
 
 
+        self.tracker = performance.PerformanceTracker(self.initial_capital, self.interval)
         portfolio = portfolio_module.NaivePortfolio(events, buffer, self.symbol,
                                              initial_capital=self.initial_capital,
-                                             bet_size=self.bet_size, start_ts=self.start_ts)
+                                             bet_size=self.bet_size, start_ts=self.start_ts, tracker=self.tracker)
+
+        executor = (executor_factory or execution.SimulatedExecutionHandler)(events)
+        profiler = profiling.Profiler(events) if profile else None
+        register_handlers(events, self.symbol, self.strategy, buffer, portfolio, executor, profiler=profiler)
+        self.buffer = buffer
+        self.portfolio = portfolio
+        self.executor = executor
+        self.last_close_time = None
+
+        update_bars = data_handler.update_bars
+        if profiler is not None:
+            update_bars = profiler.wrap('update_bars', update_bars)
+            profiler.start()
 
-        executor = execution.SimulatedExecutionHandler(events)
+        self._run_loop(events, data_handler, update_bars, batch_size, stop_condition)
 
+        if profiler is not None:
+            profiler.stop()
+            self.profile_report = profiler.get_report(n_bars=buffer.get_len())
+            if print_results:
+                profiler.print_report(self.profile_report)
+
+        backtest_results = performance.calculate_performance(buffer=buffer,
+                                                             interval=self.interval,
+                                                             initial_capital=self.initial_capital,
+                                                             draw=draw,
+                                                             print_results=print_results)
+
+
+        return backtest_results
+
+    def _run_loop(self, events, data_handler, update_bars, batch_size, stop_condition):
+        self.stopped = False
         while True:
             # Update the bars
             if data_handler.continue_backtest:
                 #  get new bar from data feed, append it to buffer (queue)
-                data_handler.update_bars()
+                update_bars(batch_size=batch_size)
             else:
                 break
             # Process event queue until it's empty
-            while True:
-                try:
-                    event = events.get(False)  # https://docs.python.org/3/library/queue.html#queue.Queue.get
-                except queue.Empty:
+            events.dispatch()
+
+            if stop_condition is not None:
+                self.portfolio.update_tracker()
+                if stop_condition(self.tracker):
+                    data_handler.close()
+                    self.stopped = True
                     break
+        self.portfolio.update_tracker()
+        if data_handler.last_close_time is not None:
+            # the data cursor of the run: where extend goes on from
+            self.last_close_time = data_handler.last_close_time
 
-                if event.type == 'MARKET':
-                    # event fired by data_handler.update_bars(), contains new data
-                    self.strategy.calculate_signals(self.symbol, events, event, buffer)
-                    portfolio.update_timeindex(event)
+    def extend(self, end: str, draw=False, print_results=True, imported_data=False, batch_size=1,
+               stop_condition=None):
+        """
+        Goes on with the last run_test (or the run of a checkpoint, see load_checkpoint) up to end: only the bars
+        after the last one it processed are run, through the same strategy, portfolio, executor and buffer.
+        Results are the same as a run_test from the original start to end.
+        :param imported_data: candles to go on with, the ones up to the last bar processed are skipped,
+        so they can be the new candles only or the whole history. Otherwise they are downloaded
+        Other parameters as in run_test
+        :return: backtest results of the whole run, from the original start
+        """
+        if self.last_close_time is None:
+            raise ValueError('nothing to extend: run run_test or load a checkpoint first')
+        self.end = end
+        self.end_ts = hlp.date_to_milliseconds(end)
+
+        events = dispatcher.EventDispatcher()
+        # candles open right after the last close time
+        data_handler = data.HistoricDataHandler(events, self.buffer, self.symbol, self.interval,
+                                                self.last_close_time + 1, self.end_ts, delete_previous_data=False,
+                                                imported_data=imported_data, cache=self.cache)
+        data_handler.seek(self.last_close_time + 1)
+        self.portfolio.events = events
+        self.executor.events = events
+        register_handlers(events, self.symbol, self.strategy, self.buffer, self.portfolio, self.executor)
+
+        self._run_loop(events, data_handler, data_handler.update_bars, batch_size, stop_condition)
+
+        return performance.calculate_performance(buffer=self.buffer,
+                                                 interval=self.interval,
+                                                 initial_capital=self.initial_capital,
+                                                 draw=draw,
+                                                 print_results=print_results)
+
+    def save_checkpoint(self, path):
+        """
+        Saves the state of the last run (run_test or extend): strategy with its indicators, portfolio holdings
+        and positions, orders in flight, performance tracker, the buffer and the data cursor,
+        so that a later process can load_checkpoint and extend it with new candles.
+        The whole buffer is kept, the results of an extended run are calculated on all its bars.
+        Execution handlers talking to an exchange (LiveExecutionHandler) can't be saved.
+        :param path: str or pathlib.Path
+        """
+        # the dispatcher holds the handlers of the run, a new one is made by extend
+        portfolio = copy.copy(self.portfolio)
+        portfolio.events = None
+        executor = copy.copy(self.executor)
+        executor.events = None
+        state = {
+            'version': CHECKPOINT_VERSION,
+            'symbol': self.symbol,
+            'interval': self.interval,
+            'initial_capital': self.initial_capital,
+            'bet_size': self.bet_size,
+            'columnar_buffer': self.columnar_buffer,
+            'start': self.start,
+            'start_ts': self.start_ts,
+            'end': self.end,
+            'end_ts': self.end_ts,
+            'last_close_time': self.last_close_time,
+            'stopped': self.stopped,
+            # one pickle, the objects they share (buffer, tracker) stay shared
+            'strategy': self.strategy,
+            'buffer': self.buffer,
+            'tracker': self.tracker,
+            'portfolio': portfolio,
+            'executor': executor,
+        }
+        # write to a temporary file of its own first, so that an interrupted save, or another one of the same
+        # path, never leaves a broken checkpoint
+        path = os.fspath(path)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.',
+                                         suffix='.tmp', delete=False) as f:
+            try:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.replace(f.name, path)
 
-                elif event.type == 'SIGNAL':
-                    portfolio.process_signal(event)  # puts an order event on the queue
+    @classmethod
+    def load_checkpoint(cls, path, cache=None):
+        """
+        Only load checkpoints you saved yourself, they are pickles
+        :param cache: candle_cache.CandleCache for the candles extend downloads
+        :return: BackTester in the state save_checkpoint saved, ready to extend
+        """
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise ValueError(f'checkpoint {path} has version {state.get("version")}, expected {CHECKPOINT_VERSION}')
+        backtester = cls(state['strategy'], state['symbol'], state['interval'],
+                         initial_capital=state['initial_capital'], bet_size=state['bet_size'],
+                         columnar_buffer=state['columnar_buffer'], cache=cache)
+        for name in ('start', 'start_ts', 'end', 'end_ts', 'last_close_time', 'stopped', 'buffer', 'tracker',
+                     'portfolio', 'executor'):
+            setattr(backtester, name, state[name])
+        return backtester
+
+    def run_vectorized(self, start: str, end: str, draw=False, print_results=True, imported_data=False,
+                       precomputed=None):
+        """
+        Runs the same backtest as run_test, but processes all the bars at once with numpy arrays instead of
+        pushing them one by one through the event queue. Much faster, meant for research and optimisation.
+        The strategy has to implement calculate_signals_vectorized.
+        Parameters and returned results are the same as in run_test.
+        :param precomputed: dict of indicator name -> values for every candle, passed to the strategy
+        """
+        self.start = start
+        self.end = end
+        self.start_ts = hlp.date_to_milliseconds(start)
+        self.end_ts = hlp.date_to_milliseconds(end)
+        self.last_close_time = None  # can't be extended
 
-                elif event.type == 'ORDER':
-                    executor.execute_order(event)
+        if imported_data is None or imported_data is False:
+            imported_data = data.load_dataset(self.symbol, self.interval, self.start_ts, self.end_ts,
+                                              cache=self.cache)
+        candles = data.candles_to_columns(imported_data)
+        close_time = candles['close_time']
+        close = candles['close']
 
-                elif event.type == 'FILL':
-                    portfolio.update_fill(event, verbose=False)
+        buffer = buffer_module.ColumnarDataBuffer(self.symbol, interval_ts=self.interval_ts, capacity=len(close_time))
+        buffer.append_columns(close_time, candles)
+        self.buffer = buffer
 
+        portfolio = portfolio_module.NaivePortfolio(None, buffer, self.symbol,
+                                                    initial_capital=self.initial_capital,
+                                                    bet_size=self.bet_size, start_ts=self.start_ts)
+
+        signal_bars, signals = self.strategy.calculate_signals_vectorized(close_time, close, buffer,
+                                                                          precomputed=precomputed)
+        portfolio.process_signals_vectorized(close_time, close, signal_bars, signals)
 
         backtest_results = performance.calculate_performance(buffer=buffer,
                                                              interval=self.interval,
@@ -104,5 +324,102 @@ class BackTester():
                                                              draw=draw,
                                                              print_results=print_results)
 
-
         return backtest_results
+
+
+class StrategySession():
+    """
+    Everything one strategy needs in a shared event loop: its own events queue, buffer, portfolio and executor
+    """
+
+    def __init__(self, symbol, strategy, interval_ts, initial_capital, bet_size, start_ts, columnar_buffer=False):
+        self.symbol = symbol
+        self.strategy = strategy
+        self.events = dispatcher.EventDispatcher()
+        if columnar_buffer:
+            self.buffer = buffer_module.ColumnarDataBuffer(symbol, interval_ts=interval_ts)
+        else:
+            self.buffer = buffer_module.DataBuffer(symbol, interval_ts=interval_ts)
+        self.portfolio = portfolio_module.NaivePortfolio(self.events, self.buffer, symbol,
+                                                         initial_capital=initial_capital,
+                                                         bet_size=bet_size, start_ts=start_ts)
+        self.executor = execution.SimulatedExecutionHandler(self.events)
+        register_handlers(self.events, symbol, strategy, self.buffer, self.portfolio, self.executor)
+
+    def on_bar(self, bar: dict):
+        self.buffer.append_data(bar)
+        self.events.put(events_module.MarketEvent(bar))
+        self.events.dispatch()
+
+
+class MultiBackTester():
+    """
+    Backtests N strategies on M symbols in one event loop. Candles of all the symbols are merged by close_time
+    and replayed once, each bar is routed to the strategies subscribed to its symbol.
+    Every strategy has its own buffer and portfolio, results are the same as running a BackTester per strategy.
+    """
+
+    def __init__(self, interval: str, initial_capital=10000, bet_size=1, columnar_buffer=False, cache=None):
+        """
+        :param interval: time interval, e.g. '1h' for one hour scale or '1d' for one day
+        :param initial_capital: capital of each strategy's portfolio
+        :param bet_size: what portion of the initial capital is used per each trade
+        :param columnar_buffer: use ColumnarDataBuffer for the strategies' buffers
+        :param cache: candle_cache.CandleCache to load candles through
+        """
+        self.interval = interval
+        self.interval_ts = hlp.interval_to_milliseconds(interval)
+        self.initial_capital = initial_capital
+        self.bet_size = bet_size
+        self.columnar_buffer = columnar_buffer
+        self.cache = cache
+        self.subscriptions = []  # (symbol, strategy)
+
+    def add_strategy(self, symbol: str, strategy: strategy.Strategy):
+        """
+        Subscribes a strategy to a symbol, every subscription needs its own strategy object
+        """
+        self.subscriptions.append((symbol, strategy))
+
+    def run_test(self, start: str, end: str, print_results=False, imported_data=None) -> list:
+        """
+        :param imported_data: optional dict symbol -> candles (CandleDataset or list of candle tuples),
+        symbols not in it are downloaded
+        :return: backtest results of every strategy, in the order they were added
+        """
+        self.start_ts = hlp.date_to_milliseconds(start)
+        self.end_ts = hlp.date_to_milliseconds(end)
+        imported_data = imported_data or {}
+
+        self.sessions = [StrategySession(symbol, strategy, self.interval_ts, self.initial_capital, self.bet_size,
+                                         self.start_ts, columnar_buffer=self.columnar_buffer)
+                         for symbol, strategy in self.subscriptions]
+        sessions_by_symbol = {}
+        for session in self.sessions:
+            sessions_by_symbol.setdefault(session.symbol, []).append(session)
+
+        handlers = [data.HistoricDataHandler(None, None, symbol, self.interval, self.start_ts, self.end_ts,
+                                             imported_data=imported_data.get(symbol, False), cache=self.cache)
+                    for symbol in sessions_by_symbol]
+
+        # merge the feeds: always take the handler whose next bar closes first, ties go in subscription order
+        heap = [(handler.next_close_time(), i) for i, handler in enumerate(handlers) if handler.continue_backtest]
+        heapq.heapify(heap)
+        while heap:
+            _, i = heap[0]
+            handler = handlers[i]
+            new_data = handler.next_bar()
+            if handler.continue_backtest:
+                heapq.heapreplace(heap, (handler.next_close_time(), i))
+            else:
+                heapq.heappop(heap)
+
+            if new_data:
+                for session in sessions_by_symbol[handler.symbol]:
+                    session.on_bar(new_data)
+
+        return [performance.calculate_performance(buffer=session.buffer,
+                                                  interval=self.interval,
+                                                  initial_capital=self.initial_capital,
+                                                  print_results=print_results)
+                for session in self.sessions]
@@ -0,0 +1,3 @@
+"""
+Benchmarks, run from the repository root, e.g.: python -m benchmarks.bench_buffer
+"""
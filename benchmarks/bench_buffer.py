@@ -0,0 +1,65 @@
+"""
+Cost of DataBuffer.get_item_by_timestamp as the buffer grows.
+Misses (timestamp between two bars, the way EMAStrategy looks up the previous bar) are the expensive case,
+the old implementation scanned all the keys for them. Run: python -m benchmarks.bench_buffer
+"""
+import random
+import time
+
+import buffer as buffer_module
+
+INTERVAL_TS = 60 * 1000
+SIZES = [1000, 10000, 100000]
+N_LOOKUPS = 20000
+LEGACY_MAX_SIZE = 10000  # the old linear scan gets too slow to measure beyond this
+
+
+def legacy_get_item_by_timestamp(buffer, timestamp):
+    # the lookup DataBuffer used before the time index was added
+    keys = buffer.buffer.keys()
+    if timestamp in keys:
+        return buffer.buffer[timestamp]
+    else:
+        prev_timestamp = max([i for i in keys if i < timestamp])
+        return buffer.buffer[prev_timestamp]
+
+
+def fill_buffer(buffer_class, size, gaps):
+    buffer = buffer_class('BTCUSDT', interval_ts=INTERVAL_TS)
+    for i in range(size):
+        if gaps and i % 50 == 25:
+            continue
+        buffer.append_data({'close_time': i * INTERVAL_TS, 'close': float(i)})
+    return buffer
+
+
+def time_lookups(lookup, timestamps) -> float:
+    start = time.perf_counter()
+    for timestamp in timestamps:
+        lookup(timestamp)
+    return (time.perf_counter() - start) / len(timestamps) * 1e6  # us per lookup
+
+
+def main():
+    rnd = random.Random(0)
+    print(f'{"buffer":<20}{"series":<10}{"bars":>8}{"hit, us":>10}{"miss, us":>10}{"legacy miss, us":>17}')
+    for buffer_class in (buffer_module.DataBuffer, buffer_module.ColumnarDataBuffer):
+        for gaps in (False, True):
+            for size in SIZES:
+                buffer = fill_buffer(buffer_class, size, gaps)
+                hits = [rnd.randrange(size) * INTERVAL_TS for _ in range(N_LOOKUPS)]
+                hits = [ts for ts in hits if buffer.time_index.get(ts) is not None]
+                misses = [rnd.randrange(1, size) * INTERVAL_TS - INTERVAL_TS // 2 for _ in range(N_LOOKUPS)]
+
+                hit_us = time_lookups(buffer.get_item_by_timestamp, hits)
+                miss_us = time_lookups(buffer.get_item_by_timestamp, misses)
+                legacy = ''
+                if buffer_class is buffer_module.DataBuffer and size <= LEGACY_MAX_SIZE:
+                    legacy_us = time_lookups(lambda ts: legacy_get_item_by_timestamp(buffer, ts), misses[:200])
+                    legacy = f'{legacy_us:.2f}'
+                print(f'{buffer_class.__name__:<20}{"gaps" if gaps else "regular":<10}{size:>8}'
+                      f'{hit_us:>10.2f}{miss_us:>10.2f}{legacy:>17}')
+
+
+if __name__ == '__main__':
+    main()
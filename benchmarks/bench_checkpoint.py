@@ -0,0 +1,61 @@
+"""
+Nightly report scenario: a backtest over a long history is saved with BackTester.save_checkpoint, a day of new
+candles arrives, the checkpoint is loaded and extended with them. Compares the time with rerunning the whole
+history, tests/test_checkpoint.py checks that results and run logs are identical.
+Run: python -m benchmarks.bench_checkpoint
+"""
+import os
+import tempfile
+import time
+
+import backtesting
+import data
+import strategy
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2030 00:00:00'
+NEW_BARS = 24
+
+
+def new_backtester():
+    ema_strategy = strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), 10, 50)
+    return backtesting.BackTester(ema_strategy, SYMBOL, INTERVAL, columnar_buffer=True)
+
+
+def main(n_bars=50000):
+    dataset = data.CandleDataset.from_candles(generate_candles(n_bars + NEW_BARS, INTERVAL, missing_every=97))
+    history = data.CandleDataset(dataset.values[:n_bars])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'checkpoint.pkl')
+        backtester = new_backtester()
+        backtester.run_test(START, END, print_results=False, imported_data=history)
+        start = time.perf_counter()
+        backtester.save_checkpoint(path)
+        save_time = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        backtester = backtesting.BackTester.load_checkpoint(path)
+        load_time = time.perf_counter() - start
+        start = time.perf_counter()
+        backtester.extend(END, print_results=False, imported_data=dataset)
+        extend_time = time.perf_counter() - start
+
+    rerun = new_backtester()
+    start = time.perf_counter()
+    rerun.run_test(START, END, print_results=False, imported_data=dataset)
+    rerun_time = time.perf_counter() - start
+
+    print(f'{n_bars} candles of history, {NEW_BARS} new ones')
+    print(f'checkpoint: {size / 2 ** 20:.1f} MB, saved in {save_time:.2f} s, loaded in {load_time:.2f} s')
+    print(f'extend: {extend_time:.2f} s (results calculated on the whole history), '
+          f'full rerun: {rerun_time:.2f} s, speedup {rerun_time / (load_time + extend_time):.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Events per second through the event loop: the old queue.Queue loop (get(False), queue.Empty, if/elif on event.type)
+against dispatcher.EventDispatcher with a deque and with a thread-safe queue.
+Handlers do no work apart from putting the next event of the chain, so only the loop overhead is measured.
+Also times the components of a whole backtest wired to both loops.
+Run: python -m benchmarks.bench_dispatcher
+"""
+import queue
+import time
+
+import backtesting
+import buffer as buffer_module
+import data
+import dispatcher
+import events
+import execution
+import portfolio as portfolio_module
+import strategy
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles
+
+N_BARS = 200000
+SIGNAL_EVERY = 10  # every n-th bar fires a signal, followed by an order and a fill
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+
+
+class Handlers():
+    """
+    MarketEvent -> SignalEvent (every SIGNAL_EVERY bars) -> OrderEvent -> FillEvent
+    """
+
+    def __init__(self, events_queue):
+        self.events = events_queue
+        self.bars = 0
+
+    def on_market(self, event):
+        self.bars += 1
+        if self.bars % SIGNAL_EVERY == 0:
+            self.events.put(events.SignalEvent(SYMBOL, self.bars, events.EXIT_LONG, 1.))
+
+    def on_update_timeindex(self, event):
+        pass
+
+    def on_signal(self, event):
+        self.events.put(events.OrderEvent(SYMBOL, event.bar_close_time, events.OrderType.MKT, 1., 1.))
+
+    def on_order(self, event):
+        self.events.put(events.FillEvent(event.datetime, event.datetime, SYMBOL, 'Binance', 1., 1., 0.))
+
+    def on_fill(self, event):
+        pass
+
+
+def legacy_process_events(events_queue, handlers):
+    # the loop BackTester.run_test used before EventDispatcher
+    while True:
+        try:
+            event = events_queue.get(False)
+        except queue.Empty:
+            break
+
+        if event.type == 'MARKET':
+            handlers.on_market(event)
+            handlers.on_update_timeindex(event)
+        elif event.type == 'SIGNAL':
+            handlers.on_signal(event)
+        elif event.type == 'ORDER':
+            handlers.on_order(event)
+        elif event.type == 'FILL':
+            handlers.on_fill(event)
+
+
+def run_legacy(n_bars) -> float:
+    events_queue = queue.Queue()
+    handlers = Handlers(events_queue)
+    bar = {'close': 1.}
+    start = time.perf_counter()
+    for _ in range(n_bars):
+        events_queue.put(events.MarketEvent(bar))
+        legacy_process_events(events_queue, handlers)
+    return time.perf_counter() - start
+
+
+def run_dispatcher(n_bars, thread_safe) -> float:
+    events_queue = dispatcher.EventDispatcher(thread_safe=thread_safe)
+    handlers = Handlers(events_queue)
+    events_queue.register(events.MarketEvent, handlers.on_market)
+    events_queue.register(events.MarketEvent, handlers.on_update_timeindex)
+    events_queue.register(events.SignalEvent, handlers.on_signal)
+    events_queue.register(events.OrderEvent, handlers.on_order)
+    events_queue.register(events.FillEvent, handlers.on_fill)
+    bar = {'close': 1.}
+    start = time.perf_counter()
+    for _ in range(n_bars):
+        events_queue.put(events.MarketEvent(bar))
+        events_queue.dispatch()
+    return time.perf_counter() - start
+
+
+def run_backtest(candles, legacy) -> float:
+    # the components of BackTester.run_test, wired to the old loop or to an EventDispatcher
+    interval_ts = hlp.interval_to_milliseconds(INTERVAL)
+    start_ts, end_ts = hlp.date_to_milliseconds(START), hlp.date_to_milliseconds(END)
+    events_queue = queue.Queue() if legacy else dispatcher.EventDispatcher()
+    buffer = buffer_module.DataBuffer(SYMBOL, interval_ts=interval_ts)
+    data_handler = data.HistoricDataHandler(events_queue, buffer, SYMBOL, INTERVAL, start_ts, end_ts,
+                                            imported_data=candles)
+    ema_strategy = strategy.EMAStrategy(interval_ts, 10, 50)
+    portfolio = portfolio_module.NaivePortfolio(events_queue, buffer, SYMBOL, initial_capital=10000, bet_size=1,
+                                                start_ts=start_ts)
+    executor = execution.SimulatedExecutionHandler(events_queue)
+    if not legacy:
+        backtesting.register_handlers(events_queue, SYMBOL, ema_strategy, buffer, portfolio, executor)
+
+    start = time.perf_counter()
+    while data_handler.continue_backtest:
+        data_handler.update_bars()
+        if not legacy:
+            events_queue.dispatch()
+            continue
+        while True:
+            try:
+                event = events_queue.get(False)
+            except queue.Empty:
+                break
+            if event.type == 'MARKET':
+                ema_strategy.calculate_signals(SYMBOL, events_queue, event, buffer)
+                portfolio.update_timeindex(event)
+            elif event.type == 'SIGNAL':
+                portfolio.process_signal(event)
+            elif event.type == 'ORDER':
+                executor.execute_order(event)
+            elif event.type == 'FILL':
+                portfolio.update_fill(event, verbose=False)
+    return time.perf_counter() - start
+
+
+def main(n_bars=N_BARS):
+    n_events = n_bars + 3 * (n_bars // SIGNAL_EVERY)
+    print(f'{n_bars} bars, {n_events} events')
+    print(f'{"loop":<28}{"s":>8}{"events/s":>12}')
+    for name, run in [('queue.Queue, if/elif', run_legacy),
+                      ('EventDispatcher, deque', lambda n: run_dispatcher(n, thread_safe=False)),
+                      ('EventDispatcher, Queue', lambda n: run_dispatcher(n, thread_safe=True))]:
+        seconds = run(n_bars)
+        print(f'{name:<28}{seconds:>8.3f}{n_events / seconds:>12.0f}')
+
+    candles = generate_candles(n_bars // 4, INTERVAL)
+    legacy_seconds = run_backtest(candles, legacy=True)
+    seconds = run_backtest(candles, legacy=False)
+    print(f'backtest of {len(candles)} bars: old loop {legacy_seconds:.2f} s, EventDispatcher {seconds:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Execution handlers.
+Backtest: the same EMA backtest filled at the signal close (SimulatedExecutionHandler) and with orders in flight
+(LatencyExecutionHandler) under several latency distributions and slippage models, how much of the return
+survives and what it costs in bars per second. Synthetic candles open at the previous close, so filling at the next
+open without slippage gives the same results as filling at the signal close.
+Live: LiveExecutionHandler against the order endpoint of mock_exchange.MockExchange on localhost, N_ORDERS fired at
+once through a pool of MAX_CONNECTIONS connections, rate limited below the exchange's limit: orders per second,
+latency p50 / p99, largest number of orders the exchange had in flight and orders it rejected.
+Live part needs aiohttp.
+Run: python -m benchmarks.bench_execution
+"""
+import time
+
+import numpy as np
+
+import backtesting
+import data
+import dispatcher
+import events
+import execution
+import mock_exchange
+import strategy
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles
+
+N_BARS = 50000
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2030 00:00:00'
+
+EXECUTORS = [
+    ('fill at signal close', None),
+    ('next open, no latency', lambda events_queue: execution.LatencyExecutionHandler(events_queue)),
+    ('lognormal 200 ms, 10% of range', lambda events_queue: execution.LatencyExecutionHandler(
+        events_queue, latency=execution.lognormal_latency(200), slippage=execution.NextBarSlippage(0.1), seed=0)),
+    ('uniform 0-2 bars, 0-50% of range', lambda events_queue: execution.LatencyExecutionHandler(
+        events_queue, latency=execution.uniform_latency(0, 2 * hlp.interval_to_milliseconds(INTERVAL)),
+        slippage=execution.NextBarSlippage(0.5, randomize=True), seed=0)),
+]
+
+N_ORDERS = 200
+MAX_CONNECTIONS = 10
+ORDER_DELAY = 0.1  # seconds the mock exchange takes per order
+EXCHANGE_RATE_LIMIT = 100  # orders per second
+RATE_LIMIT = 80
+API_KEY, API_SECRET = 'key', 'secret'
+
+
+def bench_backtests(candles):
+    print(f'backtest, {len(candles)} bars of {INTERVAL}')
+    print(f'{"execution":<34}{"total return, %":>16}{"sharpe":>8}{"bars/s":>10}')
+    for name, executor_factory in EXECUTORS:
+        backtester = backtesting.BackTester(strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), 10, 50),
+                                            SYMBOL, INTERVAL)
+        start = time.perf_counter()
+        results = backtester.run_test(START, END, print_results=False, imported_data=candles,
+                                      executor_factory=executor_factory)
+        seconds = time.perf_counter() - start
+        print(f'{name:<34}{results["total_return"]:>16.2f}{results["sharpe_ratio"]:>8.2f}'
+              f'{len(candles) / seconds:>10.0f}')
+
+
+def bench_live(candles):
+    exchange = mock_exchange.MockExchange(candles, SYMBOL, INTERVAL, closed_at_start=len(candles),
+                                          api_key=API_KEY, api_secret=API_SECRET, order_delay=ORDER_DELAY,
+                                          order_rate_limit=EXCHANGE_RATE_LIMIT)
+    exchange.start_in_thread()
+    events_queue = dispatcher.EventDispatcher(thread_safe=True)
+    fills = []
+    events_queue.register(events.FillEvent, fills.append)
+    executor = execution.LiveExecutionHandler(events_queue, API_KEY, API_SECRET, rest_url=exchange.rest_url,
+                                              max_connections=MAX_CONNECTIONS, rate_limit=RATE_LIMIT)
+    executor.start()
+    try:
+        start = time.perf_counter()
+        for i in range(N_ORDERS):
+            quantity = 0.01 if i % 2 == 0 else -0.01
+            executor.execute_order(events.OrderEvent(SYMBOL, i, events.OrderType.MKT, quantity, 100.))
+        while len(fills) + len(executor.failed) < N_ORDERS:
+            events_queue.dispatch(block=True, timeout=1.)
+        seconds = time.perf_counter() - start
+    finally:
+        executor.close()
+        exchange.stop_thread()
+
+    latencies = np.array(executor.latencies) * 1000
+    print(f'live, {N_ORDERS} orders fired at once, {MAX_CONNECTIONS} connections, {RATE_LIMIT} requests/s, '
+          f'exchange: {ORDER_DELAY * 1000:.0f} ms per order, {EXCHANGE_RATE_LIMIT} orders/s')
+    print(f'filled {len(fills)}, failed {len(executor.failed)} in {seconds:.2f} s, {len(fills) / seconds:.0f} orders/s')
+    print(f'latency, ms: p50 {np.percentile(latencies, 50):.1f}, p99 {np.percentile(latencies, 99):.1f}')
+    print(f'exchange: max orders in flight {exchange.max_concurrent_orders}, rejected for rate limit '
+          f'{exchange.rejected}')
+
+
+def main():
+    candles = data.CandleDataset.from_candles(generate_candles(N_BARS, INTERVAL))
+    bench_backtests(candles)
+    bench_live(candles)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Optimizer.optimize_ema (event engine) through job_queue on this machine: a local broker and local worker processes
+stand in for a broker and workers on other nodes. The same grid is run serially, with a local process pool and
+through the job queue, once more with a worker killed in the middle of the sweep: its job goes to another worker
+when the heartbeats stop. Prints times and retries, tests/test_job_queue.py checks that the records are the same.
+Run: python -m benchmarks.bench_job_queue
+"""
+import threading
+import time
+
+import data
+import job_queue
+import optimization
+import strategy
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+PARAM_RANGES = {'fast': (2, 60), 'slow': (10, 200)}
+N_POINTS = 6
+N_WORKERS = 4
+LEASE_TIMEOUT = 2.
+HEARTBEAT_INTERVAL = 0.5
+
+
+def run(dataset, n_workers=1, queue=None):
+    optimizer = optimization.Optimizer(SYMBOL, INTERVAL, job_queue=queue)
+    start = time.perf_counter()
+    records = optimizer.optimize_ema(strategy.EMAStrategy, START, END, PARAM_RANGES, n_points=N_POINTS,
+                                     engine='event', n_workers=n_workers, imported_data=dataset, draw=False,
+                                     verbose=False)
+    return records, time.perf_counter() - start
+
+
+def main(n_bars=10000):
+    dataset = data.CandleDataset.from_candles(generate_candles(n_bars, INTERVAL))
+    serial, serial_time = run(dataset)
+    print(f'{n_bars} candles, {len(serial)} grid points, {N_WORKERS} workers')
+    print(f'{"run":<28}{"time, s":>9}{"retried":>9}')
+    print(f'{"serial":<28}{serial_time:>9.2f}{"":>9}')
+    _, pool_time = run(dataset, n_workers=N_WORKERS)
+    print(f'{"process pool":<28}{pool_time:>9.2f}{"":>9}')
+
+    broker = job_queue.start_broker(lease_timeout=LEASE_TIMEOUT)
+    try:
+        queue = job_queue.JobQueue(broker.address, broker.authkey, poll_interval=0.1)
+        workers = job_queue.start_workers(N_WORKERS, broker.address, broker.authkey,
+                                          heartbeat_interval=HEARTBEAT_INTERVAL)
+        _, elapsed = run(dataset, queue=queue)
+        retried = queue.broker.stats()['retried']
+        print(f'{"job queue":<28}{elapsed:>9.2f}{retried:>9}')
+
+        # a worker dies in the middle of the sweep, without a word to the broker
+        killer = threading.Timer(serial_time / 4, workers[0].kill)
+        killer.start()
+        _, elapsed = run(dataset, queue=queue)
+        killer.join()
+        retried = queue.broker.stats()['retried'] - retried
+        print(f'{"job queue, a worker killed":<28}{elapsed:>9.2f}{retried:>9}')
+    finally:
+        broker.shutdown()
+
+
+if __name__ == '__main__':
+    main()
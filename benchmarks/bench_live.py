@@ -0,0 +1,103 @@
+"""
+Live data path against mock_exchange.MockExchange on localhost: LiveDataHandler backfills the history, then
+receives candles from the kline stream, which the exchange drops every DISCONNECT_EVERY candles. Every bar goes
+through the event loop of a backtest (EMAStrategy, NaivePortfolio, SimulatedExecutionHandler).
+Reports the latency from the exchange sending a candle to the system having handled it (p50, p99),
+checks no candle is missed or fed twice across reconnects and counts reconnects and batches of several bars.
+Needs aiohttp.
+Run: python -m benchmarks.bench_live
+"""
+import time
+
+import numpy as np
+
+import backtesting
+import buffer as buffer_module
+import data
+import dispatcher
+import events
+import execution
+import mock_exchange
+import portfolio as portfolio_module
+import strategy
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles
+
+N_BARS = 2000
+HISTORY = 500  # candles closed before the start, backfilled
+BAR_DELAY = 0.002
+DISCONNECT_EVERY = 300
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1m'
+IDLE_TIMEOUT = 2.  # seconds without a bar after the last candle before giving up
+
+
+def main(n_bars=N_BARS):
+    candles = generate_candles(HISTORY + n_bars, INTERVAL)
+    exchange = mock_exchange.MockExchange(candles, SYMBOL, INTERVAL, bar_delay=BAR_DELAY, closed_at_start=HISTORY,
+                                          disconnect_every=DISCONNECT_EVERY)
+    exchange.start_in_thread()
+
+    interval_ts = hlp.interval_to_milliseconds(INTERVAL)
+    start_ts = int(exchange.dataset.values[0, 0])
+    events_queue = dispatcher.EventDispatcher()
+    buffer = buffer_module.DataBuffer(SYMBOL, interval_ts=interval_ts)
+    data_handler = data.LiveDataHandler(events_queue, buffer, SYMBOL, INTERVAL, backfill_from=start_ts,
+                                        rest_url=exchange.rest_url, stream_url=exchange.stream_url,
+                                        reconnect_delay=0.01)
+    ema_strategy = strategy.EMAStrategy(interval_ts, 10, 50)
+    portfolio = portfolio_module.NaivePortfolio(events_queue, buffer, SYMBOL, initial_capital=10000, bet_size=1,
+                                                start_ts=start_ts)
+    executor = execution.SimulatedExecutionHandler(events_queue)
+    backtesting.register_handlers(events_queue, SYMBOL, ema_strategy, buffer, portfolio, executor)
+
+    # registered last: called once the strategy and the portfolio have handled the bars
+    handled_at = {}
+    batches = []
+
+    def on_market(event):
+        now = time.perf_counter()
+        bars = event.new_data if isinstance(event.new_data, list) else [event.new_data]
+        if len(bars) > 1:
+            batches.append(len(bars))
+        for bar in bars:
+            handled_at.setdefault(bar['close_time'], []).append(now)
+
+    events_queue.register(events.MarketEvent, on_market)
+
+    data_handler.start()
+    idle_since = None
+    try:
+        while True:
+            n_handled = len(handled_at)
+            data_handler.update_bars(timeout=0.1)
+            events_queue.dispatch()
+            if len(handled_at) > n_handled or not exchange.finished:
+                idle_since = None
+            elif idle_since is None:
+                idle_since = time.perf_counter()
+            elif time.perf_counter() - idle_since > IDLE_TIMEOUT:
+                break
+    finally:
+        data_handler.close()
+        exchange.stop_thread()
+
+    expected = exchange.dataset.close_time.astype(np.int64).tolist()
+    received = sorted(handled_at)
+    duplicates = sum(len(times) - 1 for times in handled_at.values())
+    missing = len(set(expected) - set(received))
+    latencies = np.array([handled_at[ts][0] - sent for ts, sent in exchange.sent_at.items() if ts in handled_at])
+
+    print(f'{HISTORY} candles backfilled, {n_bars} streamed every {BAR_DELAY * 1000:.0f} ms, '
+          f'stream dropped every {DISCONNECT_EVERY} candles')
+    print(f'received {len(received)}/{len(expected)} candles, missing: {missing}, duplicates: {duplicates}, '
+          f'in order: {received == expected}')
+    print(f'reconnects: {data_handler.reconnects}, multi-bar batches: {len(batches)} '
+          f'(sizes {batches[:10]}{"..." if len(batches) > 10 else ""})')
+    # candles sent while the stream was down count from their sending, so the reconnects are in the tail
+    print(f'latency sent -> handled, ms: p50 {np.percentile(latencies, 50) * 1000:.2f}, '
+          f'p99 {np.percentile(latencies, 99) * 1000:.2f}, max {latencies.max() * 1000:.2f}')
+
+
+if __name__ == '__main__':
+    main()
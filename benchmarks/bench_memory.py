@@ -0,0 +1,113 @@
+"""
+Memory allocated per bar by the objects the event loop creates: the bar fed by the data handler, its MarketEvent
+and, every SIGNAL_EVERY bars, a SignalEvent, OrderEvent and FillEvent. Compares the old dict bars, events with
+an instance dict and signal lists of strings against data.Bar, __slots__ events and shared Signal code tuples.
+All the objects are kept alive (like an event log), tracemalloc measures what they take.
+Run: python -m benchmarks.bench_memory
+"""
+import gc
+import time
+import tracemalloc
+
+import data
+import events
+from benchmarks.synthetic import generate_candles
+
+N_BARS = 1000000
+SIGNAL_EVERY = 10
+SYMBOL = 'BTCUSDT'
+
+
+# events as they were before __slots__ and Signal codes
+class LegacyMarketEvent():
+    def __init__(self, new_data):
+        self.type = 'MARKET'
+        self.new_data = new_data
+
+
+class LegacySignalEvent():
+    def __init__(self, symbol, bar_close_time, signal, last_close_price):
+        self.type = 'SIGNAL'
+        self.symbol = symbol
+        self.bar_close_time = bar_close_time
+        self.signal = signal
+        self.last_close_price = last_close_price
+
+
+class LegacyOrderEvent():
+    def __init__(self, symbol, datetime, order_type, quantity, last_close_price):
+        self.type = 'ORDER'
+        self.symbol = symbol
+        self.datetime = datetime
+        self.order_type = order_type
+        self.quantity = quantity
+        self.last_close_price = last_close_price
+
+
+class LegacyFillEvent():
+    def __init__(self, time_executed, bar_close_time, symbol, exchange, quantity, price_filled, commission):
+        self.type = 'FILL'
+        self.time_executed = time_executed
+        self.bar_close_time = bar_close_time
+        self.symbol = symbol
+        self.exchange = exchange
+        self.quantity = quantity
+        self.price_filled = price_filled
+        self.commission = commission
+
+
+def legacy_get_bar(dataset, i) -> dict:
+    # CandleDataset.get_bar before data.Bar
+    bar = dataset.values[i].tolist()
+    for field in data.INT_FIELDS:
+        bar[field] = int(bar[field])
+    return dict(zip(data.CANDLE_FIELDS, bar))
+
+
+def replay(dataset, legacy) -> tuple:
+    """
+    :return: traced memory kept by the objects, peak traced memory (bytes) and time (s)
+    """
+    if legacy:
+        get_bar, market_event = legacy_get_bar, LegacyMarketEvent
+        signal_event, order_event, fill_event = LegacySignalEvent, LegacyOrderEvent, LegacyFillEvent
+    else:
+        get_bar, market_event = data.CandleDataset.get_bar, events.MarketEvent
+        signal_event, order_event, fill_event = events.SignalEvent, events.OrderEvent, events.FillEvent
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    log = []
+    for i in range(len(dataset)):
+        bar = get_bar(dataset, i)
+        log.append(market_event(bar))
+        if i % SIGNAL_EVERY == 0:
+            signal = ['EXIT', 'LONG'] if legacy else events.EXIT_LONG
+            order_type = 'MKT' if legacy else events.OrderType.MKT
+            close_time, close = bar['close_time'], bar['close']
+            log.append(signal_event(SYMBOL, close_time, signal, close))
+            log.append(order_event(SYMBOL, close_time, order_type, 1.5, close))
+            log.append(fill_event(close_time, close_time, SYMBOL, 'Binance', 1.5, close, 0.1))
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del log
+    gc.collect()
+    return current, peak, seconds
+
+
+def main(n_bars=N_BARS):
+    dataset = data.CandleDataset.from_candles(generate_candles(n_bars, '1m'))
+    print(f'{n_bars} bars, signal, order and fill every {SIGNAL_EVERY} bars')
+    print(f'{"objects":<26}{"kept, MB":>10}{"peak, MB":>10}{"bytes/bar":>11}{"s":>7}')
+    results = {}
+    for name, legacy in [('dicts, lists of str', True), ('Bar, __slots__, codes', False)]:
+        current, peak, seconds = replay(dataset, legacy)
+        results[legacy] = current
+        print(f'{name:<26}{current / 2 ** 20:>10.0f}{peak / 2 ** 20:>10.0f}{current / n_bars:>11.0f}{seconds:>7.2f}')
+    print(f'{100 * (1 - results[False] / results[True]):.0f}% less memory per bar')
+
+
+if __name__ == '__main__':
+    main()
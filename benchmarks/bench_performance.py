@@ -0,0 +1,83 @@
+"""
+Cost of the watermark / drawdown part of performance.calculate_performance as the number of bars grows.
+The old implementation walked the bars in a python loop with scalar lookups, performance.calculate_drawdowns
+does it with running maximum array operations, tests/test_performance.py checks that both give the same results.
+Also times the whole calculate_performance on a vectorized backtest.
+Run: python -m benchmarks.bench_performance
+"""
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import backtesting
+import performance
+import strategy
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles, START_TS
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1m'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+SIZES = [1000, 10000, 100000, 1000000]
+LEGACY_MAX_SIZE = 100000  # the old loop gets too slow to measure beyond this
+
+
+def legacy_drawdowns(total: pd.Series) -> tuple:
+    # the loop calculate_performance used before calculate_drawdowns was added
+    water_mark = total[0]
+    wms = []
+    max_duration = timedelta(0)
+    last_peak_time = total.index[0]
+    for i in total.index:
+        cur_total = total[i]
+        if cur_total >= water_mark:
+            wms.append(cur_total)
+            water_mark = cur_total
+            max_duration = max(max_duration, i - last_peak_time)
+            last_peak_time = i
+        else:
+            wms.append(water_mark)
+    max_duration = max(max_duration, total.index[-1] - last_peak_time)
+    return np.array(wms), max_duration
+
+
+def balance_series(n_bars, seed=0) -> pd.Series:
+    # balance of a strategy: flat between trades, with a random step at every trade
+    rng = np.random.default_rng(seed)
+    steps = np.where(rng.random(n_bars) < 0.01, rng.normal(0.001, 0.02, n_bars), 0.)
+    total = 10000 * np.exp(np.cumsum(steps))
+    index = pd.to_datetime(START_TS + np.arange(n_bars) * hlp.interval_to_milliseconds(INTERVAL), unit='ms')
+    return pd.Series(total, index=index)
+
+
+def time_call(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    print(f'{"bars":>9}{"drawdowns, s":>14}{"legacy, s":>11}{"speedup":>9}{"calculate_performance, s":>26}')
+    for size in SIZES:
+        total = balance_series(size)
+        _, new_time = time_call(performance.calculate_drawdowns, total)
+
+        legacy = speedup = ''
+        if size <= LEGACY_MAX_SIZE:
+            _, legacy_time = time_call(legacy_drawdowns, total)
+            legacy, speedup = f'{legacy_time:.3f}', f'{legacy_time / new_time:.0f}'
+
+        ema_strategy = strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), 50, 200)
+        backtester = backtesting.BackTester(ema_strategy, SYMBOL, INTERVAL)
+        backtester.run_vectorized(START, END, print_results=False,
+                                  imported_data=generate_candles(size, INTERVAL))
+        _, perf_time = time_call(performance.calculate_performance, backtester.buffer, INTERVAL, 10000)
+
+        print(f'{size:>9}{new_time:>14.4f}{legacy:>11}{speedup:>9}{perf_time:>26.3f}')
+
+
+if __name__ == '__main__':
+    main()
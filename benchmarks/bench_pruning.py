@@ -0,0 +1,58 @@
+"""
+Optimizer.optimize_ema with the event engine on the same synthetic candles, without pruning and with
+optimization.Pruner rules of growing aggressiveness. Reports the number of pruned runs, time, speedup and
+whether the winner (Optimizer.best_record) is the one of the full grid. Pruning is a heuristic, narrower margins
+than these (e.g. 100) changed the winner.
+Run: python -m benchmarks.bench_pruning
+"""
+import time
+
+import data
+import optimization
+import strategy
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+PARAM_RANGES = {'fast': (2, 60), 'slow': (10, 200)}
+N_POINTS = 8
+PRUNERS = {
+    'max drawdown -90%': optimization.Pruner(margin=None),
+    'max drawdown -75%': optimization.Pruner(max_drawdown=-75., margin=None),
+    'default, margin 300': optimization.Pruner(),
+    'margin 200, from 60%': optimization.Pruner(margin=200., min_progress=0.6),
+}
+
+
+def run(dataset, prune, n_workers):
+    optimizer = optimization.Optimizer(SYMBOL, INTERVAL)
+    start = time.perf_counter()
+    records = optimizer.optimize_ema(strategy.EMAStrategy, START, END, PARAM_RANGES, n_points=N_POINTS,
+                                     engine='event', n_workers=n_workers, imported_data=dataset, draw=False,
+                                     verbose=False, prune=prune)
+    elapsed = time.perf_counter() - start
+    try:
+        best = optimization.Optimizer.best_record(records)
+        winner = (best['fast'], best['slow'])
+    except optimization.NoFinishedRun:
+        winner = None
+    return sum(bool(record.get('pruned')) for record in records), elapsed, winner
+
+
+def main(n_bars=10000, n_workers=1):
+    dataset = data.CandleDataset.from_candles(generate_candles(n_bars, INTERVAL))
+    _, full_time, full_winner = run(dataset, None, n_workers)
+    print(f'{n_bars} candles, grid of {N_POINTS} points per parameter, {n_workers} worker(s), '
+          f'winner {full_winner}')
+    print(f'{"pruning":<24}{"pruned":>8}{"time, s":>9}{"speedup":>9}{"same winner":>13}')
+    print(f'{"none":<24}{0:>8}{full_time:>9.2f}{1:>9.2f}{"yes":>13}')
+    for name, prune in PRUNERS.items():
+        n_pruned, elapsed, winner = run(dataset, prune, n_workers)
+        same = 'yes' if winner == full_winner else f'no {winner}'
+        print(f'{name:<24}{n_pruned:>8}{elapsed:>9.2f}{full_time / elapsed:>9.2f}{same:>13}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Optimizer.optimize_ema with every search backend on the same synthetic candles, vectorized engine.
+The full grid is the reference: each other backend gets about BUDGET_SHARE of its backtests and is reported with
+its time, the best af_score it found on all the candles and the rank that score would have in the grid.
+Every backend runs with a few seeds, the rank is their median.
+Run: python -m benchmarks.bench_search
+"""
+import time
+
+import numpy as np
+
+import data
+import optimization
+import search
+import strategy
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+PARAM_RANGES = {'fast': (2, 60), 'slow': (10, 200)}
+N_POINTS = 20
+BUDGET_SHARE = 0.15
+SEEDS = (0, 1, 2)
+
+
+def run(dataset, search_backend):
+    optimizer = optimization.Optimizer(SYMBOL, INTERVAL)
+    start = time.perf_counter()
+    records = optimizer.optimize_ema(strategy.EMAStrategy, START, END, PARAM_RANGES, engine='vectorized',
+                                     search=search_backend, imported_data=dataset, draw=False, verbose=False)
+    elapsed = time.perf_counter() - start
+    return len(records), elapsed, optimization.Optimizer.best_record(records)['af_score']
+
+
+def main(n_bars=20000):
+    dataset = data.CandleDataset.from_candles(generate_candles(n_bars, INTERVAL))
+    optimizer = optimization.Optimizer(SYMBOL, INTERVAL)
+    start = time.perf_counter()
+    grid = optimizer.optimize_ema(strategy.EMAStrategy, START, END, PARAM_RANGES, n_points=N_POINTS,
+                                  engine='vectorized', imported_data=dataset, draw=False, verbose=False)
+    grid_time = time.perf_counter() - start
+    grid_scores = np.sort([record['af_score'] for record in grid])[::-1]
+    budget = int(len(grid) * BUDGET_SHARE)
+
+    print(f'{n_bars} candles, grid of {N_POINTS} points per parameter, budget {budget} backtests')
+    print(f'{"search":<20}{"points":>8}{"time, s":>9}{"best af_score":>15}{"grid rank":>11}')
+    print(f'{"grid":<20}{len(grid):>8}{grid_time:>9.2f}{grid_scores[0]:>15.1f}{1:>11}')
+    backends = {
+        'random': lambda seed: search.RandomSearch(budget, seed=seed),
+        'successive halving': lambda seed: search.SuccessiveHalving(budget, seed=seed),
+        'TPE': lambda seed: search.TPESearch(budget, seed=seed),
+    }
+    for name, backend in backends.items():
+        runs = [run(dataset, backend(seed)) for seed in SEEDS]
+        n_runs, elapsed, best = (np.median(column) for column in zip(*runs))
+        # ties count in the backend's favour: rank of the first grid score not above the best found
+        ranks = [int(np.sum(grid_scores > score)) + 1 for _, _, score in runs]
+        print(f'{name:<20}{n_runs:>8.0f}{elapsed:>9.2f}{best:>15.1f}{int(np.median(ranks)):>11}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Runs EMAStrategy backtests with both engines, BackTester.run_test (event driven) and BackTester.run_vectorized,
+on the same synthetic candles and prints the speedup. tests/test_vectorized.py checks that they give the same results.
+Run: python -m benchmarks.bench_vectorized
+"""
+import time
+
+import backtesting
+import strategy
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+PARAMS = [(2, 7), (5, 20), (10, 50), (30, 31), (50, 200)]
+
+
+def run(engine, fast, slow, candles):
+    ema_strategy = strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), fast, slow)
+    backtester = backtesting.BackTester(ema_strategy, SYMBOL, INTERVAL)
+    start = time.perf_counter()
+    getattr(backtester, engine)(START, END, print_results=False, imported_data=list(candles))
+    elapsed = time.perf_counter() - start
+    return backtester.buffer.get_all_data()['price_filled'].notna().sum(), elapsed
+
+
+def main(n_bars=20000, seeds=(0, 1, 2)):
+    print(f'{"seed":>4}{"fast":>6}{"slow":>6}{"trades":>8}{"event, s":>10}{"vectorized, s":>15}{"speedup":>9}')
+    for seed in seeds:
+        candles = generate_candles(n_bars, INTERVAL, seed=seed, missing_every=97)
+        for fast, slow in PARAMS:
+            n_trades, event_time = run('run_test', fast, slow, candles)
+            _, vec_time = run('run_vectorized', fast, slow, candles)
+            print(f'{seed:>4}{fast:>6}{slow:>6}{n_trades:>8}{event_time:>10.2f}{vec_time:>15.3f}'
+                  f'{event_time / vec_time:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
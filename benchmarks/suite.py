@@ -0,0 +1,163 @@
+"""
+Benchmark suite on synthetic candles, no database needed: end-to-end BackTester.run_test throughput,
+BackTester.run_vectorized, Optimizer.optimize_ema grid time, calculate_performance and buffer operations,
+at 10k, 100k and 1M bars. Results are saved as JSON in benchmarks/results, one file per run,
+so that runs of different commits can be compared.
+Run: python -m benchmarks.suite [--sizes 10000 100000] [--out path.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import backtesting
+import buffer as buffer_module
+import data
+import optimization
+import performance
+import strategy
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles
+
+SIZES = [10000, 100000, 1000000]
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1m'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+FAST, SLOW = 10, 50
+GRID = {'fast': (5, 20), 'slow': (30, 100)}
+GRID_POINTS = 3
+EVENT_GRID_MAX_SIZE = 100000  # grid through the event engine takes too long beyond this
+N_LOOKUPS = 20000
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def timed(func, *args, **kwargs) -> tuple:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_run_test(candles, columnar_buffer) -> dict:
+    ema_strategy = strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), FAST, SLOW)
+    backtester = backtesting.BackTester(ema_strategy, SYMBOL, INTERVAL, columnar_buffer=columnar_buffer)
+    _, seconds = timed(backtester.run_test, START, END, print_results=False, imported_data=candles)
+    return {'seconds': seconds, 'bars_per_sec': len(candles) / seconds}
+
+
+def bench_run_vectorized(candles) -> dict:
+    ema_strategy = strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), FAST, SLOW)
+    backtester = backtesting.BackTester(ema_strategy, SYMBOL, INTERVAL)
+    _, seconds = timed(backtester.run_vectorized, START, END, print_results=False, imported_data=candles)
+    return {'seconds': seconds, 'bars_per_sec': len(candles) / seconds}
+
+
+def bench_optimize(candles, engine) -> dict:
+    optimizer = optimization.Optimizer(SYMBOL, INTERVAL)
+    with contextlib.redirect_stdout(io.StringIO()):  # optimize_ema prints every grid point
+        results, seconds = timed(optimizer.optimize_ema, strategy.EMAStrategy, START, END, GRID,
+                                 n_points=GRID_POINTS, engine=engine, draw=False, imported_data=candles)
+    return {'seconds': seconds, 'grid_points': len(results), 'seconds_per_point': seconds / max(len(results), 1)}
+
+
+def bench_performance(candles) -> dict:
+    ema_strategy = strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), FAST, SLOW)
+    backtester = backtesting.BackTester(ema_strategy, SYMBOL, INTERVAL)
+    backtester.run_vectorized(START, END, print_results=False, imported_data=candles)
+    _, seconds = timed(performance.calculate_performance, backtester.buffer, INTERVAL, backtester.initial_capital)
+    return {'seconds': seconds}
+
+
+def bench_buffer(buffer_class, n_bars) -> dict:
+    interval_ts = hlp.interval_to_milliseconds(INTERVAL)
+    buffer = buffer_class(SYMBOL, interval_ts=interval_ts)
+    bars = [{'close_time': i * interval_ts, 'close': float(i), 'volume': 1.} for i in range(n_bars)]
+    _, append_seconds = timed(lambda: [buffer.append_data(bar) for bar in bars])
+
+    rnd = random.Random(0)
+    hits = [rnd.randrange(n_bars) * interval_ts for _ in range(N_LOOKUPS)]
+    misses = [ts + interval_ts // 2 for ts in hits]
+    _, hit_seconds = timed(lambda: [buffer.get_item_by_timestamp(ts) for ts in hits])
+    _, miss_seconds = timed(lambda: [buffer.get_item_by_timestamp(ts) for ts in misses])
+    _, frame_seconds = timed(buffer.get_all_data)
+    return {
+        'append_us': append_seconds / n_bars * 1e6,
+        'lookup_hit_us': hit_seconds / N_LOOKUPS * 1e6,
+        'lookup_miss_us': miss_seconds / N_LOOKUPS * 1e6,
+        'get_all_data_seconds': frame_seconds,
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_suite(sizes=SIZES) -> dict:
+    results = {}
+    for n_bars in sizes:
+        candles = data.CandleDataset.from_candles(generate_candles(n_bars, INTERVAL))
+        size_results = {
+            'run_test': bench_run_test(candles, columnar_buffer=False),
+            'run_test_columnar': bench_run_test(candles, columnar_buffer=True),
+            'run_vectorized': bench_run_vectorized(candles),
+            'optimize_ema_vectorized': bench_optimize(candles, 'vectorized'),
+            'calculate_performance': bench_performance(candles),
+            'buffer': bench_buffer(buffer_module.DataBuffer, n_bars),
+            'columnar_buffer': bench_buffer(buffer_module.ColumnarDataBuffer, n_bars),
+        }
+        if n_bars <= EVENT_GRID_MAX_SIZE:
+            size_results['optimize_ema_event'] = bench_optimize(candles, 'event')
+        results[n_bars] = size_results
+        print_results(n_bars, size_results)
+    return {'environment': environment(), 'results': results}
+
+
+def print_results(n_bars, size_results):
+    print(f'--- {n_bars} bars')
+    for name, metrics in size_results.items():
+        print(f'{name:<26}' + ', '.join(f'{key}: {value:.4g}' for key, value in metrics.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numbers of bars')
+    parser.add_argument('--out', help='json file to save results to, default: benchmarks/results/<time>_<commit>.json')
+    args = parser.parse_args()
+
+    report = run_suite(args.sizes)
+
+    path = args.out
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(RESULTS_DIR, f'{stamp}_{report["environment"]["commit"] or "unknown"}.json')
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'results saved to {path}')
+
+
+if __name__ == '__main__':
+    main()
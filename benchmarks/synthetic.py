@@ -0,0 +1,48 @@
+"""
+Deterministic synthetic candles, laid out like the tuples binance_sql get_candles returns,
+so backtests can be run without a database.
+"""
+import numpy as np
+
+import btb_helpers as hlp
+
+START_TS = 1546300800000  # 01-Jan-2019 00:00:00 UTC
+
+
+def generate_candles(n_bars, interval='1h', start_ts=START_TS, seed=0, missing_every=None,
+                     reversed_order=True) -> list:
+    """
+    Random walk prices (geometric brownian motion) with plausible highs, lows and volumes.
+    :param n_bars: number of candles
+    :param interval: Binance interval string, e.g. '1m', '1h', '1d'
+    :param start_ts: open time of the first candle, ms
+    :param seed: same seed gives the same candles
+    :param missing_every: if set, every n-th candle is a missing one (negative values, as stored by binance_sql)
+    :param reversed_order: desc order, the way HistoricDataHandler expects them
+    :return: a list of tuples (open_time, open, high, low, close, volume, close_time,
+     quote_vol, num_trades, buy_base_vol, buy_quote_vol)
+    """
+    rng = np.random.default_rng(seed)
+    interval_ts = hlp.interval_to_milliseconds(interval)
+
+    close = 100 * np.exp(np.cumsum(rng.normal(0.00005, 0.01, n_bars)))
+    open_ = np.concatenate([[100.], close[:-1]])
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.005, n_bars))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.005, n_bars))
+    volume = rng.uniform(10, 1000, n_bars)
+    quote_vol = volume * close
+    num_trades = rng.integers(10, 5000, n_bars)
+    buy_share = rng.uniform(0.3, 0.7, n_bars)
+    open_time = start_ts + interval_ts * np.arange(n_bars, dtype=np.int64)
+    close_time = open_time + interval_ts - 1
+
+    candles = list(zip(open_time.tolist(), open_.tolist(), high.tolist(), low.tolist(), close.tolist(),
+                       volume.tolist(), close_time.tolist(), quote_vol.tolist(), num_trades.tolist(),
+                       (volume * buy_share).tolist(), (quote_vol * buy_share).tolist()))
+    if missing_every:
+        for i in range(missing_every - 1, n_bars, missing_every):
+            candles[i] = (candles[i][0], -1, -1, -1, -1, -1, candles[i][6], -1, -1, -1, -1)
+
+    if reversed_order:
+        candles.reverse()
+    return candles
@@ -57,6 +57,13 @@ def date_to_milliseconds(date_str):
     # return the difference in time
     return int((d - epoch).total_seconds() * 1000.0)
 
+def milliseconds_to_date(timestamp) -> str:
+    """
+    Inverse of date_to_milliseconds, down to the second
+    :return: UTC date like '01-Mar-2019 00:00:00'
+    """
+    return datetime.utcfromtimestamp(timestamp / 1000).strftime('%d-%b-%Y %H:%M:%S')
+
 def span_to_list(span: tuple, n_points) -> list:
     """
     transforms a range(span) into a list of n points evenly distributed within the range
@@ -1,6 +1,6 @@
 from abc import ABCMeta, abstractmethod
+from bisect import bisect_left, bisect_right
 import collections
-import time
 
 import pandas as pd
 import numpy as np
@@ -9,6 +9,93 @@ import mplfinance as mpf
 import events
 
 
+class TimeIndex():
+    """
+    Keeps the timestamps of the buffer sorted and maps them to bar numbers (order of appending).
+    While the series is regular (every timestamp is interval_ts after the previous one) the position
+    of a timestamp is found by arithmetic, otherwise (gaps, unknown interval) by bisection.
+    """
+
+    def __init__(self, interval_ts=None):
+        self.interval_ts = interval_ts
+        self.positions = {}  # timestamp -> bar number
+        self.timestamps = []  # sorted
+        self.bars = []  # bar numbers, in the order of self.timestamps
+        self.regular = bool(interval_ts)
+        self.ordered = True  # bars were appended in time order, so bar number == position
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def add(self, timestamp) -> int:
+        """
+        Registers a new timestamp, returns its bar number
+        """
+        bar = len(self.timestamps)
+        self.positions[timestamp] = bar
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            pos = bisect_right(self.timestamps, timestamp)
+            self.timestamps.insert(pos, timestamp)
+            self.bars.insert(pos, bar)
+            self.regular = False
+            self.ordered = False
+        else:
+            if self.timestamps and timestamp - self.timestamps[-1] != self.interval_ts:
+                self.regular = False
+            self.timestamps.append(timestamp)
+            self.bars.append(bar)
+        return bar
+
+    def extend(self, timestamps) -> range:
+        """
+        Registers new timestamps, all later than the ones already in the index, in asc order
+        :return: their bar numbers
+        """
+        timestamps = [int(ts) for ts in timestamps]
+        if not timestamps:
+            return range(len(self.timestamps), len(self.timestamps))
+        if (self.timestamps and timestamps[0] <= self.timestamps[-1]) or np.any(np.diff(timestamps) <= 0):
+            raise ValueError('TimeIndex.extend expects new timestamps in asc order')
+
+        if self.regular:
+            steps = np.diff(self.timestamps[-1:] + timestamps)
+            self.regular = bool(np.all(steps == self.interval_ts))
+        bars = range(len(self.timestamps), len(self.timestamps) + len(timestamps))
+        self.positions.update(zip(timestamps, bars))
+        self.timestamps.extend(timestamps)
+        self.bars.extend(bars)
+        return bars
+
+    def get(self, timestamp):
+        """
+        :return: bar number of the exact timestamp, None if not in the index
+        """
+        return self.positions.get(timestamp)
+
+    def position_at_or_before(self, timestamp) -> int:
+        """
+        :return: position (in sorted timestamps) of the latest timestamp <= timestamp, -1 if there is none
+        """
+        if not self.timestamps or timestamp < self.timestamps[0]:
+            return -1
+        if self.regular:
+            return min(int((timestamp - self.timestamps[0]) // self.interval_ts), len(self.timestamps) - 1)
+        return bisect_right(self.timestamps, timestamp) - 1
+
+    def positions_between(self, start_ts, end_ts) -> tuple:
+        """
+        :return: (first, last + 1) positions of timestamps within [start_ts, end_ts]
+        """
+        if self.regular and self.timestamps:
+            first = self.timestamps[0]
+            lo = max(0, -((first - start_ts) // self.interval_ts))  # ceil division
+            lo = min(int(lo), len(self.timestamps))
+        else:
+            lo = bisect_left(self.timestamps, start_ts)
+        hi = self.position_at_or_before(end_ts) + 1
+        return lo, max(lo, hi)
+
+
 class DataBuffer():
     """
     This buffer is used to store data as a log during backtest run or live trading.
@@ -16,20 +103,25 @@ class DataBuffer():
     The buffer itself is a dict of dicts. Outer dict keys are timestamps, inner dicts contain the data.
     """
 
-    def __init__(self, symbol, max_size=None):
+    def __init__(self, symbol, max_size=None, interval_ts=None):
         """
         :param max_size: maximum length of buffer in MB?
+        :param interval_ts: candle interval in ms, lets the time index locate bars by arithmetic
         """
         self.buffer = {}
         self.symbol = symbol
+        self.time_index = TimeIndex(interval_ts)
 
-    def append_data(self, new_data: dict):
+    def append_data(self, new_data):
         """
-        :param new_data: dict with timestamp key, named 'close_time' (time of closure of the last candle)
+        :param new_data: dict with timestamp key, named 'close_time' (time of closure of the last candle),
+        or a list of such dicts
         :return:
         """
-        # TODO new_data can be a list of dicts
-        start = time.perf_counter()
+        if isinstance(new_data, list):
+            for item in new_data:
+                self.append_data(item)
+            return
 
         new_data_time = new_data['close_time']
 
@@ -38,18 +130,45 @@ class DataBuffer():
             self.buffer[new_data_time] = {**self.buffer[new_data_time], **new_data}
 
         else:
-            self.buffer[new_data_time] = new_data
+            # bars from data handlers are data.Bar mappings, the buffer keeps dicts
+            self.buffer[new_data_time] = new_data if type(new_data) is dict else dict(new_data)
+            self.time_index.add(new_data_time)
+
+    def append_columns(self, close_time, columns: dict):
+        """
+        Merges data for many bars at once, same result as calling append_data for each bar.
+        :param close_time: array of bar timestamps
+        :param columns: dict of field name -> array of values, same length as close_time
+        """
+        names = list(columns)
+        values = [np.asarray(columns[name]).tolist() for name in names]
+        for i, timestamp in enumerate(np.asarray(close_time).tolist()):
+            item = {'close_time': timestamp}
+            item.update(zip(names, (column[i] for column in values)))
+            self.append_data(item)
 
     def get_len(self):
         return len(self.buffer)
 
     def get_item_by_timestamp(self, timestamp):
-        keys = self.buffer.keys()
-        if timestamp in keys:
-            return self.buffer[timestamp]
-        else:
-            prev_timestamp = max([i for i in keys if i < timestamp])
-            return self.buffer[prev_timestamp]
+        """
+        :return: the item at timestamp, or the latest one before it if there is no such timestamp.
+        None if the buffer has nothing at or before timestamp
+        """
+        item = self.buffer.get(timestamp)
+        if item is None:
+            pos = self.time_index.position_at_or_before(timestamp)
+            if pos < 0:
+                return None
+            item = self.buffer[self.time_index.timestamps[pos]]
+        return item
+
+    def get_items_between(self, start_ts, end_ts) -> list:
+        """
+        :return: items with timestamps within [start_ts, end_ts], in time order
+        """
+        lo, hi = self.time_index.positions_between(start_ts, end_ts)
+        return [self.buffer[ts] for ts in self.time_index.timestamps[lo:hi]]
 
     def get_all_data(self) -> pd.DataFrame:
         if not len(self.buffer):
@@ -67,3 +186,177 @@ class DataBuffer():
 
     def feed_param_names(self, *args):
         self.params = [str(i) for i in args]
+
+
+class ColumnarDataBuffer(DataBuffer):
+    """
+    Column oriented version of the DataBuffer, meant for long backtests.
+    Every field is stored in its own row of a preallocated 2d float array, the array grows (doubles)
+    when it runs out of space. The time index maps timestamps ('close_time') to bar numbers, so merging new data
+    into an existing bar is a few array writes instead of creating a new dict.
+    The dict of dicts interface is still available: buffer attribute and items returned as dicts.
+    """
+
+    def __init__(self, symbol, max_size=None, interval_ts=None, capacity=1024):
+        """
+        :param interval_ts: candle interval in ms, lets the time index locate bars by arithmetic
+        :param capacity: number of bars to preallocate space for, e.g. the number of candles in a backtest
+        """
+        self.symbol = symbol
+        self.time_index = TimeIndex(interval_ts)
+        self.columns = {}  # field name -> row number in self._data, 'close_time' is kept in self._timestamps
+        self._len = 0
+        self._timestamps = np.empty(max(capacity, 1), dtype=np.int64)
+        self._data = np.full((16, max(capacity, 1)), np.nan)
+
+    def append_data(self, new_data):
+        """
+        :param new_data: dict with timestamp key, named 'close_time' (time of closure of the last candle),
+        or a list of such dicts
+        :return:
+        """
+        if isinstance(new_data, list):
+            if new_data and all(item.keys() == new_data[0].keys() for item in new_data):
+                # a batch of bars with the same fields, e.g. candles: write whole columns
+                self.append_columns([item['close_time'] for item in new_data],
+                                    {name: [item[name] for item in new_data] for name in new_data[0]})
+            else:
+                for item in new_data:
+                    self.append_data(item)
+            return
+
+        new_data_time = new_data['close_time']
+        bar = self.time_index.get(new_data_time)
+        if bar is None:
+            bar = self._add_bar(new_data_time)
+
+        for name, value in new_data.items():
+            if name == 'close_time':
+                continue
+            col = self.columns.get(name)
+            if col is None:
+                col = self._add_column(name)
+            self._data[col, bar] = value
+
+    def append_columns(self, close_time, columns: dict):
+        """
+        Merges data for many bars at once, same result as calling append_data for each bar.
+        :param close_time: array of bar timestamps
+        :param columns: dict of field name -> array of values, same length as close_time
+        """
+        close_time = np.asarray(close_time, dtype=np.int64)
+        known = [self.time_index.get(ts) for ts in close_time.tolist()]
+        if all(bar is None for bar in known) and (not self._len or close_time[0] > self.time_index.timestamps[-1]):
+            # new bars, appended after the existing ones
+            if self._len + len(close_time) > self._timestamps.shape[0]:
+                self._resize(self._data.shape[0], max(2 * self._len, self._len + len(close_time)))
+            bars = self.time_index.extend(close_time)
+            self._timestamps[bars.start:bars.stop] = close_time
+            self._len += len(close_time)
+            bars = slice(bars.start, bars.stop)
+        else:
+            bars = np.array([self._add_bar(ts) if bar is None else bar for ts, bar in zip(close_time.tolist(), known)],
+                            dtype=np.int64)
+
+        for name, values in columns.items():
+            if name == 'close_time':
+                continue
+            col = self.columns.get(name)
+            if col is None:
+                col = self._add_column(name)
+            self._data[col, bars] = values
+
+    def _add_bar(self, timestamp) -> int:
+        if self._len == self._timestamps.shape[0]:
+            self._resize(self._data.shape[0], 2 * self._len)
+        bar = self.time_index.add(timestamp)
+        self._timestamps[bar] = timestamp
+        self._len += 1
+        return bar
+
+    def _add_column(self, name) -> int:
+        if len(self.columns) == self._data.shape[0]:
+            self._resize(2 * self._data.shape[0], self._data.shape[1])
+        col = len(self.columns)
+        self.columns[name] = col
+        return col
+
+    def _resize(self, n_columns, n_bars):
+        data = np.full((n_columns, n_bars), np.nan)
+        data[:self._data.shape[0], :self._len] = self._data[:, :self._len]
+        self._data = data
+        if n_bars != self._timestamps.shape[0]:
+            timestamps = np.empty(n_bars, dtype=np.int64)
+            timestamps[:self._len] = self._timestamps[:self._len]
+            self._timestamps = timestamps
+
+    def _bar_as_dict(self, bar) -> dict:
+        # every column is in the item, NaN where the field was never set for this bar
+        item = dict(zip(self.columns, self._data[:len(self.columns), bar].tolist()))
+        item['close_time'] = int(self._timestamps[bar])
+        return item
+
+    @property
+    def buffer(self) -> dict:
+        """
+        Compatibility layer, the data as a dict of dicts like in DataBuffer. Is built on every call.
+        """
+        return {int(self._timestamps[bar]): self._bar_as_dict(bar) for bar in range(self._len)}
+
+    def get_len(self):
+        return self._len
+
+    def get_item_by_timestamp(self, timestamp):
+        """
+        :return: the item at timestamp, or the latest one before it if there is no such timestamp.
+        None if the buffer has nothing at or before timestamp
+        """
+        bar = self.time_index.get(timestamp)
+        if bar is None:
+            pos = self.time_index.position_at_or_before(timestamp)
+            if pos < 0:
+                return None
+            bar = self.time_index.bars[pos]
+        return self._bar_as_dict(bar)
+
+    def get_items_between(self, start_ts, end_ts) -> list:
+        """
+        :return: items with timestamps within [start_ts, end_ts], in time order
+        """
+        lo, hi = self.time_index.positions_between(start_ts, end_ts)
+        return [self._bar_as_dict(bar) for bar in self.time_index.bars[lo:hi]]
+
+    def get_column(self, name, start_ts=None, end_ts=None) -> np.ndarray:
+        """
+        :param start_ts, end_ts: optional time range, both ends included
+        :return: the column in time order, NaN where the field was not set.
+        A view of the buffer arrays as long as bars were appended in time order
+        """
+        if name == 'close_time':
+            column = self._timestamps[:self._len]
+        else:
+            column = self._data[self.columns[name], :self._len]
+
+        if not self._len or (start_ts is None and end_ts is None):
+            lo, hi = 0, self._len
+        else:
+            lo, hi = self.time_index.positions_between(
+                self.time_index.timestamps[0] if start_ts is None else start_ts,
+                self.time_index.timestamps[-1] if end_ts is None else end_ts
+            )
+        if self.time_index.ordered:
+            return column[lo:hi]
+        return column[self.time_index.bars[lo:hi]]
+
+    def get_all_data(self) -> pd.DataFrame:
+        """
+        The DataFrame is built on top of the buffer arrays, data is not copied.
+        Beware that it reflects later in-place updates of the bars already in the buffer.
+        """
+        if not self._len:
+            return None
+        df = pd.DataFrame(self._data[:len(self.columns), :self._len].T, columns=list(self.columns), copy=False)
+        timestamps = pd.to_datetime(self._timestamps[:self._len], unit='ms')
+        df.index = timestamps
+        df['close_time'] = timestamps
+        return df
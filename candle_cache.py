@@ -0,0 +1,220 @@
+from contextlib import contextmanager
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import btb_helpers as hlp
+import data
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, writers of the same candles are not serialised there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class CandleCache():
+    """
+    Local on-disk cache of candles in front of the binance_sql database.
+    Candles of every (symbol, interval) are kept in one .npy file, a 2d float array in asc order with
+    the fields of data.CANDLE_FIELDS, next to a .json file listing the time ranges already fetched.
+    Only the parts of a requested range that are not covered yet are loaded from the database,
+    cached data is served as a CandleDataset on top of a memory mapped file.
+    Candles later than the cached ones are appended to the file in place, others (gaps, older candles, candles
+    fetched again) are merged into a new file that replaces it. Processes filling the same (symbol, interval)
+    take turns through a lock file.
+    """
+
+    def __init__(self, cache_dir, fetch=None, offline=False):
+        """
+        :param cache_dir: directory for the cache files, created if it doesn't exist
+        :param fetch: function(symbol, interval, start_ts, end_ts) returning a list of candle tuples,
+        by default data.load_candles, i.e. the database
+        :param offline: never fetch, ranges missing from the cache raise LookupError
+        """
+        self.cache_dir = cache_dir
+        self.fetch = fetch or data.load_candles
+        self.offline = offline
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, symbol, interval):
+        name = os.path.join(self.cache_dir, f'{symbol}_{interval}')
+        return name + '.npy', name + '.json'
+
+    def get_ranges(self, symbol, interval) -> list:
+        """
+        :return: list of [start_ts, end_ts] ranges (open time, both ends included) already in the cache
+        """
+        _, ranges_path = self._paths(symbol, interval)
+        if not os.path.exists(ranges_path):
+            return []
+        with open(ranges_path) as f:
+            return json.load(f)['ranges']
+
+    def missing_ranges(self, symbol, interval, start_ts, end_ts) -> list:
+        """
+        :return: list of (start_ts, end_ts) parts of [start_ts, end_ts] not covered by the cache
+        """
+        missing = []
+        current = start_ts
+        for range_start, range_end in self.get_ranges(symbol, interval):
+            if range_end < current:
+                continue
+            if range_start > end_ts:
+                break
+            if range_start > current:
+                missing.append((current, range_start - 1))
+            current = max(current, range_end + 1)
+            if current > end_ts:
+                break
+        if current <= end_ts:
+            missing.append((current, end_ts))
+        return missing
+
+    def get_dataset(self, symbol, interval, start_ts, end_ts) -> data.CandleDataset:
+        """
+        :return: CandleDataset of the candles with open time within [start_ts, end_ts]
+        """
+        missing = self.missing_ranges(symbol, interval, start_ts, end_ts)
+        if missing and self.offline:
+            raise LookupError(f'candle cache is offline and misses {symbol} {interval} ranges {missing}')
+        for range_start, range_end in missing:
+            logger.info(f'candle cache: fetching {symbol} {interval} [{range_start}, {range_end}]')
+            candles = self.fetch(symbol, interval, range_start, range_end)
+            self.store(symbol, interval, range_start, range_end, candles)
+
+        values_path, _ = self._paths(symbol, interval)
+        if not os.path.exists(values_path):
+            return data.CandleDataset.from_candles([])
+        values = np.load(values_path, mmap_mode='r')
+        open_time = values[:, data.CANDLE_FIELDS.index('open_time')]
+        lo = np.searchsorted(open_time, start_ts, side='left')
+        hi = np.searchsorted(open_time, end_ts, side='right')
+        return data.CandleDataset(values[lo:hi])
+
+    def store(self, symbol, interval, start_ts, end_ts, candles):
+        """
+        Adds candles to the cache and marks [start_ts, end_ts] as covered.
+        Can be used to fill the cache with data from elsewhere, e.g. to work offline.
+        :param candles: a list of candle tuples (any order) or a CandleDataset
+        """
+        if isinstance(candles, data.CandleDataset):
+            new_values = np.asarray(candles.values)
+        else:
+            new_values = np.array(candles, dtype=np.float64).reshape(-1, len(data.CANDLE_FIELDS))
+
+        new_values = self._sorted_unique(new_values)
+
+        values_path, ranges_path = self._paths(symbol, interval)
+        with self._lock(symbol, interval):
+            if not self._append(values_path, new_values):
+                if os.path.exists(values_path):
+                    values = self._sorted_unique(np.concatenate([np.load(values_path, mmap_mode='r'), new_values]))
+                else:
+                    values = new_values
+                self._write(values_path, lambda f: np.save(f, values))
+
+            # candles that haven't closed yet may still appear in the database, don't mark them as covered
+            last_closed = int(time.time() * 1000) - hlp.interval_to_milliseconds(interval)
+            ranges = self.get_ranges(symbol, interval)
+            if start_ts <= min(end_ts, last_closed):
+                ranges = self._merge_ranges(ranges + [[start_ts, min(end_ts, last_closed)]])
+            self._write(ranges_path, lambda f: f.write(json.dumps({'ranges': ranges}).encode()))
+
+    @contextmanager
+    def _lock(self, symbol, interval):
+        if fcntl is None:
+            yield
+            return
+        values_path, _ = self._paths(symbol, interval)
+        with open(values_path + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _sorted_unique(values) -> np.ndarray:
+        # sort by open time, of candles with the same open time the last one is kept
+        open_time = values[:, data.CANDLE_FIELDS.index('open_time')]
+        order = np.argsort(open_time, kind='stable')[::-1]
+        _, last = np.unique(open_time[order], return_index=True)
+        return values[order[last]]
+
+    @staticmethod
+    def _append(path, new_values) -> bool:
+        """
+        Appends candles later than all the cached ones to the .npy file in place: the rows go after the array
+        first, then the header gets the new shape, so an interrupted append leaves the array as it was.
+        :param new_values: candles in asc order, without duplicates
+        :return: False if the candles can't be appended and the file has to be rewritten
+        """
+        if not os.path.exists(path):
+            return False
+        if not len(new_values):
+            return True
+        new_values = np.ascontiguousarray(new_values, dtype=np.float64)
+        with open(path, 'r+b') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                read_header, write_header = np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0
+            else:
+                read_header, write_header = np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            offset = f.tell()
+            if fortran_order or dtype != np.float64 or len(shape) != 2 or shape[1] != new_values.shape[1]:
+                return False
+            row_size = new_values.shape[1] * new_values.itemsize
+            if shape[0]:
+                f.seek(offset + (shape[0] - 1) * row_size)
+                last_row = np.frombuffer(f.read(row_size), dtype=np.float64)
+                open_time = data.CANDLE_FIELDS.index('open_time')
+                if new_values[0, open_time] <= last_row[open_time]:
+                    return False
+
+            # numpy leaves room in the header for the shape to grow, a header of another size can't be rewritten
+            header = io.BytesIO()
+            write_header(header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                                  'shape': (shape[0] + len(new_values), shape[1])})
+            if header.tell() != offset:
+                return False
+
+            f.seek(offset + shape[0] * row_size)
+            f.write(new_values.tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+            f.seek(0)
+            f.write(header.getvalue())
+        return True
+
+    @staticmethod
+    def _merge_ranges(ranges) -> list:
+        merged = []
+        for range_start, range_end in sorted(ranges):
+            if merged and range_start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+        return merged
+
+    @staticmethod
+    def _write(path, write):
+        # write to a temporary file first, so that an interrupted run never leaves a broken cache file,
+        # a file of its own for every writer
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.',
+                                         suffix='.tmp', delete=False) as f:
+            try:
+                write(f)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.replace(f.name, path)
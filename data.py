@@ -1,13 +1,198 @@
 from abc import ABCMeta, abstractmethod
+import asyncio
 import collections
+from collections.abc import Mapping
+import json
+import logging
+import queue
+import threading
 import time
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import spooky
-from binance_sql import historical_data as ghd
+import btb_helpers as hlp
 import events
 
+logger = logging.getLogger(__name__)
+
+BINANCE_REST_URL = 'https://api.binance.com'
+BINANCE_STREAM_URL = 'wss://stream.binance.com:9443'
+KLINES_LIMIT = 1000  # max candles per request of the klines endpoint
+
+# layout of a candle tuple as returned by binance_sql get_candles
+CANDLE_FIELDS = ['open_time', 'open', 'high', 'low', 'close', 'volume', 'close_time',
+                 'quote_vol', 'num_trades', 'buy_base_vol', 'buy_quote_vol']
+INT_FIELDS = [CANDLE_FIELDS.index(field) for field in ('open_time', 'close_time', 'num_trades')]
+
+
+def load_candles(symbol, interval, start_ts, end_ts, delete_previous_data=False) -> list:
+    """
+    Gets candles from the database, missing ones are downloaded from the exchange by binance_sql.
+    :return: a list of tuples, each representing a candle, in desc order
+    """
+    # imported here, so that backtests on imported or cached data work without the database setup
+    import spooky
+    from binance_sql import historical_data as ghd
+
+    conn_creds = {
+        'host': spooky.creds['host'],
+        'user': spooky.creds['user'],
+        'password': spooky.creds['password'],
+        'database': spooky.creds['database']
+    }
+    candle_getter = ghd.data_manager(symbol, interval)
+    candle_getter.set_database_credentials(**conn_creds)
+    return candle_getter.get_candles(start_ts=start_ts, end_ts=end_ts,
+                                     delete_existing_table=delete_previous_data,
+                                     reversed_order=True)
+
+
+def load_dataset(symbol, interval, start_ts, end_ts, cache=None, delete_previous_data=False):
+    """
+    :param cache: a candle_cache.CandleCache, if given candles are served from it and only the ranges
+    it doesn't have yet are loaded from the database
+    :return: CandleDataset of the candles within [start_ts, end_ts]
+    """
+    if cache is not None:
+        return cache.get_dataset(symbol, interval, start_ts, end_ts)
+    candles = load_candles(symbol, interval, start_ts, end_ts, delete_previous_data=delete_previous_data)
+    return CandleDataset.from_candles(candles)
+
+
+def iter_dataset_chunks(symbol, interval, start_ts, end_ts, chunk_size, cache=None):
+    """
+    Generator of CandleDatasets covering [start_ts, end_ts] in consecutive time windows of chunk_size candles,
+    each one loaded only when the previous one has been taken.
+    """
+    chunk_len_ts = chunk_size * hlp.interval_to_milliseconds(interval)
+    chunk_start = start_ts
+    while chunk_start <= end_ts:
+        chunk_end = min(chunk_start + chunk_len_ts - 1, end_ts)
+        yield load_dataset(symbol, interval, chunk_start, chunk_end, cache=cache)
+        chunk_start = chunk_end + 1
+
+
+def candles_to_columns(candles, reversed_order=True) -> dict:
+    """
+    Converts candle tuples into a dict of numpy arrays, one per field of CANDLE_FIELDS, in asc order.
+    Missing bars (negative open) are dropped, the same way HistoricDataHandler skips them.
+    :param candles: a list of tuples, each representing a candle, or a CandleDataset
+    :param reversed_order: candles are in desc order, as HistoricDataHandler expects them
+    """
+    if isinstance(candles, CandleDataset):
+        values = candles.values
+    else:
+        values = np.array(candles, dtype=float).reshape(-1, len(CANDLE_FIELDS))
+        if reversed_order:
+            values = values[::-1]
+    values = values[values[:, CANDLE_FIELDS.index('open')] >= 0]
+    columns = {field: values[:, i] for i, field in enumerate(CANDLE_FIELDS)}
+    for field in ('open_time', 'close_time'):
+        columns[field] = columns[field].astype(np.int64)
+    return columns
+
+
+class Bar(Mapping):
+    """
+    A candle as data handlers feed it to the system: read-only mapping of CANDLE_FIELDS to values,
+    used like the dict it replaces (bar['close'], **bar), but backed by a list of values, without a dict per bar
+    """
+    __slots__ = ('_values',)
+    _index = {field: i for i, field in enumerate(CANDLE_FIELDS)}
+
+    def __init__(self, values: list):
+        """
+        :param values: values of CANDLE_FIELDS, in that order
+        """
+        self._values = values
+
+    def __getitem__(self, field):
+        return self._values[self._index[field]]
+
+    def __contains__(self, field):
+        return field in self._index
+
+    def __iter__(self):
+        return iter(CANDLE_FIELDS)
+
+    def __len__(self):
+        return len(CANDLE_FIELDS)
+
+    def items(self):
+        return zip(CANDLE_FIELDS, self._values)
+
+    def __repr__(self):
+        return f'Bar({dict(self.items())})'
+
+
+def kline_to_bar(kline) -> Bar:
+    """
+    :param kline: a candle from the Binance api: a list as returned by the klines REST endpoint,
+    or the 'k' dict of a kline websocket message
+    """
+    if isinstance(kline, dict):
+        kline = [kline['t'], kline['o'], kline['h'], kline['l'], kline['c'], kline['v'], kline['T'],
+                 kline['q'], kline['n'], kline['V'], kline['Q']]
+    values = [float(value) for value in kline[:len(CANDLE_FIELDS)]]
+    for field in INT_FIELDS:
+        values[field] = int(values[field])
+    return Bar(values)
+
+
+class CandleDataset():
+    """
+    Immutable set of candles in asc order, one row per candle with the fields of CANDLE_FIELDS.
+    Candles are kept in a read-only 2d float array, which can live in shared memory or in a memory mapped file.
+    Data handlers read it through a cursor, so any number of backtests, in one process or many,
+    can replay the same dataset without copying it.
+    """
+
+    def __init__(self, values: np.ndarray):
+        """
+        :param values: 2d float array, shape (number of candles, len(CANDLE_FIELDS)), asc order
+        """
+        self.values = values.view()
+        self.values.flags.writeable = False
+        self.close_time = self.values[:, CANDLE_FIELDS.index('close_time')]
+
+    @classmethod
+    def from_candles(cls, candles: list, reversed_order=True):
+        """
+        :param candles: a list of tuples, each representing a candle, as returned by get_candles
+        :param reversed_order: candles are in desc order
+        """
+        values = np.array(candles, dtype=np.float64).reshape(-1, len(CANDLE_FIELDS))
+        if reversed_order:
+            values = values[::-1].copy()
+        return cls(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def get_bar(self, i) -> Bar:
+        """
+        :return: i-th candle as a Bar, like HistoricDataHandler feeds it to the system
+        """
+        bar = self.values[i].tolist()
+        for field in INT_FIELDS:
+            bar[field] = int(bar[field])
+        return Bar(bar)
+
+    def index_of(self, timestamp) -> int:
+        """
+        :return: position of the first candle closing at or after timestamp
+        """
+        return int(np.searchsorted(self.close_time, timestamp, side='left'))
+
+    def view(self, start_ts=None, end_ts=None):
+        """
+        :return: a dataset of the candles with close_time within [start_ts, end_ts], sharing memory with this one
+        """
+        lo = 0 if start_ts is None else self.index_of(start_ts)
+        hi = len(self) if end_ts is None else int(np.searchsorted(self.close_time, end_ts, side='right'))
+        return CandleDataset(self.values[lo:max(lo, hi)])
+
 
 class DataHandler(object):
     """
@@ -47,7 +232,7 @@ class HistoricDataHandler(DataHandler):
     """
 
     def __init__(self, events, buffer, symbol, interval, start_ts, end_ts, delete_previous_data=False,
-                 imported_data=False):
+                 imported_data=False, cache=None):
         """
         Initialises the historic data handler.
         :param events: the events queue
@@ -56,7 +241,9 @@ class HistoricDataHandler(DataHandler):
         :param start_ts: backtester start timestamp
         :param end_ts: backtester stop timestamp
         :param latest_data_maxlen: max length of latest_symbol_data, where we append new candles
-        :param import_data: download or import data
+        :param imported_data: a CandleDataset or a list of candle tuples (desc order) to use instead of
+        downloading data
+        :param cache: candle_cache.CandleCache to load data through
         """
 
         self.events = events
@@ -66,52 +253,75 @@ class HistoricDataHandler(DataHandler):
         self.start_ts = start_ts
         self.end_ts = end_ts
         self.delete_prev_data = delete_previous_data
+        self.cache = cache
 
-        self.historical_data = []
+        self.dataset = CandleDataset.from_candles([])
+        self.cursor = 0  # position of the next bar in the dataset
         self.continue_backtest = True
 
-        if imported_data:
+        # an empty CandleDataset or list is imported too, e.g. no new candles to extend a run with
+        if imported_data is not None and imported_data is not False:
             self.import_historical_data(imported_data)
         else:
             self.load_historical_data()
 
     def load_historical_data(self):
-        #  returns a list of tuples, each representing a candle, returned in desc order, so we can pop from list
-
-        conn_creds = {
-            'host': spooky.creds['host'],
-            'user': spooky.creds['user'],
-            'password': spooky.creds['password'],
-            'database': spooky.creds['database']
-        }
-        candle_getter = ghd.data_manager(self.symbol, self.interval)
-        candle_getter.set_database_credentials(**conn_creds)
-        self.historical_data = candle_getter.get_candles(start_ts=self.start_ts, end_ts=self.end_ts,
-                                                         delete_existing_table=self.delete_prev_data,
-                                                         reversed_order=True)
-        if not self.historical_data:
-            self.continue_backtest = False
+        dataset = load_dataset(self.symbol, self.interval, self.start_ts, self.end_ts, cache=self.cache,
+                               delete_previous_data=self.delete_prev_data)
+        self.import_historical_data(dataset)
 
-    def import_historical_data(self, data: list):
+    def import_historical_data(self, data):
         """
-        :param data: a list of tuples, each representing a candle, organised in desc order, so we can pop from list
+        :param data: a CandleDataset, or a list of tuples, each representing a candle, organised in desc order
         :return:
         """
-        self.historical_data = data
-        if not self.historical_data:
-            self.continue_backtest = False
+        if not isinstance(data, CandleDataset):
+            data = CandleDataset.from_candles(data)
+        self.dataset = data
+        self.reset()
+
+    def reset(self):
+        """
+        Rewinds the data feed to the first bar, the dataset is never consumed
+        """
+        self.seek(None)
+
+    def close(self):
+        """
+        Stops the replay
+        """
+        self.continue_backtest = False
+
+    def seek(self, timestamp):
+        """
+        Moves the cursor, so that the next bar is the first one closing at or after timestamp
+        :param timestamp: close_time in ms, None for the first bar of the dataset
+        """
+        self.cursor = 0 if timestamp is None else self.dataset.index_of(timestamp)
+        self.continue_backtest = self.cursor < len(self.dataset)
+
+    def next_close_time(self):
+        """
+        :return: close_time of the bar the next update_bars will feed
+        """
+        return self.dataset.close_time[self.cursor]
 
-    def _pop_new_bar(self) -> dict:
+    @property
+    def last_close_time(self):
         """
-        :return: Dict. The latest bar from the data feed.
+        :return: close_time of the last bar fed (or skipped by seek), None if there is none
         """
-        new_raw_bar = self.historical_data.pop()
-        #  if list is empty after pop, don't go on the nex loop
-        if not self.historical_data:
+        return int(self.dataset.close_time[self.cursor - 1]) if self.cursor else None
+
+    def _pop_new_bar(self) -> Bar:
+        """
+        :return: Bar. The latest bar from the data feed.
+        """
+        new_bar = self.dataset.get_bar(self.cursor)
+        self.cursor += 1
+        #  if it was the last bar, don't go on the nex loop
+        if self.cursor >= len(self.dataset):
             self.continue_backtest = False
-        keys = ['open_time', 'open', 'high', 'low', 'close', 'volume', 'close_time',
-                'quote_vol', 'num_trades', 'buy_base_vol', 'buy_quote_vol']
-        new_bar = dict(zip(keys, new_raw_bar))
         if new_bar['open'] < 0:
             # print('missing bar detected!!!!!!!!!!=========================')
             return None
@@ -120,13 +330,309 @@ class HistoricDataHandler(DataHandler):
 
         # should think of something in case of recieving multiple bars while live trading
 
-    def update_bars(self):
+    def next_bar(self):
+        """
+        Takes the next bar off the feed without buffering it or putting a MarketEvent,
+        for callers merging many feeds, e.g. backtesting.MultiBackTester
+        :return: Bar, None for a missing candle
+        """
+        return self._pop_new_bar()
+
+    def update_bars(self, batch_size=1):
         """
         Pushes the latest bar to the buffered_data queue.
+        :param batch_size: if more than 1, up to batch_size bars are pushed at once, as a list in one MarketEvent.
+        Useful for bulk replay, or in live trading when candles are downloaded after restoring lost connection
         """
-        #  TODO: in live trading new data can be a bunch of canldes if
-        #   for example we download them after restoring lost connection to exchange
-        new_data = self._pop_new_bar()
+        if batch_size > 1:
+            new_data = []
+            while self.continue_backtest and len(new_data) < batch_size:
+                new_bar = self._pop_new_bar()
+                if new_bar:
+                    new_data.append(new_bar)
+        else:
+            new_data = self._pop_new_bar()
         if new_data:
             self.buffer.append_data(new_data)
             self.events.put(events.MarketEvent(new_data))
+
+
+class StreamingHistoricDataHandler(HistoricDataHandler):
+    """
+    Historic data handler for long backtests (e.g. years of 1m candles). Instead of loading the whole
+    [start_ts, end_ts] range before the first bar, candles are loaded in chunks of chunk_size candles.
+    A background thread loads the next chunks while the event loop consumes the current one,
+    so memory used by candles is bounded by the chunk size, not by the length of the backtest.
+    """
+
+    def __init__(self, events, buffer, symbol, interval, start_ts, end_ts, chunk_size=10000, prefetch=1,
+                 cache=None):
+        """
+        :param chunk_size: number of candles loaded at once
+        :param prefetch: number of chunks loaded ahead of the one being consumed
+        :param cache: candle_cache.CandleCache to load chunks through
+        Other parameters are the same as in HistoricDataHandler
+        """
+        self.events = events
+        self.buffer = buffer
+        self.symbol = symbol
+        self.interval = interval
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.delete_prev_data = False
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+
+        self.dataset = CandleDataset.from_candles([])
+        self.cursor = 0
+        self.continue_backtest = True
+        self._last_close_time = None
+        self._loader = None
+        self.seek(None)
+
+    def _load_chunks(self, chunks, chunk_queue, stop):
+        # runs in the loader thread: puts chunks, then None at the end of data, or the exception if loading failed
+        try:
+            for chunk in chunks:
+                if not self._put(chunk_queue, chunk, stop):
+                    return
+        except Exception as e:
+            self._put(chunk_queue, e, stop)
+        else:
+            self._put(chunk_queue, None, stop)
+
+    @staticmethod
+    def _put(chunk_queue, item, stop) -> bool:
+        # waits while the queue is full, gives up if the handler is closed
+        while not stop.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def close(self):
+        """
+        Stops the loader thread, e.g. when the backtest is stopped before the end of data
+        """
+        if self._loader is not None:
+            self._stop.set()
+            self._loader.join()
+            self._loader = None
+        self.continue_backtest = False
+
+    def seek(self, timestamp):
+        """
+        Restarts the stream, the next bar is the first one closing at or after timestamp
+        :param timestamp: close_time in ms, None for the start of the backtest
+        """
+        self.close()
+        self._chunks = queue.Queue(maxsize=self.prefetch)
+        self._stop = threading.Event()
+        start_ts = self.start_ts
+        if timestamp is not None:
+            start_ts = max(start_ts, timestamp - hlp.interval_to_milliseconds(self.interval))
+        chunks = iter_dataset_chunks(self.symbol, self.interval, start_ts, self.end_ts, self.chunk_size,
+                                     cache=self.cache)
+        self._loader = threading.Thread(target=self._load_chunks, args=(chunks, self._chunks, self._stop),
+                                        daemon=True)
+        self._loader.start()
+
+        self._last_close_time = None if timestamp is None else timestamp - 1
+        self.dataset = CandleDataset.from_candles([])
+        self.cursor = 0
+        self.continue_backtest = True
+        self._next_chunk()
+
+    @property
+    def last_close_time(self):
+        # the cursor is reset with every chunk, the close time is kept across them
+        return None if self._last_close_time is None else int(self._last_close_time)
+
+    def _next_chunk(self):
+        # takes chunks from the loader until a non-empty one, or the end of data
+        while True:
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                self.close()
+                raise chunk
+            if chunk is None:
+                self._loader.join()
+                self._loader = None
+                self.dataset = CandleDataset.from_candles([])
+                self.cursor = 0
+                self.continue_backtest = False
+                return
+            if self._last_close_time is not None:
+                chunk = chunk.view(start_ts=self._last_close_time + 1)
+            if len(chunk):
+                self.dataset = chunk
+                self.cursor = 0
+                return
+
+    def _pop_new_bar(self) -> Bar:
+        """
+        :return: Bar. The latest bar from the data feed.
+        """
+        new_bar = self.dataset.get_bar(self.cursor)
+        self.cursor += 1
+        self._last_close_time = new_bar['close_time']
+        #  if it was the last bar of the chunk, move to the next one, stop if there is none
+        if self.cursor >= len(self.dataset):
+            self._next_chunk()
+        if new_bar['open'] < 0:
+            return None
+        else:
+            return new_bar
+
+
+class LiveDataHandler(DataHandler):
+    """
+    Feeds closed candles of a Binance kline websocket stream to the system.
+    Network I/O runs in an asyncio loop on a background thread and bars are handed over through a thread-safe
+    queue, so update_bars, called from the trading loop, never waits on the network longer than its timeout.
+    The stream is reconnected with exponential backoff. Candles closed while it was down are downloaded from
+    the klines REST endpoint and fed as one batch (a list of bars in one MarketEvent), as are the candles
+    since backfill_from at the start.
+    Needs aiohttp.
+    """
+
+    def __init__(self, events, buffer, symbol, interval, backfill_from=None,
+                 rest_url=BINANCE_REST_URL, stream_url=BINANCE_STREAM_URL,
+                 reconnect_delay=1., max_reconnect_delay=30.):
+        """
+        :param backfill_from: if set, candles closing from this time (ms) on are downloaded at the start,
+        e.g. to warm up the strategy
+        :param rest_url: base url of the REST api, e.g. of mock_exchange.MockExchange
+        :param stream_url: base url of the websocket streams
+        :param reconnect_delay: seconds to wait before the first reconnect, doubled after each failed one
+        """
+        self.events = events
+        self.buffer = buffer
+        self.symbol = symbol
+        self.interval = interval
+        self.interval_ts = hlp.interval_to_milliseconds(interval)
+        self.rest_url = rest_url
+        self.stream_url = stream_url
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.last_close_time = None if backfill_from is None else backfill_from - 1
+        self.continue_backtest = True  # same flag as historic handlers, False once the handler is closed
+        self.reconnects = 0
+        self._bars = queue.Queue()  # lists of new bars, put by the network thread
+        self._error = None
+        self._loop = None
+        self._task = None
+        self._thread = None
+
+    def start(self):
+        """
+        Starts streaming on a background thread
+        """
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(started,), daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def _run(self, started):
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self.stream())
+        started.set()
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self._error = e
+            self._bars.put([])  # wakes update_bars up
+        finally:
+            self._loop.close()
+
+    def close(self):
+        """
+        Stops streaming
+        """
+        self.continue_backtest = False
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+            self._thread.join()
+            self._thread = None
+
+    async def stream(self):
+        """
+        Coroutine receiving closed candles until cancelled, can be run in any asyncio loop
+        """
+        import aiohttp
+
+        url = f'{self.stream_url}/ws/{self.symbol.lower()}@kline_{self.interval}'
+        delay = self.reconnect_delay
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.ws_connect(url, heartbeat=30) as ws:
+                        # candles closed before the subscription, or while the stream was down
+                        await self._backfill(session)
+                        async for message in ws:
+                            if message.type != aiohttp.WSMsgType.TEXT:
+                                break
+                            kline = json.loads(message.data)['k']
+                            if kline['x']:  # the candle is closed
+                                self._put([kline_to_bar(kline)])
+                                delay = self.reconnect_delay
+                except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError) as e:
+                    logger.warning(f'{self.symbol} kline stream: {e!r}')
+                self.reconnects += 1
+                logger.info(f'{self.symbol} kline stream disconnected, reconnecting in {delay} s')
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, self.max_reconnect_delay)
+
+    async def _backfill(self, session):
+        if self.last_close_time is None:
+            return
+        url = f'{self.rest_url}/api/v3/klines'
+        bars = []
+        start_ts = self.last_close_time + 1
+        while True:
+            params = {'symbol': self.symbol, 'interval': self.interval, 'startTime': start_ts, 'limit': KLINES_LIMIT}
+            async with session.get(url, params=params) as response:
+                response.raise_for_status()
+                klines = await response.json()
+            now = time.time() * 1000
+            # the last kline can be the current one, not closed yet
+            bars.extend(kline_to_bar(kline) for kline in klines if kline[6] <= now)
+            if len(klines) < KLINES_LIMIT:
+                break
+            start_ts = klines[-1][6] + 1
+        self._put(bars)
+
+    def _put(self, bars: list):
+        # only bars after the last one fed, the stream and the backfill can overlap
+        bars = [bar for bar in bars if self.last_close_time is None or bar['close_time'] > self.last_close_time]
+        if bars:
+            self.last_close_time = bars[-1]['close_time']
+            self._bars.put(bars)
+
+    def update_bars(self, timeout=1.):
+        """
+        Pushes the bars received since the last call: one bar, or a list of them in one MarketEvent
+        if several came at once (backfill after a reconnect).
+        :param timeout: seconds to wait for a bar if there is none yet, 0 to return at once
+        """
+        new_data = []
+        try:
+            new_data += self._bars.get(timeout=timeout) if timeout else self._bars.get_nowait()
+            while True:
+                new_data += self._bars.get_nowait()
+        except queue.Empty:
+            pass
+        if self._error is not None:
+            raise self._error
+        if not new_data:
+            return
+        if len(new_data) == 1:
+            new_data = new_data[0]
+        self.buffer.append_data(new_data)
+        self.events.put(events.MarketEvent(new_data))
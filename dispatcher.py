@@ -0,0 +1,73 @@
+from collections import deque
+import queue
+
+
+class EventDispatcher():
+    """
+    Event queue of the trading loop, routes every event to the handlers registered for its class.
+    Components put events on it the same way as on a queue.Queue: dispatcher.put(event).
+    Backtests run on one thread and use a plain deque, live trading, where events can come from other threads,
+    uses a thread-safe queue.Queue.
+    """
+
+    def __init__(self, thread_safe=False):
+        """
+        :param thread_safe: use a queue.Queue, needed if events are put from other threads
+        """
+        self.thread_safe = thread_safe
+        self.handlers = {}  # event class -> list of handlers, called in the order they were registered
+        self._resolved = {}  # handlers of event subclasses, found through the mro once
+        if thread_safe:
+            self._queue = queue.Queue()
+            self.put = self._queue.put
+        else:
+            self._queue = deque()
+            self.put = self._queue.append
+
+    def register(self, event_class, handler):
+        """
+        :param event_class: e.g. events.MarketEvent, handlers of a class also get the events of its subclasses
+        :param handler: callable taking the event
+        """
+        self.handlers.setdefault(event_class, []).append(handler)
+        self._resolved.clear()
+
+    def get_handlers(self, event_class) -> list:
+        handlers = self._resolved.get(event_class)
+        if handlers is None:
+            handlers = [handler for cls in event_class.__mro__ for handler in self.handlers.get(cls, ())]
+            self._resolved[event_class] = handlers
+        return handlers
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self.thread_safe else len(self._queue)
+
+    def dispatch(self, block=False, timeout=None) -> int:
+        """
+        Processes events until the queue is empty, including the ones put by the handlers
+        :param block: thread-safe dispatcher only, wait up to timeout seconds for the first event
+        :return: number of events processed
+        """
+        n_events = 0
+        resolved = self._resolved
+        if self.thread_safe:
+            get = self._queue.get
+            try:
+                event = get(block, timeout)
+                while True:
+                    for handler in resolved.get(type(event)) or self.get_handlers(type(event)):
+                        handler(event)
+                    n_events += 1
+                    event = get(False)
+            except queue.Empty:
+                return n_events
+
+        pending = self._queue
+        popleft = pending.popleft
+        while pending:
+            event = popleft()
+            for handler in resolved.get(type(event)) or self.get_handlers(type(event)):
+                handler(event)
+            n_events += 1
+        return n_events
+
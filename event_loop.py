@@ -1,5 +1,4 @@
 import sys
-import queue
 import pandas as pd
 import mplfinance as mpf
 import matplotlib.pyplot as plt
@@ -13,8 +12,10 @@ import strategy
 import portfolio
 import execution
 import performance
+import dispatcher
+from events import MarketEvent, SignalEvent, OrderEvent, FillEvent
 
-events = queue.Queue()
+events = dispatcher.EventDispatcher()
 
 symbol = 'ADAUSDT'
 start_ts = hlp.date_to_milliseconds('01-Mar-2019 00:00:00')
@@ -32,6 +33,13 @@ portfolio = portfolio.NaivePortfolio(events, buffer, symbol, initial_capital=100
 
 executor = execution.SimulatedExecutionHandler(events)
 
+# event fired by data_handler.update_bars(), contains new data
+events.register(MarketEvent, lambda event: ema_strategy.calculate_signals(symbol, interval_ts, events, event, buffer))
+events.register(MarketEvent, portfolio.update_timeindex)
+events.register(SignalEvent, portfolio.process_signal)  # puts an order event on the queue
+events.register(OrderEvent, executor.execute_order)
+events.register(FillEvent, portfolio.update_fill)
+
 while True:
     # Update the bars
     if data_handler.continue_backtest:
@@ -40,28 +48,7 @@ while True:
     else:
         break
     # Process event queue until it's empty
-    while True:
-        try:
-            event = events.get(False)  # https://docs.python.org/3/library/queue.html#queue.Queue.get
-        except queue.Empty:
-            break
-
-        if event.type == 'MARKET':
-            # event fired by data_handler.update_bars(), contains new data
-            ema_strategy.calculate_signals(symbol, interval_ts, events, event, buffer)
-            portfolio.update_timeindex(event)
-
-        elif event.type == 'SIGNAL':
-
-            portfolio.process_signal(event)  # puts an order event on the queue
-
-        elif event.type == 'ORDER':
-
-            executor.execute_order(event)
-
-        elif event.type == 'FILL':
-            portfolio.update_fill(event)
-
+    events.dispatch()
 
 backtest_results = performance.calculate_performance(buffer, interval)
 
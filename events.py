@@ -1,23 +1,48 @@
+from enum import IntEnum
+
+
+class Signal(IntEnum):
+    """
+    Kinds of signals sent by strategies, a SignalEvent carries a sequence of them, e.g. (EXIT, LONG)
+    """
+    EXIT = 0
+    LONG = 1
+    SHORT = 2
+
+
+class OrderType(IntEnum):
+    MKT = 0  # market
+    LMT = 1  # limit
+
+
+# signal sequences shared by all the SignalEvents, instead of a new list per signal
+EXIT_LONG = (Signal.EXIT, Signal.LONG)
+EXIT_SHORT = (Signal.EXIT, Signal.SHORT)
+
+
 class Event(object):
     """
     Event is base class providing an interface for all subsequent
     (inherited) events, that will trigger further events in the
     trading infrastructure.
+    Events are created for every bar, they use __slots__ instead of an instance dict,
+    the type is a class attribute.
     """
-    pass
+    __slots__ = ()
 
 
 class MarketEvent(Event):
     """
     Handles the event of receiving new market data (bars).
     """
+    __slots__ = ('new_data',)
+    type = 'MARKET'
 
     def __init__(self, new_data):
         """
         Initialises the MarketEvent.
-        new_data may be a dict or a list of dicts
+        new_data may be a bar (data.Bar or a dict) or a list of them
         """
-        self.type = 'MARKET'
         self.new_data = new_data
 
 
@@ -26,17 +51,18 @@ class SignalEvent(Event):
     Handles the event of sending a Signal from a Strategy object.
     This is received by a Portfolio object and acted upon.
     """
+    __slots__ = ('symbol', 'bar_close_time', 'signal', 'last_close_price')
+    type = 'SIGNAL'
 
-    def __init__(self, symbol, bar_close_time, signal: list, last_close_price):
+    def __init__(self, symbol, bar_close_time, signal: tuple, last_close_price):
         """
         Initialises the SignalEvent.
         Parameters:
         symbol - The ticker symbol, e.g. 'GOOG'.
         datetime - The timestamp at which the signal was generated.
-        signal_type - 'LONG' or 'SHORT'.
+        signal - sequence of Signal codes, e.g. EXIT_LONG.
         """
 
-        self.type = 'SIGNAL'
         self.symbol = symbol
         self.bar_close_time = bar_close_time
         self.signal = signal
@@ -49,22 +75,23 @@ class OrderEvent(Event):
     The order contains a symbol (e.g. GOOG), a type (market or limit),
     quantity and a direction.
     """
+    __slots__ = ('symbol', 'datetime', 'order_type', 'quantity', 'last_close_price')
+    type = 'ORDER'
 
     def __init__(self, symbol, datetime, order_type, quantity, last_close_price):
         """
         Initialises the order type, setting whether it is
-        a Market order ('MKT') or Limit order ('LMT'), has
+        a Market order (MKT) or Limit order (LMT), has
         a quantity (integral) and its direction ('BUY' or
         'SELL').
 
         Parameters:
         symbol - The instrument to trade.
-        order_type - 'MKT' or 'LMT' for Market or Limit.
+        order_type - OrderType.MKT or OrderType.LMT for Market or Limit.
         quantity - Non-negative integer for quantity.
         direction - 'BUY' or 'SELL' for long or short.
         """
 
-        self.type = 'ORDER'
         self.symbol = symbol
         self.datetime = datetime
         self.order_type = order_type
@@ -75,7 +102,7 @@ class OrderEvent(Event):
         """
         Outputs the values within the Order.
         """
-        print(f'Order: type={self.order_type}, symbol={self.symbol}, '
+        print(f'Order: type={OrderType(self.order_type).name}, symbol={self.symbol}, '
               f'quantity={self.quantity}, price fired={self.last_close_price}')
 
 
@@ -86,6 +113,8 @@ class FillEvent(Event):
     actually filled and at what price. In addition, stores
     the commission of the trade from the brokerage.
     """
+    __slots__ = ('time_executed', 'bar_close_time', 'symbol', 'exchange', 'quantity', 'price_filled', 'commission')
+    type = 'FILL'
 
     def __init__(self, time_executed, bar_close_time, symbol, exchange, quantity, price_filled, commission):
         """
@@ -106,7 +135,6 @@ class FillEvent(Event):
         commission - An optional commission sent from IB.
         """
 
-        self.type = 'FILL'
         self.time_executed = time_executed
         self.bar_close_time = bar_close_time
         self.symbol = symbol
@@ -114,3 +142,25 @@ class FillEvent(Event):
         self.quantity = quantity
         self.price_filled = price_filled
         self.commission = commission
+
+
+class OrderFailedEvent(Event):
+    """
+    An order that could not be placed, e.g. for a network error. Nothing was filled,
+    the portfolio stops waiting for the fill.
+    """
+    __slots__ = ('symbol', 'datetime', 'quantity', 'reason')
+    type = 'ORDER_FAILED'
+
+    def __init__(self, symbol, datetime, quantity, reason):
+        """
+        Parameters:
+        symbol - The instrument of the order.
+        datetime - The bar close time of the order.
+        quantity - The quantity ordered.
+        reason - Description of the error.
+        """
+        self.symbol = symbol
+        self.datetime = datetime
+        self.quantity = quantity
+        self.reason = reason
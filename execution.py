@@ -1,10 +1,26 @@
 from abc import ABCMeta, abstractmethod
+import asyncio
+from bisect import bisect_left
 import datetime
+import functools
+import hashlib
+import heapq
+import hmac
+import logging
+import threading
 import time
 import queue
+from urllib.parse import urlencode
 
+import numpy as np
+
+import data
 import events
 
+logger = logging.getLogger(__name__)
+
+COMMISSION_RATE = 0.1 / 100  # Binance spot taker fee
+
 
 class ExecutionHandler(object):
     """
@@ -32,6 +48,13 @@ class ExecutionHandler(object):
         """
         raise NotImplementedError("Should implement execute_order()")
 
+    def on_market(self, event):
+        """
+        Receives every MarketEvent after the strategy and the portfolio,
+        for handlers that fill orders against later bars. Does nothing by default.
+        """
+        pass
+
 
 class SimulatedExecutionHandler(ExecutionHandler):
     """
@@ -54,6 +77,10 @@ class SimulatedExecutionHandler(ExecutionHandler):
         """
         self.events = events
 
+    @staticmethod
+    def calculate_commission(quantity, price_filled):
+        return COMMISSION_RATE * abs(quantity) * price_filled
+
     def execute_order(self, event: events.OrderEvent):
         """
         Simply converts Order objects into Fill objects naively,
@@ -68,10 +95,317 @@ class SimulatedExecutionHandler(ExecutionHandler):
         time_executed = event.datetime
         bar_close_time = event.datetime
 
-        commission = (0.1/100) * abs(quantity) * price_filled
+        commission = self.calculate_commission(quantity, price_filled)
 
         # in case of live trading some magic has to be done here
         # if execution successsfull:
         fill_event = events.FillEvent(time_executed, bar_close_time, event.symbol,
                                'Binance', quantity, price_filled, commission)
-        self.events.put(fill_event)
\ No newline at end of file
+        self.events.put(fill_event)
+
+# latency distributions are partials of these functions rather than lambdas, so that the state of an execution
+# handler can be pickled, e.g. in a checkpoint of a backtest (see BackTester.save_checkpoint)
+def _constant(latency, rng):
+    return latency
+
+
+def _uniform(low, high, rng):
+    return rng.uniform(low, high)
+
+
+def _lognormal(mu, sigma, rng):
+    return rng.lognormal(mu, sigma)
+
+
+def _empirical(samples, rng):
+    return samples[rng.integers(len(samples))]
+
+
+def uniform_latency(low, high):
+    """
+    :return: latency distribution for LatencyExecutionHandler, uniform between low and high ms
+    """
+    return functools.partial(_uniform, low, high)
+
+
+def lognormal_latency(median, sigma=0.5):
+    """
+    :return: latency distribution for LatencyExecutionHandler, lognormal with the given median (ms),
+    a long right tail like real network latencies
+    """
+    return functools.partial(_lognormal, np.log(median), sigma)
+
+
+def empirical_latency(samples):
+    """
+    :param samples: measured latencies, ms, e.g. LiveExecutionHandler.latencies * 1000
+    :return: latency distribution for LatencyExecutionHandler, drawing from the samples
+    """
+    return functools.partial(_empirical, np.asarray(samples, dtype=float))
+
+
+class SlippageModel(object):
+    """
+    Price a market order is filled at, given the bar it is filled in
+    """
+
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def fill_price(self, quantity, bar, rng):
+        """
+        :param quantity: order quantity, positive to buy, negative to sell
+        :param bar: the bar the order is filled in
+        :param rng: numpy Generator of the execution handler
+        """
+        raise NotImplementedError("Should implement fill_price()")
+
+
+class NextBarSlippage(SlippageModel):
+    """
+    Fills at the open of the bar the order reaches the exchange in, moved against the order
+    by a fraction of the range the price travelled from the open: towards the high for buys,
+    towards the low for sells.
+    """
+
+    def __init__(self, fraction=0., randomize=False):
+        """
+        :param fraction: 0 fills at the open, 1 at the high (buy) or the low (sell)
+        :param randomize: draw the fraction uniformly from [0, fraction) for every order
+        """
+        self.fraction = fraction
+        self.randomize = randomize
+
+    def fill_price(self, quantity, bar, rng):
+        fraction = self.fraction * rng.random() if self.randomize else self.fraction
+        if quantity > 0:
+            return bar['open'] + fraction * (bar['high'] - bar['open'])
+        return bar['open'] - fraction * (bar['open'] - bar['low'])
+
+
+class LatencyExecutionHandler(SimulatedExecutionHandler):
+    """
+    Simulated execution with orders in flight: an order fired at the close of a bar reaches the exchange after
+    a latency drawn from a distribution and is filled in the bar it arrives in, at a price given by
+    the slippage model, i.e. never at the close it was decided on.
+    Any number of orders can be in flight at once, they are filled in the order they arrive, as bars come.
+    Time is the time of the bars, not of the clock, so backtests stay fast and reproducible for a seed.
+    Needs on_market to be registered for MarketEvents after the portfolio (backtesting.register_handlers does).
+    """
+
+    def __init__(self, events, latency=0, slippage=None, seed=None):
+        """
+        :param events: the dispatcher fills are put on
+        :param latency: ms from the close of the signal bar to the order reaching the exchange: a number,
+        or a distribution, callable taking a numpy Generator, e.g. lognormal_latency(200)
+        :param slippage: SlippageModel, default NextBarSlippage() fills at the open of the next bar
+        :param seed: seed of the latency and slippage draws
+        """
+        super().__init__(events)
+        self.latency = latency if callable(latency) else functools.partial(_constant, latency)
+        self.slippage = slippage if slippage is not None else NextBarSlippage()
+        self.rng = np.random.default_rng(seed)
+
+        self._in_flight = []  # heap of (arrival time, order number, order event)
+        self._n_orders = 0
+        self._bars = []  # bars of the last MarketEvent, orders arriving within them can be filled at once
+        self._close_times = []
+
+    @property
+    def orders_in_flight(self):
+        return len(self._in_flight)
+
+    def execute_order(self, event: events.OrderEvent):
+        # an order can't be filled in the bar it was decided on, the earliest is the next one
+        arrival = event.datetime + max(self.latency(self.rng), 1)
+        heapq.heappush(self._in_flight, (arrival, self._n_orders, event))
+        self._n_orders += 1
+        self._fill_arrived()
+
+    def on_market(self, event: events.MarketEvent):
+        self._bars = event.new_data if isinstance(event.new_data, list) else [event.new_data]
+        self._close_times = [bar['close_time'] for bar in self._bars]
+        self._fill_arrived()
+
+    def _fill_arrived(self):
+        # fills the orders that reached the exchange within the bars seen so far
+        in_flight = self._in_flight
+        while in_flight and self._close_times and in_flight[0][0] <= self._close_times[-1]:
+            arrival, _, order = heapq.heappop(in_flight)
+            bar = self._bars[bisect_left(self._close_times, arrival)]
+            quantity = order.quantity
+            price_filled = self.slippage.fill_price(quantity, bar, self.rng)
+            fill_event = events.FillEvent(max(arrival, bar['open_time']), bar['close_time'], order.symbol,
+                                          'Binance', quantity, price_filled,
+                                          self.calculate_commission(quantity, price_filled))
+            self.events.put(fill_event)
+
+
+class RateLimiter():
+    """
+    Token bucket for asyncio: at most rate acquisitions per second on average, bursts up to burst
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or 1
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()  # created in the loop it is used in
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LiveExecutionHandler(ExecutionHandler):
+    """
+    Sends market orders to the Binance REST api (POST /api/v3/order) and puts a FillEvent when an order is filled,
+    an OrderFailedEvent when it could not be placed.
+    execute_order returns at once: requests run as coroutines in an asyncio loop on a background thread,
+    so many orders can be in flight. They share a pool of at most max_connections connections
+    and are rate limited to rate_limit requests per second, requests rejected with 429 are retried after
+    the Retry-After the exchange sends.
+    Fills are put from the network thread: events has to be an EventDispatcher(thread_safe=True).
+    Needs aiohttp.
+    """
+
+    def __init__(self, events, api_key, api_secret, rest_url=data.BINANCE_REST_URL,
+                 max_connections=10, rate_limit=10, max_retries=3, recv_window=5000):
+        """
+        :param rest_url: base url of the REST api, e.g. of mock_exchange.MockExchange
+        :param max_connections: size of the connection pool
+        :param rate_limit: requests per second
+        :param max_retries: retries of a request rejected for the rate limit
+        """
+        self.events = events
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.rest_url = rest_url
+        self.max_connections = max_connections
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.max_retries = max_retries
+        self.recv_window = recv_window
+
+        self.latencies = []  # seconds from execute_order to the fill, of every filled order
+        self.failed = []  # (order event, exception) of orders that could not be placed
+        self._session = None
+        self._loop = None
+        self._thread = None
+        self._pending = set()
+
+    def start(self):
+        """
+        Starts the network loop on a background thread
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._open_session(), self._loop).result()
+
+    async def _open_session(self):
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        self._session = aiohttp.ClientSession(connector=connector, headers={'X-MBX-APIKEY': self.api_key})
+
+    def close(self, wait=True):
+        """
+        Stops the network loop
+        :param wait: let the orders in flight finish first
+        """
+        if self._thread is None:
+            return
+        if wait:
+            for future in list(self._pending):
+                future.result()
+        asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+
+    @property
+    def orders_in_flight(self):
+        return len(self._pending)
+
+    def execute_order(self, event: events.OrderEvent):
+        if self._thread is None:
+            self.start()
+        future = asyncio.run_coroutine_threadsafe(self.place_order(event), self._loop)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+
+    def _sign(self, params: dict) -> str:
+        query = urlencode(params)
+        signature = hmac.new(self.api_secret.encode(), query.encode(), hashlib.sha256).hexdigest()
+        return f'{query}&signature={signature}'
+
+    async def place_order(self, event: events.OrderEvent):
+        """
+        Coroutine placing one market order, puts its FillEvent on the events queue,
+        or an OrderFailedEvent if the order fails or its response can't be read
+        """
+        start = time.perf_counter()
+        if event.quantity == 0:
+            self.events.put(events.FillEvent(event.datetime, event.datetime, event.symbol, 'Binance', 0,
+                                             event.last_close_price, 0))
+            return
+        params = {
+            'symbol': event.symbol,
+            'side': 'BUY' if event.quantity > 0 else 'SELL',
+            'type': 'MARKET',
+            'quantity': f'{abs(event.quantity):.8f}',
+            'newOrderRespType': 'FULL',
+            'recvWindow': self.recv_window,
+        }
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self.rate_limiter.acquire()
+                params['timestamp'] = int(time.time() * 1000)
+                async with self._session.post(f'{self.rest_url}/api/v3/order', data=self._sign(params),
+                                              headers={'Content-Type': 'application/x-www-form-urlencoded'}
+                                              ) as response:
+                    if response.status in (418, 429) and attempt < self.max_retries:
+                        retry_after = float(response.headers.get('Retry-After', 1))
+                        logger.warning(f'{event.symbol} order rate limited, retrying in {retry_after} s')
+                        await asyncio.sleep(retry_after)
+                        continue
+                    response.raise_for_status()
+                    order = await response.json()
+                    break
+            fill = self._fill_event(event, params['side'], order)
+        except Exception as e:
+            # network errors as well as a response that can't be parsed, the portfolio must not wait for a fill
+            logger.error(f'{event.symbol} order of {event.quantity} failed: {e!r}')
+            self.failed.append((event, e))
+            self.events.put(events.OrderFailedEvent(event.symbol, event.datetime, event.quantity, repr(e)))
+            return
+        self.latencies.append(time.perf_counter() - start)
+        self.events.put(fill)
+
+    @staticmethod
+    def _fill_event(event: events.OrderEvent, side: str, order: dict) -> events.FillEvent:
+        # FillEvent of a FULL order response
+        quantity, quote, commission = 0., 0., 0.
+        for fill in order['fills']:
+            qty, price = float(fill['qty']), float(fill['price'])
+            quantity += qty
+            quote += qty * price
+            # commission in the base asset is converted to quote, in any other asset (BNB) it is taken as is
+            fee = float(fill['commission'])
+            commission += fee * price if event.symbol.startswith(fill['commissionAsset']) else fee
+        price_filled = quote / quantity if quantity else event.last_close_price
+        if side == 'SELL':
+            quantity = -quantity
+        return events.FillEvent(order['transactTime'], event.datetime, event.symbol, 'Binance',
+                                quantity, price_filled, commission)
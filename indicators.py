@@ -1,4 +1,14 @@
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from itertools import accumulate
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    from scipy.signal import lfilter
+except ImportError:  # scipy is optional, ema_array falls back to a python loop
+    lfilter = None
 
 
 class Indicator(object):
@@ -16,6 +26,136 @@ class Indicator(object):
         """
         raise NotImplementedError("Should implement calculate_indicator()")
 
+    def warm_up(self, data):
+        """
+        Seeds the state of the indicator from historical data in one pass over arrays, replacing the current state.
+        Feeding the same bars to calculate_next one by one gives the same state.
+        :param data: dict of field name -> array (asc order), e.g. data.candles_to_columns() output,
+        indicators of close prices take a plain array of closes as well
+        :return: indicator values for every bar, NaN while the indicator is not ready
+        """
+        raise NotImplementedError("Should implement warm_up()")
+
+
+def _column(data, name) -> np.ndarray:
+    if isinstance(data, dict):
+        return np.asarray(data[name], dtype=float)
+    if name != 'close':
+        raise ValueError(f'{name} values needed, pass a dict of columns')
+    return np.asarray(data, dtype=float)
+
+
+def _smooth(values, alpha, first) -> np.ndarray:
+    # y[i] = alpha * x[i] + (1 - alpha) * y[i-1], y[-1] = first
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return values.copy()
+    if lfilter is not None:
+        smoothed, _ = lfilter([alpha, 0.], [1., -(1 - alpha)], values, zi=[(1 - alpha) * first])
+        return smoothed
+    return np.array(list(accumulate(values.tolist(), lambda prev, x: alpha * x + (1 - alpha) * prev,
+                                    initial=first))[1:])
+
+
+class _Window(object):
+    """
+    Fixed size ring of the last n values
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.values = [0.] * n
+        self.pos = 0
+        self.count = 0
+
+    def push(self, value):
+        """
+        :return: the value that dropped out of the window, None while the window is not full
+        """
+        dropped = self.values[self.pos] if self.count == self.n else None
+        self.values[self.pos] = value
+        self.pos = (self.pos + 1) % self.n
+        self.count = min(self.count + 1, self.n)
+        return dropped
+
+    def fill(self, values):
+        """
+        Replaces the content with the last n of values
+        """
+        values = list(values)[-self.n:]
+        self.values = values + [0.] * (self.n - len(values))
+        self.count = len(values)
+        self.pos = self.count % self.n
+
+    def ordered(self) -> list:
+        if self.count < self.n:
+            return self.values[:self.count]
+        return self.values[self.pos:] + self.values[:self.pos]
+
+
+def _rolling_sum(values, n) -> np.ndarray:
+    # sum over the last n values for every bar, NaN for the first n - 1 bars
+    out = np.full(len(values), np.nan)
+    if len(values) >= n:
+        out[n - 1:] = sliding_window_view(values, n).sum(axis=1)
+    return out
+
+
+def ema_array(values, n, initial=None) -> np.ndarray:
+    """
+    Exponential moving average of a whole array, same recursion and the same float operations
+    as EMA.calculate_next, so the results are identical to feeding the values one by one.
+    :param values: 1d array of prices
+    :param n: ema period
+    :param initial: last ema value before values[0], if None the ema starts from values[0]
+    :return: array of ema values, same length as values
+    """
+    values = np.asarray(values, dtype=float)
+    alpha = 2 / (n + 1)
+    ema = np.empty_like(values)
+    if not len(values):
+        return ema
+
+    if initial:
+        first, rest, start = initial, values, 0
+    else:
+        first, rest, start = values[0], values[1:], 1
+        ema[0] = first
+
+    if not len(rest):
+        return ema
+
+    ema[start:] = _smooth(rest, alpha, first)
+    return ema
+
+
+
+def ema_grid(values, spans) -> np.ndarray:
+    """
+    Exponential moving averages of one array for many periods, e.g. all the periods of a parameter sweep.
+    Row i is identical to ema_array(values, spans[i]).
+    :param values: 1d array of prices
+    :param spans: ema periods
+    :return: 2d array, shape (len(spans), len(values))
+    """
+    values = np.asarray(values, dtype=float)
+    grid = np.empty((len(spans), len(values)))
+    if not len(spans) or not len(values):
+        return grid
+
+    if lfilter is not None:
+        # one C pass per period
+        for row, n in enumerate(spans):
+            grid[row] = ema_array(values, n)
+        return grid
+
+    # without scipy: step through the bars once, updating the emas of all periods together
+    alpha = 2 / (np.asarray(spans, dtype=float) + 1)
+    beta = 1 - alpha
+    grid[:, 0] = values[0]
+    for bar in range(1, len(values)):
+        grid[:, bar] = alpha * values[bar] + beta * grid[:, bar - 1]
+    return grid
 
 class EMA(Indicator):
     """
@@ -28,24 +168,410 @@ class EMA(Indicator):
         self.name = 'ema' + str(self.n)
 
     def calculate_next(self, data_feed: dict):
-        #  get newest candle, append ema values to self buffer
-        #  do I really need those bufers?
+        #  get newest candle, the only state needed is the last ema value
+        return self.update(data_feed['close'])
 
+    def update(self, value):
         alpha = 2 / (self.n + 1)
 
         if self.last_entry:
-            ema = alpha * data_feed['close'] + (1 - alpha) * self.last_entry
+            ema = alpha * value + (1 - alpha) * self.last_entry
 
         else:
-            ema = data_feed['close']
+            ema = value
 
         self.last_entry = ema
+        return ema
+
+    def calculate_array(self, values) -> np.ndarray:
+        """
+        Same as calling calculate_next for every value, but in one pass over an array
+        :return: ema for every value
+        """
+        ema = ema_array(values, self.n, initial=self.last_entry)
+        if len(ema):
+            self.last_entry = float(ema[-1])
+        return ema
+
+    def warm_up(self, data):
+        self.last_entry = None
+        return self.calculate_array(_column(data, 'close'))
+
+
+
+class SMA(Indicator):
+    """
+    Simple moving average of the last n close prices
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.window = _Window(n)
+        self.total = 0.
+        self.last_entry = None
+        self.name = 'sma' + str(self.n)
+
+    def calculate_next(self, data_feed: dict):
+        return self.update(data_feed['close'])
 
+    def update(self, value):
+        dropped = self.window.push(value)
+        self.total += value - (dropped or 0.)
+        if self.window.count == self.n:
+            self.last_entry = self.total / self.n
+        return self.last_entry
 
+    def warm_up(self, data):
+        values = _column(data, 'close')
+        self.window.fill(values.tolist())
+        self.total = float(np.sum(self.window.ordered()))
+        self.last_entry = self.total / self.n if self.window.count == self.n else None
+        return _rolling_sum(values, self.n) / self.n
 
-        
 
+class RSI(Indicator):
+    """
+    Relative strength index with Wilder's smoothing (alpha = 1 / n) of gains and losses,
+    the averages are seeded with the simple mean of the first n price changes
+    """
+
+    def __init__(self, n=14):
+        self.n = n
+        self.last_close = None
+        self.changes = 0  # number of price changes seen, up to n
+        self.avg_gain = 0.
+        self.avg_loss = 0.
+        self.last_entry = None
+        self.name = 'rsi' + str(self.n)
+
+    def _rsi(self, avg_gain, avg_loss):
+        if avg_loss == 0:
+            return 100. if avg_gain else 50.
+        return 100 - 100 / (1 + avg_gain / avg_loss)
+
+    def calculate_next(self, data_feed: dict):
+        return self.update(data_feed['close'])
+
+    def update(self, value):
+        if self.last_close is None:
+            self.last_close = value
+            return None
+        change = value - self.last_close
+        self.last_close = value
+        gain, loss = max(change, 0.), max(-change, 0.)
 
+        if self.changes < self.n:
+            # sums until there are n changes to average
+            self.avg_gain += gain
+            self.avg_loss += loss
+            self.changes += 1
+            if self.changes < self.n:
+                return None
+            self.avg_gain /= self.n
+            self.avg_loss /= self.n
+        else:
+            alpha = 1 / self.n
+            self.avg_gain = alpha * gain + (1 - alpha) * self.avg_gain
+            self.avg_loss = alpha * loss + (1 - alpha) * self.avg_loss
+
+        self.last_entry = self._rsi(self.avg_gain, self.avg_loss)
+        return self.last_entry
+
+    def warm_up(self, data):
+        values = _column(data, 'close')
+        out = np.full(len(values), np.nan)
+        self.__init__(self.n)
+        if not len(values):
+            return out
+        self.last_close = float(values[-1])
+        changes = np.diff(values)
+        gains, losses = np.maximum(changes, 0.), np.maximum(-changes, 0.)
+
+        if len(changes) < self.n:
+            self.changes = len(changes)
+            self.avg_gain = float(np.sum(gains))
+            self.avg_loss = float(np.sum(losses))
+            return out
+
+        self.changes = self.n
+        alpha = 1 / self.n
+        first_gain = float(np.sum(gains[:self.n])) / self.n
+        first_loss = float(np.sum(losses[:self.n])) / self.n
+        avg_gain = np.concatenate(([first_gain], _smooth(gains[self.n:], alpha, first_gain)))
+        avg_loss = np.concatenate(([first_loss], _smooth(losses[self.n:], alpha, first_loss)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+        rsi[avg_loss == 0] = np.where(avg_gain[avg_loss == 0] > 0, 100., 50.)
+        out[self.n:] = rsi
 
+        self.avg_gain, self.avg_loss = float(avg_gain[-1]), float(avg_loss[-1])
+        self.last_entry = float(rsi[-1])
+        return out
 
 
+class ATR(Indicator):
+    """
+    Average true range with Wilder's smoothing, seeded with the simple mean of the first n true ranges
+    """
+
+    def __init__(self, n=14):
+        self.n = n
+        self.last_close = None
+        self.ranges = 0  # number of true ranges seen, up to n
+        self.total = 0.  # sum of the first true ranges
+        self.last_entry = None
+        self.name = 'atr' + str(self.n)
+
+    def calculate_next(self, data_feed: dict):
+        high, low, close = data_feed['high'], data_feed['low'], data_feed['close']
+        if self.last_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high, self.last_close) - min(low, self.last_close)
+        self.last_close = close
+
+        if self.ranges < self.n:
+            self.total += true_range
+            self.ranges += 1
+            if self.ranges < self.n:
+                return None
+            self.last_entry = self.total / self.n
+        else:
+            alpha = 1 / self.n
+            self.last_entry = alpha * true_range + (1 - alpha) * self.last_entry
+        return self.last_entry
+
+    def warm_up(self, data):
+        high, low, close = _column(data, 'high'), _column(data, 'low'), _column(data, 'close')
+        out = np.full(len(close), np.nan)
+        self.__init__(self.n)
+        if not len(close):
+            return out
+        prev_close = np.concatenate(([np.nan], close[:-1]))
+        # fmax / fmin ignore the NaN of the first bar, which has only high - low
+        true_range = np.fmax(high, prev_close) - np.fmin(low, prev_close)
+        self.last_close = float(close[-1])
+
+        if len(true_range) < self.n:
+            self.ranges = len(true_range)
+            self.total = float(np.sum(true_range))
+            return out
+
+        self.ranges = self.n
+        self.total = float(np.sum(true_range[:self.n]))
+        first = self.total / self.n
+        atr = np.concatenate(([first], _smooth(true_range[self.n:], 1 / self.n, first)))
+        out[self.n - 1:] = atr
+        self.last_entry = float(atr[-1])
+        return out
+
+
+class Bollinger(Indicator):
+    """
+    Bollinger bands: simple moving average of the last n closes and the bands k standard deviations around it.
+    Mean and variance of the window are updated with Welford's method, no sums of squares
+    """
+
+    def __init__(self, n=20, k=2):
+        self.n = n
+        self.k = k
+        self.window = _Window(n)
+        self.mean = 0.
+        self.m2 = 0.  # sum of squared differences from the mean
+        self.last_entry = None  # (middle, upper, lower)
+        self.name = 'bb' + str(self.n)
+
+    def calculate_next(self, data_feed: dict):
+        return self.update(data_feed['close'])
+
+    def update(self, value):
+        dropped = self.window.push(value)
+        if dropped is None:
+            delta = value - self.mean
+            self.mean += delta / self.window.count
+            self.m2 += delta * (value - self.mean)
+        else:
+            old_mean = self.mean
+            self.mean += (value - dropped) / self.n
+            self.m2 += (value - dropped) * (value - self.mean + dropped - old_mean)
+        if self.window.count < self.n:
+            return None
+        width = self.k * np.sqrt(max(self.m2, 0.) / self.n)
+        self.last_entry = (self.mean, self.mean + width, self.mean - width)
+        return self.last_entry
+
+    def warm_up(self, data):
+        """
+        :return: 2d array of middle, upper and lower bands, shape (3, bars)
+        """
+        values = _column(data, 'close')
+        out = np.full((3, len(values)), np.nan)
+        self.window.fill(values.tolist())
+        last = np.array(self.window.ordered())
+        self.mean = float(last.mean()) if len(last) else 0.
+        self.m2 = float(np.sum((last - self.mean) ** 2))
+        self.last_entry = None
+        if len(values) < self.n:
+            return out
+
+        windows = sliding_window_view(values, self.n)
+        middle = windows.mean(axis=1)
+        width = self.k * windows.std(axis=1)
+        out[:, self.n - 1:] = middle, middle + width, middle - width
+        width = self.k * np.sqrt(self.m2 / self.n)
+        self.last_entry = (self.mean, self.mean + width, self.mean - width)
+        return out
+
+
+class MACD(Indicator):
+    """
+    Moving average convergence divergence: fast ema - slow ema, its signal line (ema of it) and the histogram
+    """
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.ema_fast = EMA(fast)
+        self.ema_slow = EMA(slow)
+        self.signal_n = signal
+        self.signal = None
+        self.last_entry = None  # (macd, signal, histogram)
+        self.name = f'macd{fast}_{slow}_{signal}'
+
+    def calculate_next(self, data_feed: dict):
+        return self.update(data_feed['close'])
+
+    def update(self, value):
+        macd = self.ema_fast.update(value) - self.ema_slow.update(value)
+        # macd starts from 0, so the signal line can't use EMA, which restarts from a falsy last value
+        if self.signal is None:
+            self.signal = macd
+        else:
+            alpha = 2 / (self.signal_n + 1)
+            self.signal = alpha * macd + (1 - alpha) * self.signal
+        self.last_entry = (macd, self.signal, macd - self.signal)
+        return self.last_entry
+
+    def warm_up(self, data):
+        """
+        :return: 2d array of macd, signal and histogram, shape (3, bars)
+        """
+        values = _column(data, 'close')
+        macd = self.ema_fast.warm_up(values) - self.ema_slow.warm_up(values)
+        signal = np.empty_like(macd)
+        if len(macd):
+            signal[0] = macd[0]
+            signal[1:] = _smooth(macd[1:], 2 / (self.signal_n + 1), macd[0])
+        out = np.array([macd, signal, macd - signal]).reshape(3, len(values))
+        self.signal = float(signal[-1]) if len(values) else None
+        self.last_entry = tuple(out[:, -1].tolist()) if len(values) else None
+        return out
+
+
+class _RollingExtreme(Indicator):
+    """
+    Extreme value of the last n values of a field. Keeps a monotonic queue of the window's candidates
+    for the extreme, every value enters and leaves it once: amortised O(1) updates
+    """
+
+    def __init__(self, n, field='close'):
+        self.n = n
+        self.field = field
+        self.bar = 0  # number of values seen
+        self.candidates = deque()  # (bar, value), values ordered so that the first one is the extreme
+        self.last_entry = None
+        self.name = self._prefix + str(self.n)
+
+    def _beats(self, a, b):
+        raise NotImplementedError("Should implement _beats()")
+
+    def calculate_next(self, data_feed: dict):
+        return self.update(data_feed[self.field])
+
+    def update(self, value):
+        while self.candidates and not self._beats(self.candidates[-1][1], value):
+            self.candidates.pop()
+        self.candidates.append((self.bar, value))
+        if self.candidates[0][0] <= self.bar - self.n:
+            self.candidates.popleft()
+        self.bar += 1
+        if self.bar >= self.n:
+            self.last_entry = self.candidates[0][1]
+        return self.last_entry
+
+    def warm_up(self, data):
+        values = _column(data, self.field)
+        out = np.full(len(values), np.nan)
+        self.bar = len(values)
+        self.last_entry = None
+        # candidates of the last window: values beating every later value in it
+        window = values[-self.n:]
+        later = self._accumulate(window[::-1])[::-1]  # extreme of the window from each value on
+        keep = np.ones(len(window), dtype=bool)
+        keep[:-1] = self._beats(window[:-1], later[1:])
+        start = len(values) - len(window)
+        self.candidates = deque(zip((start + np.flatnonzero(keep)).tolist(), window[keep].tolist()))
+        if len(values) >= self.n:
+            out[self.n - 1:] = self._reduce(sliding_window_view(values, self.n), axis=1)
+            self.last_entry = self.candidates[0][1]
+        return out
+
+
+class RollingMax(_RollingExtreme):
+    """
+    Highest value of a field over the last n bars, e.g. RollingMax(20, 'high') for the upper Donchian channel
+    """
+    _prefix = 'max'
+    _accumulate = staticmethod(np.maximum.accumulate)
+    _reduce = staticmethod(np.max)
+
+    def _beats(self, a, b):
+        return a > b
+
+
+class RollingMin(_RollingExtreme):
+    """
+    Lowest value of a field over the last n bars
+    """
+    _prefix = 'min'
+    _accumulate = staticmethod(np.minimum.accumulate)
+    _reduce = staticmethod(np.min)
+
+    def _beats(self, a, b):
+        return a < b
+
+
+class VWAP(Indicator):
+    """
+    Volume weighted average of the typical price (high + low + close) / 3 over the last n bars
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.prices = _Window(n)  # price * volume
+        self.volumes = _Window(n)
+        self.price_volume = 0.
+        self.volume = 0.
+        self.last_entry = None
+        self.name = 'vwap' + str(self.n)
+
+    def calculate_next(self, data_feed: dict):
+        typical = (data_feed['high'] + data_feed['low'] + data_feed['close']) / 3
+        price_volume = typical * data_feed['volume']
+        self.price_volume += price_volume - (self.prices.push(price_volume) or 0.)
+        self.volume += data_feed['volume'] - (self.volumes.push(data_feed['volume']) or 0.)
+        if self.prices.count == self.n and self.volume:
+            self.last_entry = self.price_volume / self.volume
+        return self.last_entry
+
+    def warm_up(self, data):
+        typical = (_column(data, 'high') + _column(data, 'low') + _column(data, 'close')) / 3
+        volume = _column(data, 'volume')
+        price_volume = typical * volume
+        self.prices.fill(price_volume.tolist())
+        self.volumes.fill(volume.tolist())
+        self.price_volume = float(np.sum(self.prices.ordered()))
+        self.volume = float(np.sum(self.volumes.ordered()))
+        self.last_entry = None
+        if self.prices.count == self.n and self.volume:
+            self.last_entry = self.price_volume / self.volume
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return _rolling_sum(price_volume, self.n) / _rolling_sum(volume, self.n)
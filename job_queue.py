@@ -0,0 +1,373 @@
+"""
+Job queue for spreading backtests over worker processes on any number of machines.
+A broker (JobBroker, served by a multiprocessing manager over TCP) holds the jobs, workers connect to it,
+lease jobs one at a time, send heartbeats while they run them and send back the results.
+A job whose worker stops sending heartbeats, or that fails, goes back to the queue, up to max_retries attempts.
+The submitting side (JobQueue.map) gets the results in the order of the jobs, whatever order they finish in.
+
+Everything runs on one box too: start_broker starts a local broker process, start_workers local worker processes.
+Workers on other machines: python -m job_queue --address <broker host>:<port>, with the broker's key in
+the environment variable BTB_JOB_QUEUE_AUTHKEY (or --authkey <key>).
+The broker and the workers exchange pickles, anyone with the key can run code on them: a broker listening
+on a non-loopback address has to be given a secret key, a local one gets a random key if none is given.
+"""
+import argparse
+from collections import deque, OrderedDict
+import ipaddress
+import logging
+from multiprocessing import Process
+from multiprocessing.managers import BaseManager
+import os
+import secrets
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+logger = logging.getLogger(__name__)
+
+LEASE_TIMEOUT = 30.  # seconds without a heartbeat before a job is given to another worker
+HEARTBEAT_INTERVAL = 5.
+MAX_RETRIES = 3  # attempts per job, failed or lost ones included
+CONTEXT_CACHE_SIZE = 4  # contexts a worker keeps
+AUTHKEY_ENV = 'BTB_JOB_QUEUE_AUTHKEY'  # environment variable the worker command line takes the key from
+
+
+class JobFailed(Exception):
+    pass
+
+
+class JobBroker():
+    """
+    Queue of jobs and their results, lives in the broker process, clients call it through proxies.
+    A job is a payload run within a context: a callable and the arguments shared by many jobs
+    (e.g. the candles of a sweep), sent to each worker once. The worker calls function(*args, *payload).
+    """
+
+    def __init__(self, lease_timeout=LEASE_TIMEOUT, max_retries=MAX_RETRIES):
+        self.lease_timeout = lease_timeout
+        self.max_retries = max_retries
+        self._condition = threading.Condition()
+        self._contexts = {}  # context id -> (function, args)
+        self._jobs = {}  # job id -> (context id, payload), until the job is done
+        self._pending = deque()  # job ids waiting for a worker
+        self._leases = {}  # job id -> (worker id, deadline)
+        self._attempts = {}  # job id -> number of times it was leased
+        self._done = {}  # job id -> (True, result) or (False, error), until collected
+        self._workers = {}  # worker id -> time last seen
+        self.retried = 0
+
+    def put_context(self, context_id, context):
+        with self._condition:
+            self._contexts[context_id] = context
+
+    def get_context(self, context_id):
+        with self._condition:
+            return self._contexts[context_id]
+
+    def drop_context(self, context_id):
+        with self._condition:
+            self._contexts.pop(context_id, None)
+
+    def submit(self, jobs: list):
+        """
+        :param jobs: list of (job id, context id, payload)
+        """
+        with self._condition:
+            for job_id, context_id, payload in jobs:
+                self._jobs[job_id] = (context_id, payload)
+                self._attempts[job_id] = 0
+                self._pending.append(job_id)
+            self._condition.notify_all()
+
+    def take(self, worker_id, timeout=1.):
+        """
+        Leases the next job to a worker, waits up to timeout seconds for one
+        :return: (job id, context id, payload) or None
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._workers[worker_id] = time.time()
+            while True:
+                self._requeue_expired()
+                if self._pending:
+                    job_id = self._pending.popleft()
+                    self._leases[job_id] = (worker_id, time.monotonic() + self.lease_timeout)
+                    self._attempts[job_id] += 1
+                    context_id, payload = self._jobs[job_id]
+                    return job_id, context_id, payload
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                # wake up in time to requeue the leases that expire meanwhile
+                self._condition.wait(min(remaining, self.lease_timeout))
+
+    def heartbeat(self, worker_id, job_id) -> bool:
+        """
+        Extends the lease of a running job
+        :return: False if the job is not leased to the worker any more, it can be abandoned
+        """
+        with self._condition:
+            self._workers[worker_id] = time.time()
+            lease = self._leases.get(job_id)
+            if lease is None or lease[0] != worker_id:
+                return False
+            self._leases[job_id] = (worker_id, time.monotonic() + self.lease_timeout)
+            return True
+
+    def complete(self, worker_id, job_id, result):
+        with self._condition:
+            self._workers[worker_id] = time.time()
+            # a job can finish twice if its lease expired meanwhile, the first result is kept
+            if job_id in self._jobs:
+                self._finish(job_id, (True, result))
+
+    def fail(self, worker_id, job_id, error: str):
+        with self._condition:
+            self._workers[worker_id] = time.time()
+            lease = self._leases.get(job_id)
+            if job_id not in self._jobs or lease is None or lease[0] != worker_id:
+                return
+            logger.warning(f'job {job_id} failed on {worker_id}: {error}')
+            self._retry(job_id, error)
+
+    def collect(self, job_ids, timeout=1.) -> dict:
+        """
+        Waits up to timeout seconds for any of the jobs to be done
+        :return: dict job id -> (True, result) or (False, error) of the jobs done, removed from the broker
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                self._requeue_expired()
+                done = {job_id: self._done.pop(job_id) for job_id in job_ids if job_id in self._done}
+                remaining = deadline - time.monotonic()
+                if done or remaining <= 0:
+                    return done
+                self._condition.wait(min(remaining, self.lease_timeout))
+
+    def cancel(self, job_ids):
+        """
+        Forgets the jobs, the running ones finish but their results are dropped
+        """
+        with self._condition:
+            for job_id in job_ids:
+                if job_id in self._jobs:
+                    self._finish(job_id, None)
+                self._done.pop(job_id, None)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {'pending': len(self._pending), 'running': len(self._leases), 'done': len(self._done),
+                    'retried': self.retried, 'workers': dict(self._workers)}
+
+    def _finish(self, job_id, outcome):
+        del self._jobs[job_id]
+        self._attempts.pop(job_id, None)
+        # a job is either leased or queued, only a lost one can be finished from the queue
+        if self._leases.pop(job_id, None) is None and job_id in self._pending:
+            self._pending.remove(job_id)
+        self._done[job_id] = outcome
+        self._condition.notify_all()
+
+    def _retry(self, job_id, error):
+        self._leases.pop(job_id, None)
+        if self._attempts[job_id] >= self.max_retries:
+            self._finish(job_id, (False, f'{self._attempts[job_id]} attempts, last: {error}'))
+            return
+        self.retried += 1
+        # retried jobs go first, the submitter waits for them to hand out the results in order
+        self._pending.appendleft(job_id)
+        self._condition.notify_all()
+
+    def _requeue_expired(self):
+        now = time.monotonic()
+        for job_id, (worker_id, deadline) in list(self._leases.items()):
+            if deadline < now:
+                logger.warning(f'job {job_id}: no heartbeat from {worker_id}, giving it to another worker')
+                self._retry(job_id, f'lease of {worker_id} expired')
+
+
+# the broker of the broker process, see start_broker
+_broker = None
+
+
+def _init_broker(lease_timeout, max_retries):
+    global _broker
+    _broker = JobBroker(lease_timeout, max_retries)
+
+
+def _get_broker():
+    return _broker
+
+
+class BrokerManager(BaseManager):
+    pass
+
+
+BrokerManager.register('broker', callable=_get_broker)
+
+
+def _is_loopback(host) -> bool:
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback if host else False
+    except (OSError, ValueError):
+        return False
+
+
+def start_broker(address=('127.0.0.1', 0), authkey=None, lease_timeout=LEASE_TIMEOUT,
+                 max_retries=MAX_RETRIES) -> BrokerManager:
+    """
+    Starts a broker in a new process
+    :param address: (host, port) to listen on, port 0 for any free one, see the address of the returned manager.
+    Listen on '0.0.0.0' for workers on other machines
+    :param authkey: bytes, secret key of the clients and the workers. Required unless the broker listens
+    on a loopback address only, a random key is generated then. Raises ValueError if missing
+    :return: started BrokerManager, shutdown() stops the broker, its authkey is the key to connect with
+    """
+    if authkey is None:
+        if not _is_loopback(address[0]):
+            raise ValueError(f'a broker listening on {address[0]!r} needs a secret authkey: anyone who can reach '
+                             f'it and knows the key can run code on the broker and its workers')
+        authkey = secrets.token_bytes(32)
+    manager = BrokerManager(address=address, authkey=authkey)
+    manager.start(_init_broker, (lease_timeout, max_retries))
+    manager.authkey = authkey
+    return manager
+
+
+def connect(address, authkey):
+    """
+    :return: proxy of the JobBroker at address
+    """
+    manager = BrokerManager(address=tuple(address), authkey=authkey)
+    manager.connect()
+    return manager.broker()
+
+
+class JobQueue():
+    """
+    Submitting side: runs a function on many payloads through the broker's workers
+    """
+
+    def __init__(self, address, authkey, poll_interval=1.):
+        """
+        :param address: (host, port) of the broker
+        :param authkey: the broker's key, see start_broker
+        :param poll_interval: seconds to wait for results at a time
+        """
+        self.address = address
+        self.authkey = authkey
+        self.poll_interval = poll_interval
+        self.broker = connect(address, authkey)
+
+    def map(self, function, args: tuple, payloads: list):
+        """
+        Runs function(*args, *payload) for every payload on the workers. args are sent to each worker once.
+        function has to be importable by the workers, i.e. defined at the top level of a module.
+        :return: generator of the results in the order of payloads, each one as soon as it and the ones before it
+        are done. Raises JobFailed if a job failed max_retries times
+        """
+        context_id = uuid.uuid4().hex
+        job_ids = [f'{context_id}:{i}' for i in range(len(payloads))]
+        self.broker.put_context(context_id, (function, args))
+        try:
+            self.broker.submit([(job_id, context_id, payload) for job_id, payload in zip(job_ids, payloads)])
+            results = {}
+            waiting = set(job_ids)
+            for job_id in job_ids:
+                while job_id not in results:
+                    for done_id, (ok, result) in self.broker.collect(list(waiting), self.poll_interval).items():
+                        if not ok:
+                            raise JobFailed(f'job {done_id} failed: {result}')
+                        results[done_id] = result
+                        waiting.discard(done_id)
+                yield results.pop(job_id)
+        finally:
+            # nothing left if all the results were handed out, otherwise the jobs still queued are dropped
+            self.broker.cancel(job_ids)
+            self.broker.drop_context(context_id)
+
+
+def _heartbeat(broker, worker_id, job_id, interval, stop: threading.Event):
+    while not stop.wait(interval):
+        try:
+            if not broker.heartbeat(worker_id, job_id):
+                return
+        except (OSError, EOFError):
+            return
+
+
+def run_worker(address, authkey, worker_id=None, heartbeat_interval=HEARTBEAT_INTERVAL, max_jobs=None,
+               idle_timeout=None):
+    """
+    Takes jobs from the broker and runs them until the broker goes away
+    :param worker_id: name of the worker in the broker's stats, default host:pid
+    :param max_jobs: stop after this many jobs
+    :param idle_timeout: stop after this many seconds without a job
+    """
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    broker = connect(address, authkey)
+    contexts = OrderedDict()
+    n_jobs = 0
+    idle_since = time.monotonic()
+    while max_jobs is None or n_jobs < max_jobs:
+        try:
+            job = broker.take(worker_id, timeout=1.)
+        except (OSError, EOFError):
+            logger.info(f'{worker_id}: broker is gone, stopping')
+            return
+        if job is None:
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                return
+            continue
+        job_id, context_id, payload = job
+        n_jobs += 1
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, args=(broker, worker_id, job_id, heartbeat_interval, stop),
+                                     daemon=True)
+        heartbeat.start()
+        try:
+            if context_id not in contexts:
+                contexts[context_id] = broker.get_context(context_id)
+                if len(contexts) > CONTEXT_CACHE_SIZE:
+                    contexts.popitem(last=False)
+            function, args = contexts[context_id]
+            result = function(*args, *payload)
+        except Exception:
+            stop.set()
+            broker.fail(worker_id, job_id, traceback.format_exc(limit=5))
+        else:
+            stop.set()
+            broker.complete(worker_id, job_id, result)
+        heartbeat.join()
+        idle_since = time.monotonic()
+
+
+def start_workers(n_workers, address, authkey, **kwargs) -> list:
+    """
+    Starts local worker processes, see run_worker
+    :return: the processes, they stop when the broker is shut down
+    """
+    workers = [Process(target=run_worker, args=(address, authkey), kwargs=kwargs, daemon=True)
+               for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a job queue worker')
+    parser.add_argument('--address', required=True, help='host:port of the broker')
+    # a key on the command line is seen by the other users of the machine, the environment variable is not
+    parser.add_argument('--authkey', default=os.environ.get(AUTHKEY_ENV),
+                        help=f'secret key of the broker, default the environment variable {AUTHKEY_ENV}')
+    parser.add_argument('--heartbeat-interval', type=float, default=HEARTBEAT_INTERVAL)
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error(f'the broker\'s key is needed, set {AUTHKEY_ENV} or pass --authkey')
+    host, port = args.address.rsplit(':', 1)
+    logging.basicConfig(level=logging.INFO)
+    run_worker((host, int(port)), args.authkey.encode(), heartbeat_interval=args.heartbeat_interval)
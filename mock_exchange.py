@@ -0,0 +1,214 @@
+"""
+Local stand-in for the Binance endpoints the live handlers use, serving prerecorded or synthetic candles,
+so live data handling and order execution can be run and benchmarked without the exchange. Needs aiohttp.
+"""
+import asyncio
+from collections import deque
+import hashlib
+import hmac
+import json
+import threading
+import time
+from urllib.parse import parse_qsl
+
+from aiohttp import web, WSMsgType
+
+import data
+import execution
+
+
+class MockExchange():
+    """
+    Replays candles on a fast clock: every bar_delay seconds the next candle closes and is sent to the kline
+    websocket subscribers (ws://host:port/ws/<symbol>@kline_<interval>), closed candles can be downloaded
+    from the klines REST endpoint (http://host:port/api/v3/klines).
+    Can drop the websocket connections every n candles, to exercise reconnects and backfills.
+    Market orders sent to the order endpoint (POST http://host:port/api/v3/order) are filled
+    at the close of the last closed candle, after order_delay, with Binance's FULL response.
+    """
+
+    def __init__(self, candles, symbol='BTCUSDT', interval='1m', bar_delay=0.01, closed_at_start=0,
+                 disconnect_every=None, api_key=None, api_secret=None, order_delay=0., order_rate_limit=None,
+                 host='127.0.0.1', port=0):
+        """
+        :param candles: CandleDataset or list of candle tuples in desc order, as get_candles returns them
+        :param bar_delay: seconds between two candles closing
+        :param closed_at_start: number of candles already closed when the exchange starts, history for backfills
+        :param disconnect_every: close the websocket connections after every n candles
+        :param api_key: if set, orders need this X-MBX-APIKEY header
+        :param api_secret: if set, orders need a valid signature
+        :param order_delay: seconds the exchange takes to fill an order
+        :param order_rate_limit: orders per second, more within a second are rejected with 429
+        :param port: 0 for any free port, see rest_url and stream_url
+        """
+        self.dataset = candles if isinstance(candles, data.CandleDataset) else data.CandleDataset.from_candles(candles)
+        self.symbol = symbol
+        self.interval = interval
+        self.bar_delay = bar_delay
+        self.closed = closed_at_start  # number of candles closed so far
+        self.disconnect_every = disconnect_every
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.order_delay = order_delay
+        self.order_rate_limit = order_rate_limit
+        self.host = host
+        self.port = port
+
+        self.sent_at = {}  # close_time -> time.perf_counter() when the candle was sent to the stream
+        self.subscribers = set()
+        self.orders = []  # responses to the filled orders
+        self.rejected = 0  # orders rejected for the rate limit
+        self.max_concurrent_orders = 0
+        self._concurrent_orders = 0
+        self._order_times = deque()  # arrival of the orders within the last second
+        self._runner = None
+        self._clock = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def rest_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def stream_url(self):
+        return f'ws://{self.host}:{self.port}'
+
+    @property
+    def finished(self):
+        return self.closed >= len(self.dataset)
+
+    def _kline(self, i) -> list:
+        # the candle as the klines REST endpoint returns it, prices and volumes are strings
+        bar = self.dataset.get_bar(i)
+        return [bar['open_time'], str(bar['open']), str(bar['high']), str(bar['low']), str(bar['close']),
+                str(bar['volume']), bar['close_time'], str(bar['quote_vol']), bar['num_trades'],
+                str(bar['buy_base_vol']), str(bar['buy_quote_vol']), '0']
+
+    def _kline_message(self, i) -> str:
+        kline = self._kline(i)
+        return json.dumps({
+            'e': 'kline', 'E': int(time.time() * 1000), 's': self.symbol,
+            'k': {'t': kline[0], 'T': kline[6], 's': self.symbol, 'i': self.interval,
+                  'o': kline[1], 'h': kline[2], 'l': kline[3], 'c': kline[4], 'v': kline[5],
+                  'n': kline[8], 'x': True, 'q': kline[7], 'V': kline[9], 'Q': kline[10]}
+        })
+
+    async def get_klines(self, request):
+        start_ts = int(request.query.get('startTime', 0))
+        end_ts = int(request.query.get('endTime', 2 ** 62))
+        limit = min(int(request.query.get('limit', 500)), data.KLINES_LIMIT)
+        klines = []
+        for i in range(self.dataset.index_of(start_ts), self.closed):
+            if self.dataset.values[i, 0] < start_ts or self.dataset.values[i, 1] < 0:  # missing candles are not served
+                continue
+            if self.dataset.values[i, 0] > end_ts or len(klines) == limit:
+                break
+            klines.append(self._kline(i))
+        return web.json_response(klines)
+
+    async def post_order(self, request):
+        body = await request.text()
+        if self.api_key is not None and request.headers.get('X-MBX-APIKEY') != self.api_key:
+            return web.json_response({'code': -2014, 'msg': 'API-key format invalid.'}, status=401)
+        query, _, signature = body.rpartition('&signature=')
+        if self.api_secret is not None:
+            expected = hmac.new(self.api_secret.encode(), query.encode(), hashlib.sha256).hexdigest()
+            if not hmac.compare_digest(signature, expected):
+                return web.json_response({'code': -1022, 'msg': 'Signature for this request is not valid.'},
+                                         status=400)
+
+        now = time.monotonic()
+        while self._order_times and now - self._order_times[0] >= 1:
+            self._order_times.popleft()
+        if self.order_rate_limit is not None and len(self._order_times) >= self.order_rate_limit:
+            self.rejected += 1
+            return web.json_response({'code': -1003, 'msg': 'Too many requests.'}, status=429,
+                                     headers={'Retry-After': '1'})
+        self._order_times.append(now)
+
+        params = dict(parse_qsl(query))
+        if params.get('symbol') != self.symbol or params.get('type') != 'MARKET':
+            return web.json_response({'code': -1100, 'msg': 'Illegal parameters.'}, status=400)
+        self._concurrent_orders += 1
+        self.max_concurrent_orders = max(self.max_concurrent_orders, self._concurrent_orders)
+        try:
+            await asyncio.sleep(self.order_delay)
+        finally:
+            self._concurrent_orders -= 1
+
+        close = data.CANDLE_FIELDS.index('close')
+        price = self.dataset.values[self.closed - 1, close] if self.closed else self.dataset.values[0, 1]
+        quantity = float(params['quantity'])
+        order = {
+            'symbol': self.symbol, 'orderId': len(self.orders), 'clientOrderId': f'mock{len(self.orders)}',
+            'transactTime': int(time.time() * 1000), 'price': '0.00000000', 'origQty': params['quantity'],
+            'executedQty': params['quantity'], 'cummulativeQuoteQty': str(quantity * price),
+            'status': 'FILLED', 'timeInForce': 'GTC', 'type': 'MARKET', 'side': params['side'],
+            'fills': [{'price': str(price), 'qty': params['quantity'],
+                       'commission': str(execution.COMMISSION_RATE * quantity * price), 'commissionAsset': 'USDT'}]
+        }
+        self.orders.append(order)
+        return web.json_response(order)
+
+    async def stream(self, request):
+        if request.match_info['stream'] != f'{self.symbol.lower()}@kline_{self.interval}':
+            raise web.HTTPNotFound()
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.subscribers.add(ws)
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self.subscribers.discard(ws)
+        return ws
+
+    async def _run_clock(self):
+        while not self.finished:
+            await asyncio.sleep(self.bar_delay)
+            i = self.closed
+            self.closed += 1
+            if self.dataset.values[i, 1] < 0:
+                continue
+            message = self._kline_message(i)
+            self.sent_at[int(self.dataset.close_time[i])] = time.perf_counter()
+            for ws in list(self.subscribers):
+                await ws.send_str(message)
+            if self.disconnect_every and self.closed % self.disconnect_every == 0:
+                for ws in list(self.subscribers):
+                    await ws.close()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/api/v3/klines', self.get_klines)
+        app.router.add_get('/ws/{stream}', self.stream)
+        app.router.add_post('/api/v3/order', self.post_order)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        self._clock = asyncio.get_running_loop().create_task(self._run_clock())
+
+    async def stop(self):
+        self._clock.cancel()
+        for ws in list(self.subscribers):
+            await ws.close()
+        await self._runner.cleanup()
+
+    def start_in_thread(self):
+        """
+        Runs the exchange in its own asyncio loop on a background thread
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -1,5 +1,8 @@
-from itertools import product
-import copy
+from concurrent.futures import ProcessPoolExecutor
+import math
+import multiprocessing
+from multiprocessing import shared_memory
+import os
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -7,110 +10,435 @@ import seaborn as sns
 
 import strategy
 import backtesting
+import data
+import indicators
+import search as search_module
 
-import spooky
-from binance_sql import historical_data as ghd
 import btb_helpers as hlp
 
+# state of an optimizer worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(shm_name, shape, strategy, symbol, interval, start, end, warm_up=None, prune=None, best=None):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['shm'] = shm  # keep a reference, the array below is a view of its buffer
+    _worker['dataset'] = data.CandleDataset(np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+    _worker['strategy'] = strategy
+    _worker['symbol'] = symbol
+    _worker['interval'] = interval
+    _worker['start'] = start
+    _worker['end'] = end
+    _worker['warm_up'] = warm_up  # (closes, precomputed) to warm the strategies up on
+    _worker['prune'] = prune
+    _worker['best'] = best  # best score of the finished backtests, shared by the workers
+
+
+def _run_grid_point(kwargs):
+    """
+    Runs one backtest in a worker process, candles are read from the shared memory.
+    :return: backtest results, close time of the last bar processed if it was pruned (else None)
+    """
+    interval_ts = hlp.interval_to_milliseconds(_worker['interval'])
+    strategy = _worker['strategy'](interval_ts, **kwargs)
+    if _worker['warm_up'] is not None:
+        strategy.warm_up(*_worker['warm_up'])
+    backtester = backtesting.BackTester(strategy, _worker['symbol'], _worker['interval'])
+    return _run_event(backtester, kwargs, _worker['start'], _worker['end'], _worker['dataset'], _worker['prune'],
+                      _worker['best'])
+
+
+def _run_job(strategy, symbol, interval, start, end, candles, warm_up, kwargs) -> tuple:
+    """
+    Runs one backtest on a job queue worker, see job_queue.
+    :return: backtest results without the drawdown series, and None (never pruned)
+    """
+    strategy = strategy(hlp.interval_to_milliseconds(interval), **kwargs)
+    if warm_up is not None:
+        strategy.warm_up(*warm_up)
+    backtester = backtesting.BackTester(strategy, symbol, interval)
+    backtest_results = backtester.run_test(start, end, draw=False, print_results=False,
+                                           imported_data=data.CandleDataset(candles))
+    if backtest_results:
+        # only the scalar results are sent back to the optimizer
+        backtest_results.pop('drawdown_df', None)
+    return backtest_results, None
+
+
+def _run_event(backtester, kwargs, start, end, dataset, prune, best) -> tuple:
+    """
+    Event driven backtest of a grid point, aborted as soon as prune finds it hopeless.
+    A finished backtest raises best to its score.
+    :return: backtest results, close time of the last bar processed if it was pruned (else None)
+    """
+    stop_condition = None
+    if prune is not None and len(dataset) > 1:
+        first_ts, last_ts = dataset.close_time[0], dataset.close_time[-1]
+
+        def stop_condition(tracker):
+            # part of the candles processed so far
+            progress = (tracker.last_time - first_ts) / (last_ts - first_ts) if tracker.last_time else 0.
+            return prune(tracker, best.value, progress)
+
+    backtest_results = backtester.run_test(start, end, draw=False, print_results=False, imported_data=dataset,
+                                           stop_condition=stop_condition)
+    if stop_condition is not None and backtester.stopped:
+        return backtest_results, backtester.tracker.last_time
+    record = Optimizer.result_record(kwargs, backtest_results)
+    if best is not None and record:
+        with best.get_lock():
+            best.value = max(best.value, record['af_score'])
+    return backtest_results, None
+
+
+class NoFinishedRun(Exception):
+    """
+    None of the backtests of an optimisation ran to the end with trades: all of them were pruned or had no trades
+    """
+    pass
+
+
+class Pruner():
+    """
+    Tells optimize_ema when a backtest is hopeless, so it is aborted instead of run to the end of the candles:
+    - its max drawdown went below max_drawdown (percent), or
+    - once min_progress of the candles are processed, its af_score so far (Optimizer.running_score) is more
+    than margin below the best af_score of the backtests finished so far.
+    Checked every check_every bars. It is a heuristic: a pruned run could have caught up by the end,
+    so the winner CAN change. The default margin kept the winner of the grids tried, a narrower one or an earlier
+    min_progress prunes more and risks it more (a margin of 100 changed it). A pruned run never wins,
+    see Optimizer.best_record.
+    """
+
+    def __init__(self, max_drawdown=-90., margin=300., min_progress=0.5, check_every=24):
+        """
+        :param max_drawdown: percent, <= 0, None to only compare with the best score
+        :param margin: af_score points, None to only check the drawdown
+        :param min_progress: part of the candles processed before the score is compared
+        """
+        self.max_drawdown = max_drawdown
+        self.margin = margin
+        self.min_progress = min_progress
+        self.check_every = check_every
+
+    def __call__(self, tracker, best_score, progress) -> bool:
+        """
+        :param tracker: performance.PerformanceTracker of the backtest
+        :param best_score: best af_score of the finished backtests, -inf if none
+        :param progress: part of the candles processed
+        :return: True if the backtest should be aborted
+        """
+        if tracker.n_returns % self.check_every:
+            return False
+        if self.max_drawdown is not None and tracker.max_drawdown < self.max_drawdown:
+            return True
+        if self.margin is None or progress < self.min_progress or best_score == -math.inf:
+            return False
+        return Optimizer.running_score(tracker) < best_score - self.margin
+
 
 class Optimizer():
-    def __init__(self, symbol, interval):
+    def __init__(self, symbol, interval, cache=None, store=None, job_queue=None):
+        """
+        :param cache: candle_cache.CandleCache to load candles through instead of going to the database every run
+        :param store: result_store.ResultStore, points already in it are not backtested again and every new
+        result is added to it as soon as it is known, so an interrupted sweep resumes where it stopped
+        :param job_queue: job_queue.JobQueue, the event engine's backtests are run by the workers of its broker,
+        on this machine or others, instead of local processes. Not pruned
+        """
         self.symbol = symbol
         self.interval = interval
+        self.cache = cache
+        self.store = store
+        self.job_queue = job_queue
         self.interval_ts = hlp.interval_to_milliseconds(interval)
 
-    def optimize_ema(self, strategy, start: str, end: str, param_ranges: dict, n_points=5):
+    def optimize_ema(self, strategy, start: str, end: str, param_ranges: dict, n_points=5,
+                     n_workers=1, chunksize=1, engine='event', draw=True, imported_data=None, warm_up=None,
+                     precomputed=None, verbose=True, search=None, prune=None):
+        """
+        :param n_points: number of points per parameter of the default grid search
+        :param n_workers: number of worker processes, grid points are backtested in parallel if more than 1.
+        None means one per cpu core. Only used by the event engine
+        :param chunksize: number of grid points sent to a worker at once
+        :param engine: 'event' runs every grid point through the event driven BackTester.run_test,
+        'vectorized' uses BackTester.run_vectorized, with the ema of every distinct period calculated once
+        for the whole grid. Results are the same
+        :param draw: show heatmaps of the results
+        :param imported_data: candles to optimise on (CandleDataset or list of candle tuples in desc order),
+        instead of loading them
+        :param warm_up: candles right before start (CandleDataset), the strategy of every grid point is warmed up
+        on them (see Strategy.warm_up) instead of starting from scratch
+        :param precomputed: dict of ema name -> ema of close for every candle of warm_up followed by the candles
+        optimised on (missing ones dropped), e.g. slices of one indicators.ema_grid of a longer history,
+        calculated here if not given
+        :param verbose: print the parameter ranges and the score of every grid point
+        :param search: search.Search backend choosing the points to backtest, default search.GridSearch(n_points),
+        the full grid. search.RandomSearch, search.SuccessiveHalving and search.TPESearch backtest a budget of points
+        :param prune: callable taking the performance.PerformanceTracker of a running backtest, the best af_score
+        of the finished ones and the part of the candles processed, e.g. Pruner(). The backtest is
+        aborted if it returns True, its record has af_score -inf, pruned True and pruned_at, the time it stopped,
+        its other results are those of the candles processed so far. Only used by the event engine
+        :return: result records of the backtested points, see best_record for the winner
+        """
         self.start = start
         self.end = end
         self.start_ts = hlp.date_to_milliseconds(start)
         self.end_ts = hlp.date_to_milliseconds(end)
 
+        if imported_data is None:
+            self.dataset = data.load_dataset(self.symbol, self.interval, self.start_ts, self.end_ts,
+                                             cache=self.cache)
+        elif isinstance(imported_data, data.CandleDataset):
+            self.dataset = imported_data
+        else:
+            self.dataset = data.CandleDataset.from_candles(imported_data)
+
+        if search is None:
+            search = search_module.GridSearch(n_points)
+        if verbose:
+            print(f'going to optimize in parameter ranges: {param_ranges}, {search}')
+
+        self._prepare_emas(warm_up, precomputed, engine)
+        # best score of the finished backtests, per part of the candles: scores of different parts don't compare
+        self._best = {}
+
+        def evaluate(kwargs_points, fraction=1.) -> list:
+            return self._evaluate(strategy, kwargs_points, fraction, engine, n_workers, chunksize, verbose, prune)
 
-        conn_creds = {
-            'host': spooky.creds['host'],
-            'user': spooky.creds['user'],
-            'password': spooky.creds['password'],
-            'database': spooky.creds['database']
-        }
-        candle_getter = ghd.data_manager(self.symbol, self.interval)
-        candle_getter.set_database_credentials(**conn_creds)
-        self.candlestick_data = candle_getter.get_candles(start_ts=self.start_ts, end_ts=self.end_ts,
-                                                         delete_existing_table=False,
-                                                         reversed_order=True)
-
-        # transforms a param_ranges dict like {'fast' : (5, 50), 'slow' : (10, 200)} into a dict like:
-        # {'fast' : [5, 16, 28, 39, 50], 'slow' : [10, 58, 105, 152, 200]}
-        # number of elements in a list is equal to n_points
-        param_ranges = {k: hlp.span_to_list(v, n_points) for k, v in param_ranges.items()}
-        print(f'going to optimize in parameter ranges: {param_ranges}')
-
-        # create a list of test points, like [{'fast' : 5, 'slow' : 10}, {'fast' : 5, 'slow' : 58}, ...]
-        kwargs_points = [
-            dict(zip(param_ranges, cortesian_product_item))
-            for cortesian_product_item
-            in product(*param_ranges.values())
-        ]
         # includes slow < fast
         # TODO filter slow = fast or very close
-        kwargs_points = [d for d in kwargs_points if d['fast'] < d['slow'] - 5]
+        optimization_results = search.search(param_ranges, evaluate, lambda d: d['fast'] < d['slow'] - 5)
+
+        if draw:
+            finished = pd.DataFrame([result for result in optimization_results if not result.get('pruned')])
+            df_af_score = finished.pivot('fast', 'slow', 'af_score')
+            df_sharpe = finished.pivot('fast', 'slow', 'sharpe_ratio')
+            df_return = finished.pivot('fast', 'slow', 'annualised_total_return')
+            df_max_drawdown = finished.pivot('fast', 'slow', 'max_drawdown')
 
-        optimization_results = []
+            fig, ax = plt.subplots(nrows=2, ncols=2)
+            sns.heatmap(df_af_score, annot=False, fmt=".1f", ax = ax[0, 0])
+            sns.heatmap(df_return, annot=False, fmt=".1f", ax=ax[1, 0])
+            sns.heatmap(df_sharpe, annot=True, fmt=".1f", ax=ax[0, 1])
+            sns.heatmap(df_max_drawdown, annot=False, fmt=".1f", ax=ax[1, 1])
+            ax[0, 0].title.set_text('af_score')
+            ax[1, 0].title.set_text('return')
+            ax[0, 1].title.set_text('sharpe')
+            ax[1, 1].title.set_text('max_drawdown')
 
+            plt.show()
+
+        return optimization_results
+
+    def _evaluate(self, strategy, kwargs_points, fraction, engine, n_workers, chunksize, verbose, prune) -> list:
+        """
+        Backtests the points on the first fraction of the candles
+        :return: a result record per point, None for the ones without trades
+        """
+        dataset = self.dataset
+        if fraction < 1:
+            dataset = data.CandleDataset(dataset.values[:max(round(fraction * len(dataset)), 1)])
+        n_bars = np.searchsorted(self._close_time, dataset.close_time[-1], side='right') if len(dataset) else 0
+
+        records = [None] * len(kwargs_points)
+        to_run = list(range(len(kwargs_points)))  # indices of the points to backtest
+        if self.store is not None:
+            data_hash = self.store.hash_data(self._warm_close, dataset.values)
+            keys = [self.store.make_key(strategy, kwargs, self.symbol, self.interval, data_hash)
+                    for kwargs in kwargs_points]
+            stored = self.store.get(keys)
+            to_run = [i for i, key in enumerate(keys) if key not in stored]
+            for i, key in enumerate(keys):
+                if key in stored:
+                    records[i] = stored[key]
+                    if stored[key] and verbose:
+                        print(f'af_score: {str(int(stored[key]["af_score"]))}, fast: {kwargs_points[i]["fast"]}, '
+                              f'slow: {kwargs_points[i]["slow"]} (stored)')
+        points = [kwargs_points[i] for i in to_run]
+        warm_up, precomputed = self._emas_for(points, n_bars, engine)
+
+        if engine == 'vectorized':
+            all_backtest_results = ((backtest_results, None) for backtest_results in
+                                    self._run_vectorized(strategy, points, dataset, warm_up, precomputed))
+        else:
+            if fraction not in self._best:
+                self._best[fraction] = multiprocessing.Value('d', -math.inf)
+            best = self._best[fraction]
+            # the stored results count as finished backtests
+            best.value = max([best.value] + [record['af_score'] for record in records if record])
+            if self.job_queue is not None:
+                all_backtest_results = self._run_distributed(strategy, points, dataset, warm_up)
+            elif n_workers is None or n_workers > 1:
+                all_backtest_results = self._run_parallel(strategy, points, dataset, warm_up, n_workers,
+                                                          chunksize, prune, best)
+            else:
+                all_backtest_results = self._run_serial(strategy, points, dataset, warm_up, prune, best)
+
+        # the backtests go first: they are done when zip stops, a pool of workers is shut down right away
+        for (backtest_results, pruned_at), i in zip(all_backtest_results, to_run):
+            kwargs = kwargs_points[i]
+            record = self.result_record(kwargs, backtest_results)
+            if pruned_at is not None:
+                # not stored, its result depends on the backtests that were finished before it
+                record = {**(record or kwargs), 'af_score': -math.inf, 'pruned': True,
+                          'pruned_at': hlp.milliseconds_to_date(pruned_at)}
+                if verbose:
+                    print(f'pruned at {record["pruned_at"]}, fast: {kwargs["fast"]}, slow: {kwargs["slow"]}')
+            else:
+                if self.store is not None:
+                    self.store.put(keys[i], strategy, kwargs, self.symbol, self.interval, data_hash, record)
+                if record and verbose:
+                    print(f'af_score: {str(int(record["af_score"]))}, fast: {kwargs["fast"]}, slow: {kwargs["slow"]}')
+            records[i] = record
+        return records
+
+    @staticmethod
+    def result_record(kwargs, backtest_results):
+        """
+        :return: the results of a backtest optimize_ema keeps, with the score and the parameters,
+        None if there are no results (no trades)
+        """
+        if not backtest_results:
+            return None
+        af_score = (
+                backtest_results['annualised_total_return'] * 1 +
+                backtest_results['sharpe_ratio'] * 100 * 1 +
+                backtest_results['max_drawdown'] * 1 -
+                backtest_results['drawdown_duration_percent'] * 1
+        )
+
+        results_of_interest = [
+            'mean_annual_return',
+            'annualised_total_return',
+            'sharpe_ratio',
+            'max_drawdown',
+            'drawdown_duration_percent'
+        ]
+        results_of_interest = [i for i in results_of_interest if i in backtest_results]
+        result = {key: backtest_results[key] for key in results_of_interest}
+        result['af_score'] = af_score
+        return {**result, **kwargs}
+
+    @staticmethod
+    def best_record(records, score='af_score') -> dict:
+        """
+        :param records: result records of optimize_ema
+        :return: the record with the highest score among the backtests run to the end of all the candles,
+        a pruned one, or one of successive halving's backtests of a part of them (data_fraction < 1), never wins.
+        Raises NoFinishedRun if there is none
+        """
+        finished = [record for record in records
+                    if record and not record.get('pruned') and record.get('data_fraction', 1) == 1]
+        if not finished:
+            raise NoFinishedRun(f'none of the {len(records)} backtests ran to the end, all of them were pruned '
+                                f'or had no trades')
+        return max(finished, key=lambda record: record[score])
+
+    @staticmethod
+    def running_score(tracker) -> float:
+        """
+        af_score of result_record on the bars a performance.PerformanceTracker has seen so far,
+        returns annualised over the time since the first bar rather than between the first and the last trade
+        """
+        days = tracker.duration.days
+        if not days:
+            return 0.
+        return (
+                365 * tracker.total_return / days +
+                (tracker.sharpe_ratio or 0.) * 100 +
+                tracker.max_drawdown -
+                tracker.max_drawdown_duration / tracker.duration
+        )
+
+    def _prepare_emas(self, warm_up, precomputed, engine):
+        # emas are kept for the warm up followed by the candles optimised on, the warm up alone for the event engine
+        columns = data.candles_to_columns(self.dataset)
+        self._close = columns['close']
+        self._close_time = columns['close_time']
+        self._warm_close = data.candles_to_columns(warm_up)['close'] if warm_up is not None else self._close[:0]
+        self._emas = dict(precomputed) if precomputed is not None else {}
+        self._own_emas = precomputed is None
+
+    def _emas_for(self, kwargs_points, n_bars, engine) -> tuple:
+        """
+        :param n_bars: number of candles optimised on (missing ones dropped)
+        :return: the warm up of the strategies: (closes, last ema values) or None,
+        and the emas of the candles for the vectorized engine
+        """
+        n_warm = len(self._warm_close)
+        if not n_warm and engine != 'vectorized':
+            return None, None
+        if self._own_emas:
+            # every period appears in many points, its ema is calculated once and shared by all of them
+            spans = sorted({kwargs[param] for kwargs in kwargs_points for param in ('fast', 'slow')
+                            if indicators.EMA(kwargs[param]).name not in self._emas})
+            values = np.concatenate([self._warm_close, self._close]) if engine == 'vectorized' else self._warm_close
+            grid = indicators.ema_grid(values, spans)
+            self._emas.update((indicators.EMA(span).name, ema) for span, ema in zip(spans, grid))
+
+        warm_up = None
+        if n_warm:
+            warm_up = (self._warm_close, {name: ema[n_warm - 1:n_warm] for name, ema in self._emas.items()})
+        precomputed = None
+        if engine == 'vectorized':
+            precomputed = {name: ema[n_warm:n_warm + n_bars] for name, ema in self._emas.items()}
+        return warm_up, precomputed
+
+    def _new_strategy(self, strategy, kwargs, warm_up):
+        new_strategy = strategy(self.interval_ts, **kwargs)
+        if warm_up is not None:
+            new_strategy.warm_up(*warm_up)
+        return new_strategy
+
+    def _run_serial(self, strategy, kwargs_points, dataset, warm_up, prune, best):
         for kwargs in kwargs_points:
 
-            self.strategy = strategy(self.interval_ts, **kwargs)
+            self.strategy = self._new_strategy(strategy, kwargs, warm_up)
 
             self.backtester = backtesting.BackTester(self.strategy, self.symbol, self.interval)
 
-            # need to copy the data, because data handler uses data.pop, and data gets deplenished after first run
-            backtest_results = self.backtester.run_test(self.start, self.end, draw=False, print_results=False,
-                                                        imported_data=copy.deepcopy(self.candlestick_data))
-
-            if backtest_results:
-                af_score = (
-                        backtest_results['annualised_total_return'] * 1 +
-                        backtest_results['sharpe_ratio'] * 100 * 1 +
-                        backtest_results['max_drawdown'] * 1 -
-                        backtest_results['drawdown_duration_percent'] * 1
-                )
-                print(f'af_score: {str(int(af_score))}, fast: {kwargs["fast"]}, slow: {kwargs["slow"]}')
-
-                results_of_interest = [
-                    'mean_annual_return',
-                    'annualised_total_return',
-                    'sharpe_ratio',
-                    'max_drawdown',
-                    'drawdown_duration_percent'
-                ]
-                results_of_interest = [i for i in results_of_interest if i in backtest_results]
-                result = {key: backtest_results[key] for key in results_of_interest}
-                result['af_score'] = af_score
-                result = {**result, **kwargs}
-                optimization_results.append(result)
-
-
-        df_af_score = pd.DataFrame(optimization_results).pivot('fast', 'slow', 'af_score')
-        df_sharpe = pd.DataFrame(optimization_results).pivot('fast', 'slow', 'sharpe_ratio')
-        df_return = pd.DataFrame(optimization_results).pivot('fast', 'slow', 'annualised_total_return')
-        df_max_drawdown = pd.DataFrame(optimization_results).pivot('fast', 'slow', 'max_drawdown')
-
-
-        fig, ax = plt.subplots(nrows=2, ncols=2)
-        sns.heatmap(df_af_score, annot=False, fmt=".1f", ax = ax[0, 0])
-        sns.heatmap(df_return, annot=False, fmt=".1f", ax=ax[1, 0])
-        sns.heatmap(df_sharpe, annot=True, fmt=".1f", ax=ax[0, 1])
-        sns.heatmap(df_max_drawdown, annot=False, fmt=".1f", ax=ax[1, 1])
-        ax[0, 0].title.set_text('af_score')
-        ax[1, 0].title.set_text('return')
-        ax[0, 1].title.set_text('sharpe')
-        ax[1, 1].title.set_text('max_drawdown')
-
-        plt.show()
+            # data handlers only read the dataset through a cursor, every run can replay the same one
+            yield _run_event(self.backtester, kwargs, self.start, self.end, dataset, prune, best)
 
-        return optimization_results
+    def _run_vectorized(self, strategy, kwargs_points, dataset, warm_up, precomputed):
+        for kwargs in kwargs_points:
+            self.strategy = self._new_strategy(strategy, kwargs, warm_up)
+            self.backtester = backtesting.BackTester(self.strategy, self.symbol, self.interval)
+            yield self.backtester.run_vectorized(self.start, self.end, draw=False, print_results=False,
+                                                 imported_data=dataset, precomputed=precomputed)
+
+    def _run_distributed(self, strategy, kwargs_points, dataset, warm_up):
+        """
+        Backtests grid points on the job queue's workers, candles are sent to every worker once.
+        :return: (backtest results, pruned at) pairs, in the order of kwargs_points
+        """
+        args = (strategy, self.symbol, self.interval, self.start, self.end, np.asarray(dataset.values), warm_up)
+        return self.job_queue.map(_run_job, args, [(kwargs,) for kwargs in kwargs_points])
+
+    def _run_parallel(self, strategy, kwargs_points, dataset, warm_up, n_workers, chunksize, prune, best):
+        """
+        Backtests grid points in a pool of processes. Candles are put into shared memory once,
+        workers replay the CandleDataset on top of it without copying.
+        :return: (backtest results, pruned at) pairs, in the order of kwargs_points
+        """
+        candles = dataset.values
+        shm = shared_memory.SharedMemory(create=True, size=max(candles.nbytes, 1))
+        try:
+            np.ndarray(candles.shape, dtype=np.float64, buffer=shm.buf)[:] = candles
+
+            init_args = (shm.name, candles.shape, strategy,
+                         self.symbol, self.interval, self.start, self.end, warm_up, prune, best)
+            with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count(),
+                                     initializer=_init_worker, initargs=init_args) as pool:
+                # map returns results in the order of the grid points, whichever worker finishes first,
+                # each one as soon as it and the ones before it are done
+                yield from pool.map(_run_grid_point, kwargs_points, chunksize=chunksize)
+        finally:
+            shm.close()
+            shm.unlink()
 
 # TODO
 # backtesting and optimization: 1 event_loop = 1 strategy = 1 backtester = 1 symbol
 # live trading: shared event loop for N strategies. Each strategy has it's own portfolio, buffer, backtester.
 # Each backtester process should tend to start on a new core
-# mb order executors should be coroutines
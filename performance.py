@@ -1,3 +1,5 @@
+import copy
+import math
 import buffer
 import numpy as np
 import pandas as pd
@@ -12,6 +14,189 @@ from datetime import timedelta
 logger = logging.getLogger(__name__)
 
 
+class PerformanceTracker():
+    """
+    Streaming version of the metrics of calculate_performance, updated in O(1) per bar and per fill, so they are
+    available at any moment of a backtest or live trading without building a DataFrame of the buffer.
+    Works on the same balance series: total at the last fill (total_filled), initial capital before the first one.
+    A bar is finalised when the next one starts, its fills can come after the bar itself
+    """
+
+    def __init__(self, initial_capital, interval: str, riskless_ann_return=0):
+        """
+        :param riskless_ann_return: percent
+        """
+        self.initial_capital = initial_capital
+        self.periods = 86400 * 365 * 1000 / hlp.interval_to_milliseconds(interval)  # bars in a year
+        self.riskless_return = riskless_ann_return / (100 * self.periods)
+
+        self.total_filled = initial_capital  # balance at the last fill
+        self.first_total = None
+        self.last_total = None
+        self.first_time = None
+        self.last_time = None
+
+        # running mean and variance of bar returns (Welford)
+        self.n_returns = 0
+        self.mean_return = 0.
+        self._m2 = 0.
+
+        self.watermark = None
+        self.max_drawdown = 0.  # percent, <= 0
+        self.last_peak_time = None
+        self._max_peak_gap = 0  # ms, longest time between two consecutive peaks
+
+        self._pending = None  # [close_time, total_filled] of the current bar
+        self._view = None  # the tracker with the current bar finalised, see _current
+
+    def on_bar(self, close_time):
+        """
+        A new bar started, the previous one is finalised
+        """
+        if self._pending is not None:
+            self._finalize(*self._pending)
+        self._pending = [close_time, self.total_filled]
+        self._view = None
+
+    def on_fill(self, close_time, total):
+        """
+        :param close_time: close time of the bar the fill belongs to
+        :param total: balance after the fill
+        """
+        self.total_filled = total
+        if self._pending is not None and self._pending[0] == close_time:
+            self._pending[1] = total
+        self._view = None
+
+    def _finalize(self, close_time, total):
+        if self.last_total is None:
+            self.first_total, self.first_time = total, close_time
+            self.watermark, self.last_peak_time = total, close_time
+        else:
+            bar_return = (total - self.last_total) / self.last_total
+            self.n_returns += 1
+            delta = bar_return - self.mean_return
+            self.mean_return += delta / self.n_returns
+            self._m2 += delta * (bar_return - self.mean_return)
+
+            if total >= self.watermark:
+                self.watermark = total
+                self._max_peak_gap = max(self._max_peak_gap, close_time - self.last_peak_time)
+                self.last_peak_time = close_time
+            self.max_drawdown = min(self.max_drawdown, 100 * (total - self.watermark) / self.watermark)
+        self.last_total, self.last_time = total, close_time
+
+    def _current(self):
+        # metrics include the current bar, finalised on a copy, the tracker itself waits for the next bar
+        if self._pending is None:
+            return self
+        if self._view is None:
+            view = copy.copy(self)
+            view._pending = view._view = None
+            view._finalize(*self._pending)
+            self._view = view
+        return self._view
+
+    @property
+    def n_bars(self):
+        current = self._current()
+        return current.n_returns + (current.last_total is not None)
+
+    @property
+    def std_return(self):
+        current = self._current()
+        return math.sqrt(current._m2 / current.n_returns) if current.n_returns else 0.
+
+    @property
+    def sharpe_ratio(self):
+        current = self._current()
+        std = current.std_return
+        if not std:
+            return None
+        return math.sqrt(self.periods) * (current.mean_return - self.riskless_return) / std
+
+    @property
+    def mean_annual_return(self):
+        return 100 * self.periods * self._current().mean_return
+
+    @property
+    def total_return(self):
+        current = self._current()
+        if current.last_total is None:
+            return 0.
+        return 100 * (current.last_total - current.first_total) / current.first_total
+
+    @property
+    def drawdown(self):
+        """
+        Current drawdown from the high-water mark, percent
+        """
+        current = self._current()
+        if current.last_total is None:
+            return 0.
+        return 100 * (current.last_total - current.watermark) / current.watermark
+
+    @property
+    def drawdown_duration(self) -> timedelta:
+        """
+        Time since the last peak
+        """
+        current = self._current()
+        if current.last_time is None:
+            return timedelta(0)
+        return timedelta(milliseconds=int(current.last_time - current.last_peak_time))
+
+    @property
+    def max_drawdown_duration(self) -> timedelta:
+        current = self._current()
+        if current.last_time is None:
+            return timedelta(0)
+        longest = max(current._max_peak_gap, current.last_time - current.last_peak_time)
+        return timedelta(milliseconds=int(longest))
+
+    @property
+    def duration(self) -> timedelta:
+        """
+        Time from the first bar to the current one
+        """
+        current = self._current()
+        if current.last_time is None:
+            return timedelta(0)
+        return timedelta(milliseconds=int(current.last_time - current.first_time))
+
+    def get_results(self) -> dict:
+        current = self._current()
+        return {
+            'mean_annual_return': current.mean_annual_return,
+            'total_return': current.total_return,
+            'sharpe_ratio': current.sharpe_ratio,
+            'watermark': current.watermark,
+            'drawdown': current.drawdown,
+            'max_drawdown': current.max_drawdown,
+            'drawdown_duration': current.drawdown_duration,
+            'max_drawdown_duration': current.max_drawdown_duration,
+            'n_bars': current.n_bars,
+        }
+
+
+def calculate_drawdowns(total: pd.Series) -> tuple:
+    """
+    High-water mark and drawdowns of a balance series, with array operations
+    :param total: balance, indexed by time
+    :return: watermark (running maximum of total), underwater curve (drawdown from the watermark, percent)
+    and the max drawdown duration: longest time between two consecutive peaks, or from the last peak to the end
+    """
+    values = total.to_numpy()
+    watermark = np.maximum.accumulate(values)
+    underwater = 100 * (values - watermark) / watermark
+
+    # peaks are the bars where total reaches the watermark, the first bar is one of them
+    peak_times = total.index[values >= watermark].append(total.index[-1:])
+    durations = peak_times[1:] - peak_times[:-1]
+    max_duration = max(timedelta(0), durations.max()) if len(durations) else timedelta(0)
+    return watermark, underwater, max_duration
+
+
 def calculate_performance(buffer: buffer.DataBuffer, interval: str, initial_capital: int,
                           riskless_ann_return=0, draw=False, print_results=False) -> dict:
     """
@@ -34,8 +219,9 @@ def calculate_performance(buffer: buffer.DataBuffer, interval: str, initial_capi
     # Time of first and last trade
     first_trade = buffer_data['price_filled'].first_valid_index()
     last_trade = buffer_data['price_filled'].last_valid_index()
-    if not first_trade and last_trade:
-        print('less then 2 trades were made, performance returning None')
+    # returns are annualised over whole days between the first and the last trade
+    if first_trade is None or (last_trade - first_trade).days == 0:
+        print('less then 2 trades were made or they are less than a day apart, performance returning None')
         return None
 
     # Close trade parameters (page 30):
@@ -83,23 +269,7 @@ def calculate_performance(buffer: buffer.DataBuffer, interval: str, initial_capi
     mean_annual_disc_return = 100 * periods * np.mean(df["disc_returns"])
     total_return = 100 * (df.total_filled[-1] - df.total_filled[0]) / df.total_filled[0]
 
-    water_mark = df['total_filled'][0]
-    wms = []
-    max_duration = timedelta(0)
-    last_peak_time = df.index[0]
-    for i in df.index:
-        cur_total = df['total_filled'][i]
-        if cur_total >= water_mark:
-            wms.append(cur_total)
-            water_mark = cur_total
-            max_duration = max(max_duration, i - last_peak_time)
-            last_peak_time = i
-        else:
-            wms.append(water_mark)
-    max_duration = max(max_duration, df.index[-1] - last_peak_time)
-
-    df['watermark'] = wms
-    df['underwater'] = 100 * (df['total_filled'] - df['watermark']) / df['watermark']
+    df['watermark'], df['underwater'], max_duration = calculate_drawdowns(df['total_filled'])
     max_drawdown = df["underwater"].min()
     max_drawdown_duration = max_duration
     test_duration = df.index[-1] - df.index[0]
@@ -178,4 +348,4 @@ def calculate_performance(buffer: buffer.DataBuffer, interval: str, initial_capi
 
 
 
-    return
+    return results
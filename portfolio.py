@@ -6,7 +6,9 @@ import datetime
 import numpy as np
 import pandas as pd
 import queue
+from collections import deque
 import events
+import execution
 
 
 class Portfolio(object):
@@ -43,7 +45,7 @@ class NaivePortfolio(Portfolio):
     used to test simpler strategies such as BuyAndHoldStrategy.
     """
 
-    def __init__(self, events, buffer, symbol, initial_capital, bet_size, start_ts):
+    def __init__(self, events, buffer, symbol, initial_capital, bet_size, start_ts, tracker=None):
         """
         Initialises the portfolio with bars and an event queue.
         Also includes a starting datetime index and initial capital
@@ -55,6 +57,7 @@ class NaivePortfolio(Portfolio):
         start_date - The start date (bar) of the portfolio.
         initial_capital - The starting capital in USD.
         bet_size - part of available balance to put per trade
+        tracker - optional performance.PerformanceTracker, fed with every bar and fill
         """
         self.symbol = symbol
         self.events = events
@@ -63,6 +66,9 @@ class NaivePortfolio(Portfolio):
         self.initial_capital = initial_capital
         self.bet_size = bet_size
 
+        self.tracker = tracker
+        self._tracked = 0  # number of bars of the last batch the tracker has seen
+
         self.current_position = {self.symbol: 0}
 
         self.current_holdings = {
@@ -72,6 +78,12 @@ class NaivePortfolio(Portfolio):
             'total': self.initial_capital
         }
 
+        # bars of the last batch MarketEvent, (close_time, close) arrays, None after a single bar event
+        self._batch = None
+        # signals of a batch are processed one at a time: a signal waits until the order of the previous one is filled
+        self._orders_in_flight = 0
+        self._deferred_signals = deque()
+
     def update_timeindex(self, event: events.MarketEvent):
         """
         Adds a new record to the positions matrix for the current
@@ -80,11 +92,21 @@ class NaivePortfolio(Portfolio):
         Makes use of a MarketEvent from the events queue.
         """
         new_data = event.new_data
+        self.update_tracker()
+        if isinstance(new_data, list):
+            close_time = np.array([bar['close_time'] for bar in new_data], dtype=np.int64)
+            close = np.array([bar['close'] for bar in new_data], dtype=float)
+            self._batch = (close_time, close)
+            self._tracked = 0
+            self._mark_to_market(close_time, close)
+            return
+        self._batch = None
+        if self.tracker:
+            self.tracker.on_bar(new_data['close_time'])
 
         self.current_holdings['total'] = (
                 self.current_holdings['cash'] +
                 self.current_holdings[self.symbol] * new_data['close']
-            # TODO new_data can be a list of dicts!
         )
 
         self.buffer.append_data({
@@ -101,29 +123,45 @@ class NaivePortfolio(Portfolio):
         sizing of the signal object, without risk management or
         position sizing considerations.
         """
-        order_type = 'MKT'
+        if self._orders_in_flight:
+            self._deferred_signals.append(event)
+            return
+
+        order_type = events.OrderType.MKT
+
+        # the order is sized at the signal bar: holdings may have been marked at a later bar of a batch,
+        # or at the price of a fill that came after the signal was deferred
+        self.current_holdings['total'] = (
+                self.current_holdings['cash'] +
+                self.current_holdings[self.symbol] * event.last_close_price
+        )
+        mkt_quantity = self._order_quantity(event.signal, event.last_close_price)
 
+        # mkt_quantity can be positive (byu) or negative (sell)
+        order_event = events.OrderEvent(self.symbol, event.bar_close_time,
+                                        order_type, mkt_quantity, event.last_close_price)
+        self.events.put(order_event)
+        self._orders_in_flight += 1
+
+    def _order_quantity(self, signals: tuple, last_close_price):
         # TODO strength = signal.strength, mkt_quantity = floor(100 * strength)
         cur_quantity = self.current_position[self.symbol]
         mkt_quantity = 0
 
-        for signal in event.signal:
+        for signal in signals:
 
-            if signal == 'EXIT':
+            if signal == events.Signal.EXIT:
                 if cur_quantity == 0:
                     continue
                 mkt_quantity -= cur_quantity
             # TODO check if account balance ('cash') is sufficient to process the purchase
-            amount = self.current_holdings['total'] * self.bet_size / event.last_close_price
-            if signal == 'LONG':
+            amount = self.current_holdings['total'] * self.bet_size / last_close_price
+            if signal == events.Signal.LONG:
                 mkt_quantity += amount
-            if signal == 'SHORT':
+            if signal == events.Signal.SHORT:
                 mkt_quantity -= amount
 
-        # mkt_quantity can be positive (byu) or negative (sell)
-        order_event = events.OrderEvent(self.symbol, event.bar_close_time,
-                                        order_type, mkt_quantity, event.last_close_price)
-        self.events.put(order_event)
+        return mkt_quantity
 
     def update_fill(self, event: events.FillEvent, verbose=True):
         """
@@ -131,17 +169,10 @@ class NaivePortfolio(Portfolio):
         from a FillEvent.
         NO SHORTS for now
         """
-
-        self.current_position[event.symbol] += event.quantity
-
-        self.current_holdings[event.symbol] += event.quantity
-        assert self.current_holdings[event.symbol] == self.current_position[event.symbol]
-
-        self.current_holdings['cash'] -= event.quantity * event.price_filled + event.commission
-
-        self.current_holdings['commission'] += event.commission
-        self.current_holdings['total'] = (self.current_holdings['cash'] +
-                                          self.current_holdings[event.symbol] * event.price_filled)
+        self._apply_fill(event.symbol, event.quantity, event.price_filled, event.commission)
+        if self.tracker:
+            self.update_tracker(event.bar_close_time)
+            self.tracker.on_fill(event.bar_close_time, self.current_holdings['total'])
 
         self.buffer.append_data({
             'close_time': event.bar_close_time,
@@ -161,3 +192,113 @@ class NaivePortfolio(Portfolio):
                 f'comm:{round(self.current_holdings["commission"])}, '
                 f'price:{round(event.price_filled, 2)}'
             )
+
+        if self._batch is not None:
+            # bars of the batch after the fill were marked with the holdings before it
+            close_time, close = self._batch
+            later = np.searchsorted(close_time, event.bar_close_time, side='right')
+            if later < len(close_time):
+                self._mark_to_market(close_time[later:], close[later:])
+
+        self._order_done()
+
+    def update_failed_order(self, event: events.OrderFailedEvent):
+        """
+        An order was not placed, nothing changes but the next deferred signal can go
+        """
+        self._order_done()
+
+    def _order_done(self):
+        self._orders_in_flight = max(self._orders_in_flight - 1, 0)
+        if self._deferred_signals:
+            self.process_signal(self._deferred_signals.popleft())
+
+    def update_tracker(self, until_ts=None):
+        """
+        Feeds the tracker the bars of the last batch it has not seen, up to until_ts (all of them if None).
+        Batch bars are fed as their fills come, call it when the events of the batch are processed
+        """
+        if not self.tracker or self._batch is None:
+            return
+        close_time = self._batch[0]
+        end = len(close_time) if until_ts is None else np.searchsorted(close_time, until_ts, side='right')
+        for timestamp in close_time[self._tracked:end].tolist():
+            self.tracker.on_bar(timestamp)
+        self._tracked = max(self._tracked, end)
+
+    def _mark_to_market(self, close_time: np.ndarray, close: np.ndarray):
+        """
+        Records current holdings for the bars, the same as update_timeindex does for each of them
+        """
+        n = len(close_time)
+        total = self.current_holdings['cash'] + self.current_holdings[self.symbol] * close
+        self.buffer.append_columns(close_time, {
+            self.symbol: np.full(n, self.current_holdings[self.symbol]),
+            'cash': np.full(n, self.current_holdings['cash']),
+            'commission': np.full(n, self.current_holdings['commission']),
+            'total': total
+        })
+        self.current_holdings['total'] = float(total[-1])
+
+    def _apply_fill(self, symbol, quantity, price_filled, commission):
+        self.current_position[symbol] += quantity
+
+        self.current_holdings[symbol] += quantity
+        assert self.current_holdings[symbol] == self.current_position[symbol]
+
+        self.current_holdings['cash'] -= quantity * price_filled + commission
+
+        self.current_holdings['commission'] += commission
+        self.current_holdings['total'] = (self.current_holdings['cash'] +
+                                          self.current_holdings[symbol] * price_filled)
+
+    def process_signals_vectorized(self, close_time: np.ndarray, close: np.ndarray, signal_bars: np.ndarray,
+                                   signals: list):
+        """
+        Does for arrays of bars what update_timeindex, process_signal and update_fill do bar by bar,
+        with orders filled at the close of the signal bar, like SimulatedExecutionHandler does.
+        Only the fills are processed one by one, holdings of every bar are calculated for the whole array.
+        :param close_time: bar timestamps, asc order
+        :param close: close prices
+        :param signal_bars: positions in close_time where signals were fired
+        :param signals: signal sequences, e.g. events.EXIT_LONG, one per signal bar
+        """
+        # state of the portfolio after each fill, the first entry is the state before the first one
+        holdings = [self.current_holdings[self.symbol]]
+        cash = [self.current_holdings['cash']]
+        commissions = [self.current_holdings['commission']]
+
+        for bar, signal in zip(signal_bars.tolist(), signals):
+            price = close[bar]
+            self.current_holdings['total'] = (
+                    self.current_holdings['cash'] +
+                    self.current_holdings[self.symbol] * price
+            )
+            quantity = self._order_quantity(signal, price)
+            commission = execution.SimulatedExecutionHandler.calculate_commission(quantity, price)
+            self._apply_fill(self.symbol, quantity, price, commission)
+
+            holdings.append(self.current_holdings[self.symbol])
+            cash.append(self.current_holdings['cash'])
+            commissions.append(self.current_holdings['commission'])
+
+        # number of fills done up to (including) each bar
+        fills_done = np.searchsorted(signal_bars, np.arange(len(close)), side='right')
+        bar_holdings = np.array(holdings)[fills_done]
+        bar_cash = np.array(cash)[fills_done]
+        total = bar_cash + bar_holdings * close
+
+        columns = {
+            self.symbol: bar_holdings,
+            'cash': bar_cash,
+            'commission': np.array(commissions)[fills_done],
+            'total': total
+        }
+        if len(signal_bars):
+            price_filled = np.full(len(close), np.nan)
+            price_filled[signal_bars] = close[signal_bars]
+            columns['price_filled'] = price_filled
+        self.buffer.append_columns(close_time, columns)
+
+        if len(close):
+            self.current_holdings['total'] = float(total[-1])
@@ -0,0 +1,129 @@
+import time
+
+# latency histogram buckets: bucket i counts calls that took less than 2 ** i ns
+N_BUCKETS = 40
+
+
+class HandlerStats():
+    """
+    Cumulative time, number of calls and latency histogram of one handler
+    """
+
+    __slots__ = ('name', 'calls', 'total_ns', 'histogram')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total_ns = 0
+        self.histogram = [0] * N_BUCKETS
+
+    def get_report(self, wall_ns) -> dict:
+        return {
+            'calls': self.calls,
+            'total_time': self.total_ns / 1e9,
+            'mean_time': self.total_ns / self.calls / 1e9 if self.calls else 0.,
+            'share': self.total_ns / wall_ns if wall_ns else 0.,
+            # upper bound of the bucket in microseconds -> number of calls
+            'histogram': {2 ** i / 1000: count for i, count in enumerate(self.histogram) if count},
+        }
+
+
+class Profiler():
+    """
+    Opt-in instrumentation of the event loop: handlers are wrapped with timers only when a Profiler is used,
+    nothing is measured and nothing is wrapped otherwise.
+    Records time, calls and latency histogram per handler, depth of the event queue seen by the handlers
+    and bars per second of the whole run.
+    """
+
+    def __init__(self, events=None):
+        """
+        :param events: the dispatcher (or anything with qsize()) whose queue depth is sampled on every handler call
+        """
+        self.events = events
+        self.handlers = {}  # name -> HandlerStats
+        self.depth_max = 0
+        self.depth_sum = 0
+        self.depth_samples = 0
+        self.start_ns = None
+        self.stop_ns = None
+
+    def wrap(self, name, func):
+        """
+        :return: func, timed under name. Functions wrapped under the same name share their stats
+        """
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = HandlerStats(name)
+        clock = time.perf_counter_ns
+        histogram = stats.histogram
+        last_bucket = N_BUCKETS - 1
+        qsize = self.events.qsize if self.events is not None else None
+
+        def timed(*args, **kwargs):
+            if qsize is not None:
+                depth = qsize()
+                self.depth_sum += depth
+                self.depth_samples += 1
+                if depth > self.depth_max:
+                    self.depth_max = depth
+            start = clock()
+            result = func(*args, **kwargs)
+            elapsed = clock() - start
+            stats.calls += 1
+            stats.total_ns += elapsed
+            histogram[min(elapsed.bit_length(), last_bucket)] += 1
+            return result
+
+        return timed
+
+    def start(self):
+        self.start_ns = time.perf_counter_ns()
+
+    def stop(self):
+        self.stop_ns = time.perf_counter_ns()
+
+    def get_report(self, n_bars=None) -> dict:
+        """
+        :param n_bars: number of bars processed, for bars per second
+        :return: structured report of the run
+        """
+        wall_ns = ((self.stop_ns or time.perf_counter_ns()) - self.start_ns) if self.start_ns else 0
+        report = {
+            'wall_time': wall_ns / 1e9,
+            'bars': n_bars,
+            'bars_per_sec': n_bars * 1e9 / wall_ns if n_bars and wall_ns else None,
+            'queue_depth': {
+                'max': self.depth_max,
+                'mean': self.depth_sum / self.depth_samples if self.depth_samples else 0.,
+            },
+            'handlers': {name: stats.get_report(wall_ns) for name, stats in self.handlers.items()},
+        }
+        return report
+
+    @staticmethod
+    def print_report(report: dict):
+        bars_per_sec = report['bars_per_sec']
+        print(f'wall time: {report["wall_time"]:.3f} s, bars: {report["bars"]}, '
+              f'bars/sec: {bars_per_sec:.0f}' if bars_per_sec else f'wall time: {report["wall_time"]:.3f} s')
+        print(f'event queue depth: max {report["queue_depth"]["max"]}, mean {report["queue_depth"]["mean"]:.2f}')
+        print(f'{"handler":<20}{"calls":>10}{"total, s":>10}{"mean, us":>10}{"share":>8}{"p50, us":>10}'
+              f'{"p99, us":>10}')
+        for name, stats in report['handlers'].items():
+            print(f'{name:<20}{stats["calls"]:>10}{stats["total_time"]:>10.3f}{stats["mean_time"] * 1e6:>10.2f}'
+                  f'{stats["share"]:>8.1%}{percentile(stats["histogram"], 0.5):>10.2f}'
+                  f'{percentile(stats["histogram"], 0.99):>10.2f}')
+
+
+def percentile(histogram: dict, q) -> float:
+    """
+    :param histogram: bucket upper bound -> count, as in the report
+    :return: upper bound of the bucket the q-quantile falls into
+    """
+    total = sum(histogram.values())
+    seen = 0
+    for upper_bound, count in sorted(histogram.items()):
+        seen += count
+        if seen >= q * total:
+            return upper_bound
+    return 0.
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+# bump when a change of the backtesting code changes the results, records stored before are not used any more
+ENGINE_VERSION = 1
+
+
+def _to_json(value, sort_keys=True) -> str:
+    # numpy scalars (e.g. parameters taken from numpy arrays) are stored as the python numbers they hold
+    return json.dumps(value, sort_keys=sort_keys,
+                      default=lambda v: v.item() if isinstance(v, np.generic) else str(v))
+
+
+class ResultStore():
+    """
+    Persistent store of optimizer results in a local sqlite database. Every record is keyed by a hash of
+    (strategy class, parameters, symbol, interval, hash of the candles, ENGINE_VERSION): a point backtested once
+    on the same candles is never backtested again, by a repeated sweep, an overlapping one or one resumed after
+    a crash. Records are written one by one as the backtests finish.
+    Both engines give the same results, so they share the records.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: sqlite database file, created if it doesn't exist
+        """
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        # WAL keeps the records written before a crash and makes every commit cheap
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                strategy TEXT NOT NULL,
+                params TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                interval TEXT NOT NULL,
+                data_hash TEXT NOT NULL,
+                engine_version INTEGER NOT NULL,
+                record TEXT NOT NULL,
+                created REAL NOT NULL
+            )''')
+        self.connection.commit()
+
+    @staticmethod
+    def hash_data(*arrays) -> str:
+        """
+        :param arrays: numpy arrays the results depend on, e.g. warm up closes and the candles optimised on
+        :return: hex digest of their shapes and contents
+        """
+        digest = hashlib.sha256()
+        for array in arrays:
+            array = np.ascontiguousarray(array, dtype=np.float64)
+            digest.update(str(array.shape).encode())
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def strategy_name(strategy) -> str:
+        return f'{strategy.__module__}.{strategy.__qualname__}'
+
+    def make_key(self, strategy, params: dict, symbol, interval, data_hash) -> str:
+        """
+        :param strategy: strategy class, e.g. strategy.EMAStrategy
+        :param params: parameters of the strategy, e.g. {'fast': 5, 'slow': 20}
+        :return: key of the record
+        """
+        content = _to_json([self.strategy_name(strategy), params, symbol, interval, data_hash, ENGINE_VERSION])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, keys) -> dict:
+        """
+        :return: dict key -> record of the keys found, records are None for the backtests without trades
+        """
+        found = {}
+        keys = list(keys)
+        # sqlite limits the number of parameters of a query
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.connection.execute(
+                f'SELECT key, record FROM results WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+            found.update((key, json.loads(record)) for key, record in rows)
+        return found
+
+    def put(self, key, strategy, params: dict, symbol, interval, data_hash, record):
+        """
+        Stores the record of a backtest, None if it had no trades
+        """
+        self.connection.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, self.strategy_name(strategy), _to_json(params), symbol, interval, data_hash, ENGINE_VERSION,
+             _to_json(record, sort_keys=False), time.time()))
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
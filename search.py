@@ -0,0 +1,243 @@
+"""
+Search backends of Optimizer.optimize_ema: which parameter points get backtested.
+A backend calls evaluate(points, fraction) with a list of points (dicts of parameter -> value), it gets
+the result records of Optimizer.result_record back in the same order, None for the points without trades.
+fraction < 1 backtests on the first fraction of the candles only.
+Every backend returns the records of the points it backtested, the best ones are the highest score.
+"""
+from abc import ABCMeta, abstractmethod
+from itertools import product
+import math
+
+import numpy as np
+
+import btb_helpers as hlp
+
+MAX_SAMPLING_TRIES = 100  # random draws per point before the space is taken as exhausted
+
+
+def _score(record, score) -> float:
+    return record[score] if record else -math.inf
+
+
+def _key(kwargs) -> tuple:
+    return tuple(sorted(kwargs.items()))
+
+
+def _sample_points(param_ranges, is_valid, n, rng, seen) -> list:
+    """
+    :return: up to n valid points not in seen, integers drawn uniformly within the ranges (both ends included)
+    """
+    points = []
+    for _ in range(n * MAX_SAMPLING_TRIES):
+        if len(points) == n:
+            break
+        kwargs = {param: int(rng.integers(low, high + 1)) for param, (low, high) in param_ranges.items()}
+        if is_valid(kwargs) and _key(kwargs) not in seen:
+            seen.add(_key(kwargs))
+            points.append(kwargs)
+    return points
+
+
+class Search(object):
+    """
+    Search is an abstract base class providing an interface for
+    all subsequent (inherited) parameter search backends.
+    """
+
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def search(self, param_ranges: dict, evaluate, is_valid) -> list:
+        """
+        :param param_ranges: parameter -> (low, high), e.g. {'fast': (5, 50), 'slow': (10, 200)}
+        :param evaluate: callable taking a list of points and the fraction of the candles to backtest them on,
+        returning their result records
+        :param is_valid: callable taking a point, False for the points not worth a backtest
+        :return: result records of the backtested points, without the ones that had no trades
+        """
+        raise NotImplementedError("Should implement search()")
+
+
+class GridSearch(Search):
+    """
+    The full cartesian grid of n_points per parameter, every point is backtested
+    """
+
+    def __init__(self, n_points=5):
+        self.n_points = n_points
+
+    def __repr__(self):
+        return f'grid search, {self.n_points} points per parameter'
+
+    def search(self, param_ranges, evaluate, is_valid) -> list:
+        # transforms a param_ranges dict like {'fast' : (5, 50), 'slow' : (10, 200)} into a dict like:
+        # {'fast' : [5, 16, 28, 39, 50], 'slow' : [10, 58, 105, 152, 200]}
+        # number of elements in a list is equal to n_points
+        param_lists = {k: hlp.span_to_list(v, self.n_points) for k, v in param_ranges.items()}
+        # create a list of test points, like [{'fast' : 5, 'slow' : 10}, {'fast' : 5, 'slow' : 58}, ...]
+        points = [dict(zip(param_lists, item)) for item in product(*param_lists.values())]
+        points = [kwargs for kwargs in points if is_valid(kwargs)]
+        return [record for record in evaluate(points) if record]
+
+
+class RandomSearch(Search):
+    """
+    budget points drawn uniformly from the ranges, backtested all at once (in parallel if the optimizer has workers)
+    """
+
+    def __init__(self, budget, seed=None):
+        self.budget = budget
+        self.seed = seed
+
+    def __repr__(self):
+        return f'random search, {self.budget} backtests'
+
+    def search(self, param_ranges, evaluate, is_valid) -> list:
+        points = _sample_points(param_ranges, is_valid, self.budget, np.random.default_rng(self.seed), set())
+        return [record for record in evaluate(points) if record]
+
+
+class SuccessiveHalving(Search):
+    """
+    Random points are backtested on a small first part of the candles, the best 1/eta of them go on to a part
+    eta times longer, and so on until the survivors are backtested on all the candles.
+    Most backtests are short, so many more points are tried than a budget of full backtests allows.
+    The records of points eliminated early come from their last, shorter backtest, data_fraction in every
+    record tells which part of the candles it was backtested on, Optimizer.best_record only picks full ones.
+    """
+
+    def __init__(self, budget, eta=3, min_fraction=1 / 9, score='af_score', seed=None):
+        """
+        :param budget: number of backtests, of any length
+        :param eta: 1/eta of the points survive each round, the part of the candles grows eta times
+        :param min_fraction: part of the candles the first round is backtested on
+        :param score: result the points are ranked by, higher is better
+        """
+        self.budget = budget
+        self.eta = eta
+        self.min_fraction = min_fraction
+        self.score = score
+        self.seed = seed
+
+    def __repr__(self):
+        return f'successive halving, {self.budget} backtests, eta {self.eta}'
+
+    def fractions(self) -> list:
+        n_rounds = max(math.ceil(math.log(1 / self.min_fraction, self.eta) - 1e-9), 0) + 1
+        return [self.eta ** (i - n_rounds + 1) for i in range(n_rounds)]
+
+    def search(self, param_ranges, evaluate, is_valid) -> list:
+        fractions = self.fractions()
+        # number of points in the first round so that all the rounds fit in the budget
+        n_points = max(int(self.budget / sum(self.eta ** -i for i in range(len(fractions)))), 1)
+        points = _sample_points(param_ranges, is_valid, n_points, np.random.default_rng(self.seed), set())
+
+        last_records = {}
+        n_backtests = 0
+        for fraction in fractions:
+            points = points[:self.budget - n_backtests]
+            if not points:
+                break
+            records = evaluate(points, fraction)
+            n_backtests += len(points)
+            for kwargs, record in zip(points, records):
+                last_records[_key(kwargs)] = {**record, 'data_fraction': fraction} if record else None
+            ranked = sorted(zip(points, records), key=lambda item: _score(item[1], self.score), reverse=True)
+            # pruned points were found hopeless already, they don't go on
+            points = [kwargs for kwargs, record in ranked[:math.ceil(len(ranked) / self.eta)]
+                      if record and not record.get('pruned')]
+        return [record for record in last_records.values() if record]
+
+
+class TPESearch(Search):
+    """
+    Tree-structured Parzen estimator: after n_startup random points, every next point is the one of n_candidates
+    drawn around the best points so far that is most likely among the good points (the best gamma of them) and
+    least likely among the others. Each parameter is modelled on its own by a mixture of gaussians around
+    the observed values and a uniform prior.
+    Points are proposed one by one (batch_size at a time), so it gains most with cheap backtests
+    like the vectorized engine.
+    """
+
+    def __init__(self, budget, n_startup=10, gamma=0.25, n_candidates=24, batch_size=1, score='af_score',
+                 seed=None):
+        """
+        :param budget: number of backtests
+        :param n_startup: random points before the estimator is used
+        :param gamma: part of the points taken as the good ones
+        :param n_candidates: points drawn from the good ones' mixture to choose the next point from
+        :param batch_size: points proposed and backtested at once
+        :param score: result the points are ranked by, higher is better
+        """
+        self.budget = budget
+        self.n_startup = n_startup
+        self.gamma = gamma
+        self.n_candidates = n_candidates
+        self.batch_size = batch_size
+        self.score = score
+        self.seed = seed
+
+    def __repr__(self):
+        return f'TPE search, {self.budget} backtests'
+
+    def search(self, param_ranges, evaluate, is_valid) -> list:
+        rng = np.random.default_rng(self.seed)
+        seen = set()
+        observed = []  # (point, record)
+
+        points = _sample_points(param_ranges, is_valid, min(self.n_startup, self.budget), rng, seen)
+        while points:
+            observed.extend(zip(points, evaluate(points)))
+            n_next = min(self.batch_size, self.budget - len(observed))
+            points = []
+            for _ in range(n_next):
+                kwargs = self._propose(param_ranges, is_valid, observed, rng, seen)
+                if kwargs is None:
+                    break
+                seen.add(_key(kwargs))
+                points.append(kwargs)
+        return [record for _, record in observed if record]
+
+    def _propose(self, param_ranges, is_valid, observed, rng, seen):
+        ranked = sorted(observed, key=lambda item: _score(item[1], self.score), reverse=True)
+        n_good = max(math.ceil(self.gamma * len(ranked)), 1)
+        good, bad = [kwargs for kwargs, _ in ranked[:n_good]], [kwargs for kwargs, _ in ranked[n_good:]]
+
+        candidates = {param: self._sample(low, high, [kwargs[param] for kwargs in good], rng)
+                      for param, (low, high) in param_ranges.items()}
+        # log l(x) / g(x), summed over the parameters
+        ratio = np.zeros(self.n_candidates)
+        for param, (low, high) in param_ranges.items():
+            ratio += np.log(self._density(candidates[param], low, high, [kwargs[param] for kwargs in good]))
+            ratio -= np.log(self._density(candidates[param], low, high, [kwargs[param] for kwargs in bad]))
+
+        for i in np.argsort(-ratio).tolist():
+            kwargs = {param: int(values[i]) for param, values in candidates.items()}
+            if is_valid(kwargs) and _key(kwargs) not in seen:
+                return kwargs
+        # all the candidates were tried already, or invalid
+        points = _sample_points(param_ranges, is_valid, 1, rng, set(seen))
+        return points[0] if points else None
+
+    @staticmethod
+    def _bandwidth(low, high, n):
+        return max((high - low) / 5 * n ** -0.2, 0.5)
+
+    def _sample(self, low, high, values, rng) -> np.ndarray:
+        # one of the observed values plus gaussian noise, or the uniform prior, with equal weights
+        component = rng.integers(len(values) + 1, size=self.n_candidates)
+        centers = np.append(np.asarray(values, dtype=float), np.nan)[component]
+        noise = rng.normal(0, self._bandwidth(low, high, len(values)), self.n_candidates)
+        uniform = rng.uniform(low, high, self.n_candidates)
+        samples = np.where(component == len(values), uniform, centers + noise)
+        return np.clip(np.round(samples), low, high)
+
+    def _density(self, x, low, high, values) -> np.ndarray:
+        values = np.asarray(values, dtype=float)
+        width = max(high - low, 1)
+        if not len(values):
+            return np.full(len(x), 1 / width)
+        sigma = self._bandwidth(low, high, len(values))
+        gaussians = np.exp(-0.5 * ((x[:, None] - values[None, :]) / sigma) ** 2) / (sigma * math.sqrt(2 * math.pi))
+        return (gaussians.sum(axis=1) + 1 / width) / (len(values) + 1)
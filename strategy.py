@@ -4,6 +4,8 @@ import collections
 import time
 import queue
 
+import numpy as np
+
 import data
 import indicators
 import events
@@ -33,6 +35,25 @@ class Strategy(object):
         """
         raise NotImplementedError("Should implement calculate_signals()")
 
+    def calculate_signals_vectorized(self, close_time, close, buffer, precomputed=None):
+        """
+        Calculates signals for a whole array of bars at once, used by BackTester.run_vectorized.
+        Should give the same signals as feeding the bars to calculate_signals one by one.
+        :param precomputed: optional dict of indicator name -> values for the same bars, computed in advance,
+        e.g. shared by the runs of a parameter sweep
+        """
+        raise NotImplementedError("Should implement calculate_signals_vectorized()")
+
+    def warm_up(self, candles, precomputed=None):
+        """
+        Seeds the indicators with the candles right before the first bar the strategy is going to get,
+        as if it had been running on them, without firing signals.
+        :param candles: data.CandleDataset, dict of columns as data.candles_to_columns returns, or array of closes
+        :param precomputed: optional dict of indicator name -> values for the same candles, only the last ones
+        are used, e.g. slices of an indicators.ema_grid of a longer history
+        """
+        raise NotImplementedError("Should implement warm_up()")
+
 
 class EMAStrategy(Strategy):
     """
@@ -49,18 +70,22 @@ class EMAStrategy(Strategy):
         self.interval_ts = interval_ts
         self.ema_fast = indicators.EMA(fast)
         self.ema_slow = indicators.EMA(slow)
-
+        self.warm_bars = 0  # bars the emas have seen before the first one in the buffer, see warm_up
+        self._started = False  # any bar processed since __init__ or warm_up
 
     def calculate_signals(self,
                           symbol: str,
                           events_queue: queue.Queue(),
                           event: events.MarketEvent,
                           buffer: buffer.DataBuffer):
-        #  TODO: in live trading data feed can be a bunch of canldes, not just one
-        #   if for example we download them after restoring lost connection to exchange
+        data_feed = event.new_data
+        self._started = True
+        if isinstance(data_feed, list):
+            # a batch of bars, e.g. downloaded after restoring lost connection to exchange
+            self._calculate_batch_signals(symbol, events_queue, data_feed, buffer)
+            return
 
         buffer.feed_param_names(self.ema_slow.name, self.ema_fast.name)
-        data_feed = event.new_data
 
         slow_name = self.ema_slow.name
         fast_name = self.ema_fast.name
@@ -76,10 +101,13 @@ class EMAStrategy(Strategy):
 
         signal_fired = 0
         #  ema is an unstable function, so we can act only after the period of instability has passed
-        if buffer.get_len() > self.ema_slow.n:
+        prev_data = None
+        if buffer.get_len() + self.warm_bars > self.ema_slow.n:
+            # None for the first bar after a warm up
+            prev_data = buffer.get_item_by_timestamp(data_feed['close_time'] - self.interval_ts)
 
+        if prev_data is not None:
             curr_data = buffer.get_item_by_timestamp(data_feed['close_time'])
-            prev_data = buffer.get_item_by_timestamp(data_feed['close_time'] - self.interval_ts)
 
             curr_diff = curr_data[fast_name] - curr_data[slow_name]
             prev_diff = prev_data[fast_name] - prev_data[slow_name]
@@ -89,17 +117,17 @@ class EMAStrategy(Strategy):
 
             if prev_sign > 0 and curr_sign < 0:
                 self.state = -1
-                signal_fired = ['EXIT', 'SHORT']
+                signal_fired = events.EXIT_SHORT
             if prev_sign < 0 and curr_sign > 0:
                 self.state = 1
-                signal_fired = ['EXIT', 'LONG']
+                signal_fired = events.EXIT_LONG
             if prev_sign == 0:
                 if curr_sign > 0 and self.state <= 0:
                     self.state = 1
-                    signal_fired = ['EXIT', 'LONG']
+                    signal_fired = events.EXIT_LONG
                 if curr_sign < 0 and self.state >= 0:
                     self.state = -1
-                    signal_fired = ['EXIT', 'SHORT']
+                    signal_fired = events.EXIT_SHORT
 
         if signal_fired:
             events_queue.put(
@@ -110,3 +138,104 @@ class EMAStrategy(Strategy):
                     data_feed['close']
                 )
             )
+
+    def _calculate_batch_signals(self, symbol, events_queue, bars: list, buffer: buffer.DataBuffer):
+        # signals are the same as if the bars came one by one, a SignalEvent is fired for each of them
+        close_time = np.array([bar['close_time'] for bar in bars], dtype=np.int64)
+        close = np.array([bar['close'] for bar in bars], dtype=float)
+        signal_bars, signals = self.calculate_signals_vectorized(close_time, close, buffer)
+        for bar, signal_fired in zip(signal_bars.tolist(), signals):
+            events_queue.put(
+                events.SignalEvent(
+                    symbol,
+                    bars[bar]['close_time'],
+                    signal_fired,
+                    bars[bar]['close']
+                )
+            )
+
+    def calculate_signals_vectorized(self, close_time: np.ndarray, close: np.ndarray, buffer: buffer.DataBuffer,
+                                     precomputed=None):
+        """
+        Same logic as calculate_signals, applied to arrays of bars (asc order, missing bars dropped),
+        the newest bars in the buffer. Appends ema values to the buffer.
+        :param precomputed: optional dict of ema name (e.g. 'ema20') -> ema of close, used instead of
+        calculating the ema, e.g. rows of indicators.ema_grid shared by the grid points of an optimisation
+        :return: bar numbers (positions in close_time) where signals were fired, and the list of signals
+        """
+        buffer.feed_param_names(self.ema_slow.name, self.ema_fast.name)
+
+        ema_fast = self._ema_array(self.ema_fast, close, precomputed)
+        ema_slow = self._ema_array(self.ema_slow, close, precomputed)
+        self._started = True
+        buffer.append_columns(close_time, {
+            self.ema_fast.name: ema_fast,
+            self.ema_slow.name: ema_slow,
+        })
+        # the bars are the newest ones in the buffer, number of bars buffered before them:
+        buffer_len = buffer.get_len() - len(close)
+
+        curr_sign = np.sign(ema_fast - ema_slow)
+        # the bar calculate_signals would get from buffer.get_item_by_timestamp(close_time - interval_ts)
+        prev_bar = np.searchsorted(close_time, close_time - self.interval_ts, side='right') - 1
+        prev_sign = curr_sign[prev_bar]
+        has_prev = prev_bar >= 0
+        # previous bars from before the array are looked up in the buffer
+        for bar in np.flatnonzero(~has_prev).tolist():
+            prev_data = buffer.get_item_by_timestamp(close_time[bar] - self.interval_ts)
+            # a bar without EMAs: the key is missing in DataBuffer, NaN in ColumnarDataBuffer
+            if prev_data is not None and not np.isnan(prev_data.get(self.ema_fast.name, np.nan)):
+                prev_sign[bar] = np.sign(prev_data[self.ema_fast.name] - prev_data[self.ema_slow.name])
+                has_prev[bar] = True
+        #  ema is an unstable function, so we can act only after the period of instability has passed
+        stable = buffer_len + self.warm_bars + np.arange(1, len(close) + 1) > self.ema_slow.n
+
+        # a signal needs a change of sign to a non-zero one, the state only matters when the sign comes from zero
+        candidates = np.flatnonzero(stable & has_prev & (curr_sign != 0) & (curr_sign != prev_sign))
+
+        signal_bars = []
+        signals = []
+        for bar in candidates.tolist():
+            curr, prev = curr_sign[bar], prev_sign[bar]
+            signal_fired = 0
+            if prev > 0 and curr < 0:
+                self.state = -1
+                signal_fired = events.EXIT_SHORT
+            if prev < 0 and curr > 0:
+                self.state = 1
+                signal_fired = events.EXIT_LONG
+            if prev == 0:
+                if curr > 0 and self.state <= 0:
+                    self.state = 1
+                    signal_fired = events.EXIT_LONG
+                if curr < 0 and self.state >= 0:
+                    self.state = -1
+                    signal_fired = events.EXIT_SHORT
+            if signal_fired:
+                signal_bars.append(bar)
+                signals.append(signal_fired)
+
+        return np.array(signal_bars, dtype=np.int64), signals
+
+    def warm_up(self, candles, precomputed=None):
+        if isinstance(candles, data.CandleDataset):
+            candles = data.candles_to_columns(candles)
+        close = indicators._column(candles, 'close')
+        for ema in (self.ema_fast, self.ema_slow):
+            if precomputed and ema.name in precomputed:
+                values = precomputed[ema.name]
+                ema.last_entry = float(values[-1]) if len(values) else None
+            else:
+                ema.warm_up(close)
+        self.warm_bars = len(close)
+        self._started = False
+
+    def _ema_array(self, ema: indicators.EMA, close, precomputed) -> np.ndarray:
+        # precomputed values are the ema of close continuing from the warm up (from scratch without one),
+        # only valid before the strategy has processed any bar
+        if precomputed and ema.name in precomputed and not self._started:
+            values = np.asarray(precomputed[ema.name])
+            if len(values):
+                ema.last_entry = float(values[-1])
+            return values
+        return ema.calculate_array(close)
@@ -0,0 +1,3 @@
+"""
+Tests, run from the repository root: python -m pytest
+"""
@@ -0,0 +1,38 @@
+"""
+BackTester.run_test with batched MarketEvents gives the same results and run log as bar by bar.
+"""
+import pytest
+
+import backtesting
+import strategy
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+
+
+def run(candles, batch_size, columnar_buffer):
+    ema_strategy = strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), 5, 20)
+    backtester = backtesting.BackTester(ema_strategy, SYMBOL, INTERVAL, columnar_buffer=columnar_buffer)
+    results = backtester.run_test(START, END, print_results=False, imported_data=candles, batch_size=batch_size)
+    return results, backtester.buffer.get_all_data()
+
+
+@pytest.mark.parametrize('missing_every', [None, 13])
+@pytest.mark.parametrize('columnar_buffer', [False, True])
+@pytest.mark.parametrize('batch_size', [3, 64, 1000])
+def test_batches_match_bar_by_bar(missing_every, columnar_buffer, batch_size):
+    candles = generate_candles(1500, INTERVAL, missing_every=missing_every)
+    expected_results, expected_data = run(candles, 1, columnar_buffer)
+    results, run_data = run(candles, batch_size, columnar_buffer)
+
+    assert results.keys() == expected_results.keys()
+    for key, value in expected_results.items():
+        if key == 'drawdown_df':
+            assert value.equals(results[key])
+        else:
+            assert value == results[key], key
+    assert expected_data.equals(run_data)
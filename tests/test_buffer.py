@@ -0,0 +1,60 @@
+"""
+TimeIndex finds the same positions by arithmetic (regular series) as by bisection, through gaps and
+out of order timestamps.
+"""
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+import pytest
+
+import buffer
+
+INTERVAL_TS = 60000
+
+
+def random_timestamps(rng, n, gaps, out_of_order):
+    timestamps = INTERVAL_TS * np.arange(1, n + 1)
+    if gaps:
+        timestamps = timestamps[rng.random(n) > 0.1]
+    timestamps = timestamps.tolist()
+    if out_of_order:
+        i = int(rng.integers(1, len(timestamps)))
+        timestamps.insert(i - 1, timestamps.pop(i))
+    return timestamps
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('gaps, out_of_order', [(False, False), (True, False), (False, True), (True, True)])
+def test_time_index_matches_bisect(seed, gaps, out_of_order):
+    rng = np.random.default_rng(seed)
+    index = buffer.TimeIndex(INTERVAL_TS)
+    timestamps = random_timestamps(rng, 200, gaps, out_of_order)
+    for timestamp in timestamps[:100]:
+        index.add(timestamp)
+    if out_of_order:
+        for timestamp in timestamps[100:]:
+            index.add(timestamp)
+    else:
+        index.extend(timestamps[100:])
+    assert index.regular == (not gaps and not out_of_order)
+
+    ordered = sorted(timestamps)
+    assert index.timestamps == ordered
+    for query in rng.integers(0, INTERVAL_TS * 210, 500).tolist():
+        assert index.position_at_or_before(query) == bisect_right(ordered, query) - 1
+        end = query + int(rng.integers(0, INTERVAL_TS * 20))
+        assert index.positions_between(query, end) == (bisect_left(ordered, query),
+                                                      max(bisect_left(ordered, query), bisect_right(ordered, end)))
+    for timestamp in timestamps:
+        assert timestamps[index.get(timestamp)] == timestamp
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_lookups_with_gaps(columnar):
+    data_buffer = (buffer.ColumnarDataBuffer if columnar else buffer.DataBuffer)('BTCUSDT', interval_ts=INTERVAL_TS)
+    for timestamp in [1, 2, 3, 5, 6, 9]:
+        data_buffer.append_data({'close_time': timestamp * INTERVAL_TS, 'close': float(timestamp)})
+    assert data_buffer.get_item_by_timestamp(4 * INTERVAL_TS)['close'] == 3.
+    assert data_buffer.get_item_by_timestamp(8 * INTERVAL_TS + 1)['close'] == 6.
+    assert data_buffer.get_item_by_timestamp(INTERVAL_TS - 1) is None
+    assert [item['close'] for item in data_buffer.get_items_between(4 * INTERVAL_TS, 9 * INTERVAL_TS)] == [5., 6., 9.]
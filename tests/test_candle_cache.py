@@ -0,0 +1,31 @@
+"""
+CandleCache keeps the same candles whichever way it is filled: forward in chunks (appended in place),
+older candles, gaps and candles fetched again (merged into a new file).
+"""
+import os
+
+import numpy as np
+
+import candle_cache
+from benchmarks.synthetic import generate_candles
+
+INTERVAL_TS = 3600000
+CANDLES = generate_candles(1000, '1h', reversed_order=False)
+
+
+def fetch(symbol, interval, start_ts, end_ts):
+    return [candle for candle in CANDLES if start_ts <= candle[0] <= end_ts]
+
+
+def test_fills_give_the_same_candles(tmp_path):
+    cache = candle_cache.CandleCache(str(tmp_path), fetch=fetch)
+    first = CANDLES[0][0]
+    for i in range(300, 600, 100):
+        cache.get_dataset('BTCUSDT', '1h', first + i * INTERVAL_TS, first + (i + 99) * INTERVAL_TS)
+    cache.store('BTCUSDT', '1h', first + 800 * INTERVAL_TS, CANDLES[-1][0], CANDLES[800:])
+    cache.store('BTCUSDT', '1h', first + 350 * INTERVAL_TS, first + 360 * INTERVAL_TS, CANDLES[350:361])
+    dataset = cache.get_dataset('BTCUSDT', '1h', first, CANDLES[-1][0])
+
+    assert np.array_equal(np.asarray(dataset.values), np.array(CANDLES, dtype=np.float64))
+    assert cache.get_ranges('BTCUSDT', '1h') == [[first, CANDLES[-1][0]]]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
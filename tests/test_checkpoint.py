@@ -0,0 +1,120 @@
+"""
+A backtest saved with BackTester.save_checkpoint, loaded and extended with new candles gives the same results
+and run log as a run_test over all the candles, whether the first run was streamed in chunks or not.
+"""
+import threading
+
+import pytest
+
+import backtesting
+import candle_cache
+import data
+import strategy
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2030 00:00:00'
+N_BARS = 1500
+NEW_BARS = 24
+
+
+def new_backtester(columnar_buffer=False, cache=None):
+    ema_strategy = strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), 10, 50)
+    return backtesting.BackTester(ema_strategy, SYMBOL, INTERVAL, columnar_buffer=columnar_buffer, cache=cache)
+
+
+def assert_same_run(results, backtester, rerun_results, rerun):
+    assert results.keys() == rerun_results.keys()
+    for key, value in rerun_results.items():
+        if key == 'drawdown_df':
+            assert value.equals(results[key])
+        else:
+            assert value == results[key], key
+    assert rerun.buffer.get_all_data().equals(backtester.buffer.get_all_data())
+
+
+@pytest.fixture
+def dataset():
+    return data.CandleDataset.from_candles(generate_candles(N_BARS + NEW_BARS, INTERVAL, missing_every=97))
+
+
+@pytest.mark.parametrize('columnar_buffer', [False, True])
+@pytest.mark.parametrize('batch_size', [1, 10])
+def test_extend_matches_rerun(tmp_path, dataset, columnar_buffer, batch_size):
+    path = str(tmp_path / 'checkpoint.pkl')
+    backtester = new_backtester(columnar_buffer)
+    backtester.run_test(START, END, print_results=False, imported_data=data.CandleDataset(dataset.values[:N_BARS]),
+                        batch_size=batch_size)
+    backtester.save_checkpoint(path)
+
+    backtester = backtesting.BackTester.load_checkpoint(path)
+    results = backtester.extend(END, print_results=False, imported_data=dataset, batch_size=batch_size)
+
+    rerun = new_backtester(columnar_buffer)
+    assert_same_run(results, backtester, rerun.run_test(START, END, print_results=False, imported_data=dataset), rerun)
+
+
+def test_extend_streamed_run(tmp_path, dataset):
+    history = data.CandleDataset(dataset.values[:N_BARS])
+    interval_ts = hlp.interval_to_milliseconds(INTERVAL)
+
+    def fetch(symbol, interval, start_ts, end_ts):
+        # stands in for the database: the candles of the history opening within [start_ts, end_ts]
+        return history.view(start_ts + interval_ts - 1, end_ts + interval_ts - 1)
+
+    cache = candle_cache.CandleCache(str(tmp_path / 'cache'), fetch=fetch)
+    path = str(tmp_path / 'checkpoint.pkl')
+    backtester = new_backtester(cache=cache)
+    backtester.run_test(START, END, print_results=False, chunk_size=200)
+    assert backtester.last_close_time == int(history.close_time[-1])
+    backtester.save_checkpoint(path)
+
+    backtester = backtesting.BackTester.load_checkpoint(path)
+    results = backtester.extend(END, print_results=False, imported_data=dataset)
+
+    rerun = new_backtester()
+    assert_same_run(results, backtester, rerun.run_test(START, END, print_results=False, imported_data=dataset), rerun)
+
+
+@pytest.mark.parametrize('columnar_buffer', [False, True])
+def test_extend_without_new_candles(tmp_path, dataset, columnar_buffer):
+    # no candle after the last one processed: nothing is run and nothing is downloaded
+    path = str(tmp_path / 'checkpoint.pkl')
+    backtester = new_backtester(columnar_buffer)
+    results = backtester.run_test(START, END, print_results=False, imported_data=dataset)
+    backtester.save_checkpoint(path)
+
+    backtester = backtesting.BackTester.load_checkpoint(path)
+    extended_results = backtester.extend(END, print_results=False, imported_data=data.CandleDataset.from_candles([]))
+
+    rerun = new_backtester(columnar_buffer)
+    rerun.run_test(START, END, print_results=False, imported_data=dataset)
+    assert_same_run(extended_results, backtester, results, rerun)
+
+
+def test_save_to_pathlib_path(tmp_path, dataset):
+    path = tmp_path / 'checkpoint.pkl'
+    backtester = new_backtester()
+    results = backtester.run_test(START, END, print_results=False, imported_data=dataset)
+    backtester.save_checkpoint(path)
+    assert [file.name for file in tmp_path.iterdir()] == [path.name]
+
+    loaded = backtesting.BackTester.load_checkpoint(path)
+    assert_same_run(results, loaded, loaded.extend(END, print_results=False, imported_data=dataset), backtester)
+
+
+def test_failed_save_keeps_the_previous_checkpoint(tmp_path, dataset):
+    path = tmp_path / 'checkpoint.pkl'
+    backtester = new_backtester()
+    backtester.run_test(START, END, print_results=False, imported_data=dataset)
+    backtester.save_checkpoint(path)
+    saved = path.read_bytes()
+
+    backtester.strategy.lock = threading.Lock()
+    with pytest.raises(TypeError, match='pickle'):
+        backtester.save_checkpoint(path)
+    assert path.read_bytes() == saved
+    assert [file.name for file in tmp_path.iterdir()] == [path.name]
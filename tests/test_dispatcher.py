@@ -0,0 +1,112 @@
+"""
+EventDispatcher routes events by class, subclasses through the mro, in registration order,
+with the plain deque and the thread-safe queue.
+"""
+import threading
+
+import pytest
+
+import events
+from dispatcher import EventDispatcher
+
+
+class Event():
+    pass
+
+
+class SubEvent(Event):
+    pass
+
+
+class OtherEvent():
+    pass
+
+
+def recording_dispatcher(thread_safe, log):
+    dispatcher = EventDispatcher(thread_safe=thread_safe)
+    dispatcher.register(Event, lambda event: log.append(('event', type(event))))
+    dispatcher.register(SubEvent, lambda event: log.append(('sub', type(event))))
+    dispatcher.register(OtherEvent, lambda event: log.append(('other', type(event))))
+    return dispatcher
+
+
+@pytest.mark.parametrize('thread_safe', [False, True])
+def test_routes_by_class(thread_safe):
+    log = []
+    dispatcher = recording_dispatcher(thread_safe, log)
+    dispatcher.put(Event())
+    dispatcher.put(OtherEvent())
+    assert dispatcher.qsize() == 2
+    assert dispatcher.dispatch() == 2
+    assert log == [('event', Event), ('other', OtherEvent)]
+    assert dispatcher.qsize() == 0
+
+
+@pytest.mark.parametrize('thread_safe', [False, True])
+def test_subclass_gets_handlers_of_its_bases(thread_safe):
+    log = []
+    dispatcher = recording_dispatcher(thread_safe, log)
+    dispatcher.put(SubEvent())
+    dispatcher.dispatch()
+    # own class first, then the bases in mro order
+    assert log == [('sub', SubEvent), ('event', SubEvent)]
+    assert dispatcher.get_handlers(events.MarketEvent) == []
+
+
+def test_register_after_dispatch_resets_resolved_handlers():
+    log = []
+    dispatcher = recording_dispatcher(False, log)
+    dispatcher.put(SubEvent())
+    dispatcher.dispatch()
+    dispatcher.register(Event, lambda event: log.append(('late', type(event))))
+    dispatcher.put(SubEvent())
+    dispatcher.dispatch()
+    assert log[2:] == [('sub', SubEvent), ('event', SubEvent), ('late', SubEvent)]
+
+
+@pytest.mark.parametrize('thread_safe', [False, True])
+def test_handlers_run_in_registration_order(thread_safe):
+    order = []
+    dispatcher = EventDispatcher(thread_safe=thread_safe)
+    for i in range(5):
+        dispatcher.register(Event, lambda event, i=i: order.append(i))
+    dispatcher.put(Event())
+    dispatcher.dispatch()
+    assert order == list(range(5))
+
+
+@pytest.mark.parametrize('thread_safe', [False, True])
+def test_events_put_by_handlers_are_processed(thread_safe):
+    log = []
+    dispatcher = EventDispatcher(thread_safe=thread_safe)
+    dispatcher.register(Event, lambda event: dispatcher.put(OtherEvent()))
+    dispatcher.register(OtherEvent, log.append)
+    dispatcher.put(Event())
+    assert dispatcher.dispatch() == 2
+    assert len(log) == 1
+
+
+def test_blocking_dispatch_gets_events_from_other_threads():
+    log = []
+    dispatcher = EventDispatcher(thread_safe=True)
+    dispatcher.register(Event, log.append)
+    sent = [Event() for _ in range(100)]
+
+    def producer():
+        for event in sent:
+            dispatcher.put(event)
+
+    thread = threading.Thread(target=producer)
+    thread.start()
+    n_events = 0
+    while n_events < len(sent):
+        dispatched = dispatcher.dispatch(block=True, timeout=5)
+        assert dispatched, 'no event within the timeout'
+        n_events += dispatched
+    thread.join()
+    assert log == sent
+
+
+def test_blocking_dispatch_times_out():
+    dispatcher = EventDispatcher(thread_safe=True)
+    assert dispatcher.dispatch(block=True, timeout=0.01) == 0
@@ -0,0 +1,81 @@
+"""
+LiveExecutionHandler puts an OrderFailedEvent for an order it can't place or whose response it can't read,
+the portfolio stops waiting for its fill and goes on with the signals deferred meanwhile.
+"""
+import socket
+import time
+
+import pytest
+
+web = pytest.importorskip('aiohttp.web')
+
+import buffer
+import dispatcher
+import events
+import execution
+import mock_exchange
+import portfolio
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+
+
+def closed_port() -> int:
+    # a port nobody listens on: connections are refused, aiohttp raises ClientConnectorError
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_two_signals(rest_url) -> tuple:
+    # two signals, the second one is deferred until the order of the first one is done
+    events_queue = dispatcher.EventDispatcher(thread_safe=True)
+    naive_portfolio = portfolio.NaivePortfolio(events_queue, buffer.DataBuffer(SYMBOL), SYMBOL, 10000, 1, 0)
+    executor = execution.LiveExecutionHandler(events_queue, 'key', 'secret', rest_url=rest_url)
+    orders, failed = [], []
+    events_queue.register(events.SignalEvent, naive_portfolio.process_signal)
+    events_queue.register(events.OrderEvent, orders.append)
+    events_queue.register(events.OrderEvent, executor.execute_order)
+    events_queue.register(events.OrderFailedEvent, failed.append)
+    events_queue.register(events.OrderFailedEvent, naive_portfolio.update_failed_order)
+
+    events_queue.put(events.SignalEvent(SYMBOL, 1, events.EXIT_LONG, 100.))
+    events_queue.put(events.SignalEvent(SYMBOL, 2, events.EXIT_SHORT, 100.))
+    try:
+        deadline = time.monotonic() + 10
+        while len(failed) < 2 and time.monotonic() < deadline:
+            events_queue.dispatch(block=True, timeout=1)
+    finally:
+        executor.close()
+    return naive_portfolio, executor, orders, failed
+
+
+def assert_portfolio_released(naive_portfolio, executor, orders, failed):
+    # the second signal waited for the first order, then got its own
+    assert [order.datetime for order in orders] == [1, 2]
+    assert [event.datetime for event in failed] == [1, 2]
+    assert len(executor.failed) == 2
+    assert naive_portfolio._orders_in_flight == 0
+    assert not naive_portfolio._deferred_signals
+    assert naive_portfolio.current_position[SYMBOL] == 0
+
+
+def test_failed_order_releases_the_portfolio():
+    assert_portfolio_released(*run_two_signals(f'http://127.0.0.1:{closed_port()}'))
+
+
+def test_malformed_response_releases_the_portfolio():
+    exchange = mock_exchange.MockExchange(generate_candles(10, '1m'), SYMBOL, '1m', bar_delay=60)
+
+    async def post_order(request):
+        # accepted, but without the fills of a FULL response
+        return web.json_response({'symbol': SYMBOL, 'orderId': 0, 'status': 'FILLED'})
+
+    exchange.post_order = post_order
+    exchange.start_in_thread()
+    try:
+        naive_portfolio, executor, orders, failed = run_two_signals(exchange.rest_url)
+    finally:
+        exchange.stop_thread()
+    assert_portfolio_released(naive_portfolio, executor, orders, failed)
+    assert all(isinstance(error, KeyError) for _, error in executor.failed)
@@ -0,0 +1,96 @@
+"""
+Streaming indicators: warm_up followed by calculate_next gives the values of a run of calculate_next over
+all the bars, and those match a pandas reference.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import data
+import indicators
+from benchmarks.synthetic import generate_candles
+
+N_BARS = 1000
+WARM_BARS = 400
+COLUMNS = data.candles_to_columns(generate_candles(N_BARS, '1h', reversed_order=False), reversed_order=False)
+FRAME = pd.DataFrame({name: COLUMNS[name] for name in ('high', 'low', 'close', 'volume')})
+
+
+def wilder(values: pd.Series, n, start) -> np.ndarray:
+    # Wilder's smoothing seeded with the mean of the first n values, from position start on
+    seeded = pd.Series(np.concatenate(([values[start:start + n].mean()], values[start + n:])))
+    out = np.full(len(values), np.nan)
+    out[start + n - 1:] = seeded.ewm(alpha=1 / n, adjust=False).mean()
+    return out
+
+
+def rsi(close: pd.Series, n) -> np.ndarray:
+    changes = close.diff()
+    avg_gain = wilder(changes.clip(lower=0), n, 1)
+    avg_loss = wilder(-changes.clip(upper=0), n, 1)
+    return 100 - 100 / (1 + avg_gain / avg_loss)
+
+
+def atr(frame: pd.DataFrame, n) -> np.ndarray:
+    prev_close = frame['close'].shift(1)
+    true_range = np.fmax(frame['high'], prev_close) - np.fmin(frame['low'], prev_close)
+    return wilder(true_range, n, 0)
+
+
+def bollinger(close: pd.Series, n, k) -> np.ndarray:
+    middle, width = close.rolling(n).mean(), k * close.rolling(n).std(ddof=0)
+    return np.array([middle, middle + width, middle - width])
+
+
+def macd(close: pd.Series, fast, slow, signal) -> np.ndarray:
+    line = close.ewm(span=fast, adjust=False).mean() - close.ewm(span=slow, adjust=False).mean()
+    signal_line = line.ewm(span=signal, adjust=False).mean()
+    return np.array([line, signal_line, line - signal_line])
+
+
+def vwap(frame: pd.DataFrame, n) -> np.ndarray:
+    typical = (frame['high'] + frame['low'] + frame['close']) / 3
+    return ((typical * frame['volume']).rolling(n).sum() / frame['volume'].rolling(n).sum()).values
+
+
+# indicator factory, pandas reference of its values on FRAME
+INDICATORS = {
+    'ema': (lambda: indicators.EMA(20), lambda frame: frame['close'].ewm(span=20, adjust=False).mean().values),
+    'sma': (lambda: indicators.SMA(20), lambda frame: frame['close'].rolling(20).mean().values),
+    'rsi': (lambda: indicators.RSI(14), lambda frame: rsi(frame['close'], 14)),
+    'atr': (lambda: indicators.ATR(14), lambda frame: atr(frame, 14)),
+    'bollinger': (lambda: indicators.Bollinger(20, 2), lambda frame: bollinger(frame['close'], 20, 2)),
+    'macd': (lambda: indicators.MACD(12, 26, 9), lambda frame: macd(frame['close'], 12, 26, 9)),
+    'rolling max': (lambda: indicators.RollingMax(20, 'high'), lambda frame: frame['high'].rolling(20).max().values),
+    'rolling min': (lambda: indicators.RollingMin(20, 'low'), lambda frame: frame['low'].rolling(20).min().values),
+    'vwap': (lambda: indicators.VWAP(20), lambda frame: vwap(frame, 20)),
+}
+
+
+def bars(start, stop) -> list:
+    return [{name: float(COLUMNS[name][i]) for name in ('high', 'low', 'close', 'volume')} for i in range(start, stop)]
+
+
+def streamed(indicator, bars_) -> np.ndarray:
+    values = [indicator.calculate_next(bar) for bar in bars_]
+    # bands and lines are tuples, None while the indicator is not ready
+    ready = next((value for value in values if value is not None), None)
+    missing = (np.nan,) * len(ready) if isinstance(ready, tuple) else np.nan
+    return np.array([missing if value is None else value for value in values], dtype=float).T
+
+
+@pytest.mark.parametrize('name', INDICATORS)
+def test_warm_up_then_stream_matches_stream(name):
+    factory, _ = INDICATORS[name]
+    expected = streamed(factory(), bars(0, N_BARS))
+
+    indicator = factory()
+    warm = indicator.warm_up({name: column[:WARM_BARS] for name, column in COLUMNS.items()})
+    np.testing.assert_allclose(warm, expected[..., :WARM_BARS], rtol=1e-9)
+    np.testing.assert_allclose(streamed(indicator, bars(WARM_BARS, N_BARS)), expected[..., WARM_BARS:], rtol=1e-9)
+
+
+@pytest.mark.parametrize('name', INDICATORS)
+def test_stream_matches_pandas(name):
+    factory, reference = INDICATORS[name]
+    np.testing.assert_allclose(streamed(factory(), bars(0, N_BARS)), reference(FRAME), rtol=1e-7)
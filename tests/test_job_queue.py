@@ -0,0 +1,47 @@
+"""
+Optimizer.optimize_ema through a job queue gives the same records, in the same order, as a serial run,
+and a job whose worker stops sending heartbeats goes to another worker.
+"""
+import time
+
+import data
+import job_queue
+import optimization
+import strategy
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+PARAM_RANGES = {'fast': (2, 60), 'slow': (10, 200)}
+
+
+def optimize(dataset, queue=None):
+    optimizer = optimization.Optimizer(SYMBOL, INTERVAL, job_queue=queue)
+    return optimizer.optimize_ema(strategy.EMAStrategy, START, END, PARAM_RANGES, n_points=3, engine='event',
+                                  imported_data=dataset, draw=False, verbose=False)
+
+
+def test_job_queue_matches_serial():
+    dataset = data.CandleDataset.from_candles(generate_candles(1500, INTERVAL))
+    broker = job_queue.start_broker()
+    try:
+        queue = job_queue.JobQueue(broker.address, broker.authkey, poll_interval=0.1)
+        job_queue.start_workers(2, broker.address, broker.authkey, heartbeat_interval=0.5)
+        assert optimize(dataset, queue) == optimize(dataset)
+    finally:
+        broker.shutdown()
+
+
+def test_lost_job_goes_to_another_worker():
+    broker = job_queue.JobBroker(lease_timeout=0.2, max_retries=2)
+    broker.submit([('job', 'context', (1,))])
+    assert broker.take('lost', timeout=0)[0] == 'job'
+    time.sleep(0.3)
+    assert broker.take('alive', timeout=0)[0] == 'job'
+    # the first result to come is kept, a late one of the lost worker is dropped
+    broker.complete('alive', 'job', 2)
+    broker.complete('lost', 'job', 3)
+    assert broker.collect(['job'], timeout=0) == {'job': (True, 2)}
+    assert broker.stats()['retried'] == 1
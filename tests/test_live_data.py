@@ -0,0 +1,57 @@
+"""
+LiveDataHandler against mock_exchange.MockExchange dropping the stream: every candle arrives once and in order,
+across the backfill at the start and the ones after each reconnect.
+"""
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('aiohttp')
+
+import buffer as buffer_module
+import data
+import dispatcher
+import events
+import mock_exchange
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1m'
+HISTORY = 50
+N_BARS = 300
+DISCONNECT_EVERY = 40
+TIMEOUT = 30.  # seconds
+
+
+def test_all_candles_arrive_in_order_across_reconnects():
+    exchange = mock_exchange.MockExchange(generate_candles(HISTORY + N_BARS, INTERVAL), SYMBOL, INTERVAL,
+                                          bar_delay=0.002, closed_at_start=HISTORY,
+                                          disconnect_every=DISCONNECT_EVERY)
+    exchange.start_in_thread()
+
+    events_queue = dispatcher.EventDispatcher()
+    buffer = buffer_module.DataBuffer(SYMBOL, interval_ts=hlp.interval_to_milliseconds(INTERVAL))
+    data_handler = data.LiveDataHandler(events_queue, buffer, SYMBOL, INTERVAL,
+                                        backfill_from=int(exchange.dataset.values[0, 0]),
+                                        rest_url=exchange.rest_url, stream_url=exchange.stream_url,
+                                        reconnect_delay=0.01)
+    received = []
+    events_queue.register(events.MarketEvent, lambda event: received.extend(
+        bar['close_time'] for bar in (event.new_data if isinstance(event.new_data, list) else [event.new_data])))
+
+    expected = exchange.dataset.close_time.astype(np.int64).tolist()
+    data_handler.start()
+    deadline = time.monotonic() + TIMEOUT
+    try:
+        while len(received) < len(expected) and time.monotonic() < deadline:
+            data_handler.update_bars(timeout=0.1)
+            events_queue.dispatch()
+    finally:
+        data_handler.close()
+        exchange.stop_thread()
+
+    assert received == expected
+    assert data_handler.reconnects >= N_BARS // DISCONNECT_EVERY - 1
+    assert len(buffer.get_all_data()) == len(expected)
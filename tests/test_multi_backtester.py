@@ -0,0 +1,44 @@
+"""
+MultiBackTester gives every strategy the same results and run log as a BackTester of its own.
+"""
+import pytest
+
+import backtesting
+import strategy
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles, START_TS
+
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+SUBSCRIPTIONS = [('BTCUSDT', 5, 20), ('BTCUSDT', 10, 50), ('ETHUSDT', 5, 20)]
+
+
+def new_strategy(fast, slow):
+    return strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), fast, slow)
+
+
+@pytest.mark.parametrize('columnar_buffer', [False, True])
+def test_matches_one_backtester_per_strategy(columnar_buffer):
+    interval_ts = hlp.interval_to_milliseconds(INTERVAL)
+    # the second symbol starts later, both have missing candles
+    candles = {
+        'BTCUSDT': generate_candles(1500, INTERVAL, seed=0, missing_every=97),
+        'ETHUSDT': generate_candles(1200, INTERVAL, start_ts=START_TS + 300 * interval_ts, seed=1, missing_every=41),
+    }
+    multi = backtesting.MultiBackTester(INTERVAL, columnar_buffer=columnar_buffer)
+    for symbol, fast, slow in SUBSCRIPTIONS:
+        multi.add_strategy(symbol, new_strategy(fast, slow))
+    multi_results = multi.run_test(START, END, imported_data=candles)
+
+    for (symbol, fast, slow), results, session in zip(SUBSCRIPTIONS, multi_results, multi.sessions):
+        backtester = backtesting.BackTester(new_strategy(fast, slow), symbol, INTERVAL,
+                                            columnar_buffer=columnar_buffer)
+        single_results = backtester.run_test(START, END, print_results=False, imported_data=candles[symbol])
+        assert results.keys() == single_results.keys()
+        for key, value in single_results.items():
+            if key == 'drawdown_df':
+                assert value.equals(results[key])
+            else:
+                assert value == results[key], key
+        assert backtester.buffer.get_all_data().equals(session.buffer.get_all_data())
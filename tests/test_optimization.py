@@ -0,0 +1,38 @@
+"""
+The winner of Optimizer.optimize_ema is picked among the backtests that ran to the end, never a pruned one.
+"""
+import math
+
+import pytest
+
+import data
+import optimization
+import strategy
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+PARAM_RANGES = {'fast': (2, 60), 'slow': (10, 200)}
+
+
+def optimize(prune):
+    dataset = data.CandleDataset.from_candles(generate_candles(2000, INTERVAL))
+    optimizer = optimization.Optimizer(SYMBOL, INTERVAL)
+    return optimizer.optimize_ema(strategy.EMAStrategy, START, END, PARAM_RANGES, n_points=4, engine='event',
+                                  imported_data=dataset, draw=False, verbose=False, prune=prune)
+
+
+def test_best_record_skips_pruned():
+    records = optimize(None)
+    best = optimization.Optimizer.best_record(records)
+    pruned = {**best, 'af_score': math.inf, 'pruned': True}
+    assert optimization.Optimizer.best_record(records + [pruned]) == best
+
+
+def test_all_pruned_has_no_winner():
+    records = optimize(optimization.Pruner(max_drawdown=-0.01, check_every=1))
+    assert records and all(record['pruned'] for record in records)
+    with pytest.raises(optimization.NoFinishedRun):
+        optimization.Optimizer.best_record(records)
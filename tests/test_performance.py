@@ -0,0 +1,51 @@
+"""
+performance.calculate_drawdowns gives the watermark and max drawdown duration of the loop it replaced,
+PerformanceTracker gives the results of calculate_performance.
+"""
+import numpy as np
+import pytest
+
+import backtesting
+import performance
+import strategy
+import btb_helpers as hlp
+from benchmarks.bench_performance import balance_series, legacy_drawdowns
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+
+
+@pytest.mark.parametrize('n_bars, seed', [(1, 0), (100, 0), (5000, 1), (20000, 2)])
+def test_drawdowns_match_legacy_loop(n_bars, seed):
+    total = balance_series(n_bars, seed)
+    watermark, underwater, max_duration = performance.calculate_drawdowns(total)
+    legacy_watermark, legacy_duration = legacy_drawdowns(total)
+    assert np.array_equal(watermark, legacy_watermark)
+    assert max_duration == legacy_duration
+    assert np.allclose(underwater, 100 * (total.values - legacy_watermark) / legacy_watermark)
+
+
+def test_drawdowns_of_a_falling_balance():
+    # never back at the first peak: the duration runs to the last bar
+    total = balance_series(10)
+    total[:] = np.arange(10, 0, -1)
+    _, _, max_duration = performance.calculate_drawdowns(total)
+    assert max_duration == total.index[-1] - total.index[0]
+    assert legacy_drawdowns(total)[1] == max_duration
+
+
+@pytest.mark.parametrize('missing_every', [None, 13])
+@pytest.mark.parametrize('batch_size', [1, 64])
+def test_tracker_matches_calculate_performance(missing_every, batch_size):
+    ema_strategy = strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), 5, 20)
+    backtester = backtesting.BackTester(ema_strategy, SYMBOL, INTERVAL)
+    results = backtester.run_test(START, END, print_results=False, batch_size=batch_size,
+                                  imported_data=generate_candles(3000, INTERVAL, missing_every=missing_every))
+    tracked = backtester.tracker.get_results()
+
+    for key in ('total_return', 'sharpe_ratio', 'max_drawdown'):
+        assert tracked[key] == pytest.approx(results[key], rel=1e-9, abs=1e-12), key
+    assert tracked['max_drawdown_duration'] == results['max_drawdown_duration']
@@ -0,0 +1,71 @@
+"""
+A sweep repeated with the same ResultStore backtests nothing and returns the same records,
+other candles or another ENGINE_VERSION are backtested again.
+"""
+import pytest
+
+import data
+import optimization
+import result_store
+import strategy
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+PARAM_RANGES = {'fast': (5, 20), 'slow': (30, 90)}
+N_POINTS = 3
+
+
+@pytest.fixture
+def count_backtests(monkeypatch):
+    # _emas_for gets the points left to backtest once the stored ones are taken out
+    counter = {'backtests': 0}
+    emas_for = optimization.Optimizer._emas_for
+
+    def counting_emas_for(self, points, *args):
+        counter['backtests'] += len(points)
+        return emas_for(self, points, *args)
+
+    monkeypatch.setattr(optimization.Optimizer, '_emas_for', counting_emas_for)
+    return counter
+
+
+def sweep(store, candles, engine):
+    optimizer = optimization.Optimizer(SYMBOL, INTERVAL, store=store)
+    return optimizer.optimize_ema(strategy.EMAStrategy, START, END, PARAM_RANGES, n_points=N_POINTS, engine=engine,
+                                  n_workers=1, imported_data=candles, draw=False, verbose=False)
+
+
+@pytest.mark.parametrize('engine', ['event', 'vectorized'])
+def test_repeated_sweep_runs_no_backtest(tmp_path, count_backtests, engine):
+    candles = data.CandleDataset.from_candles(generate_candles(2000, INTERVAL))
+    store = result_store.ResultStore(str(tmp_path / 'results.sqlite'))
+    try:
+        records = sweep(store, candles, engine)
+        n_backtests = count_backtests['backtests']
+        assert n_backtests and len(store) == n_backtests
+
+        assert sweep(store, candles, engine) == records
+        assert count_backtests['backtests'] == n_backtests
+    finally:
+        store.close()
+
+
+def test_other_candles_or_engine_version_miss(tmp_path, monkeypatch, count_backtests):
+    candles = data.CandleDataset.from_candles(generate_candles(2000, INTERVAL))
+    store = result_store.ResultStore(str(tmp_path / 'results.sqlite'))
+    try:
+        sweep(store, candles, 'vectorized')
+        n_backtests = count_backtests['backtests']
+
+        sweep(store, data.CandleDataset.from_candles(generate_candles(2000, INTERVAL, seed=1)), 'vectorized')
+        assert count_backtests['backtests'] == 2 * n_backtests
+
+        monkeypatch.setattr(result_store, 'ENGINE_VERSION', result_store.ENGINE_VERSION + 1)
+        sweep(store, candles, 'vectorized')
+        assert count_backtests['backtests'] == 3 * n_backtests
+        assert len(store) == 3 * n_backtests
+    finally:
+        store.close()
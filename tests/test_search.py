@@ -0,0 +1,38 @@
+"""
+Search backends on candles short enough for some backtests of a part of them to have less than 2 trades.
+"""
+import pytest
+
+import data
+import optimization
+import search
+import strategy
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+PARAM_RANGES = {'fast': (2, 40), 'slow': (10, 120)}
+
+
+def test_successive_halving_on_short_data():
+    dataset = data.CandleDataset.from_candles(generate_candles(2000, INTERVAL))
+    optimizer = optimization.Optimizer(SYMBOL, INTERVAL)
+    records = optimizer.optimize_ema(strategy.EMAStrategy, START, END, PARAM_RANGES, engine='vectorized',
+                                     imported_data=dataset, draw=False, verbose=False,
+                                     search=search.SuccessiveHalving(12, seed=1))
+    # points without a result on their part of the candles are left out
+    assert records
+    assert all(0 < record['data_fraction'] <= 1 for record in records)
+    assert any(record['data_fraction'] == 1 for record in records)
+    assert optimization.Optimizer.best_record(records)['data_fraction'] == 1
+
+
+def test_partial_records_never_win():
+    # a point eliminated early can score higher on its part of the candles than the full backtests
+    records = [{'fast': 2, 'slow': 10, 'af_score': 50., 'data_fraction': 1},
+               {'fast': 3, 'slow': 20, 'af_score': 90., 'data_fraction': 1 / 3}]
+    assert optimization.Optimizer.best_record(records)['fast'] == 2
+    with pytest.raises(optimization.NoFinishedRun):
+        optimization.Optimizer.best_record(records[1:])
@@ -0,0 +1,47 @@
+"""
+BackTester.run_vectorized gives the same trades, run log and performance metrics as the event driven
+BackTester.run_test.
+"""
+import numpy as np
+import pytest
+
+import backtesting
+import strategy
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+START = '01-Jan-2019 00:00:00'
+END = '01-Jan-2025 00:00:00'
+N_BARS = 2000
+TRADE_COLUMNS = [SYMBOL, 'price_filled', 'cash', 'commission', 'total']
+
+
+def run(engine, fast, slow, candles):
+    ema_strategy = strategy.EMAStrategy(hlp.interval_to_milliseconds(INTERVAL), fast, slow)
+    backtester = backtesting.BackTester(ema_strategy, SYMBOL, INTERVAL)
+    results = getattr(backtester, engine)(START, END, print_results=False, imported_data=list(candles))
+    return results, backtester.buffer.get_all_data()
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize('fast, slow', [(2, 7), (5, 20), (10, 50), (30, 31), (50, 200)])
+def test_engines_match(seed, fast, slow):
+    candles = generate_candles(N_BARS, INTERVAL, seed=seed, missing_every=97)
+    event_results, event_data = run('run_test', fast, slow, candles)
+    vec_results, vec_data = run('run_vectorized', fast, slow, candles)
+
+    trades = event_data['price_filled'].notna()
+    assert trades.any()
+    assert trades.equals(vec_data['price_filled'].notna())
+    for column in TRADE_COLUMNS:
+        assert np.array_equal(event_data[column].astype(float).values, vec_data[column].values, equal_nan=True), \
+            column
+
+    assert event_results.keys() == vec_results.keys()
+    for key, value in event_results.items():
+        if key == 'drawdown_df':
+            assert value.equals(vec_results[key])
+        else:
+            assert value == vec_results[key], key
@@ -0,0 +1,46 @@
+"""
+WalkForward.split windows for rolling and anchored folds, and the stitched out of sample equity does not depend
+on the out of sample backtests running here or in worker processes.
+"""
+import pytest
+
+import strategy
+import walk_forward
+import btb_helpers as hlp
+from benchmarks.synthetic import generate_candles, START_TS
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1h'
+DAY = 86400 * 1000
+PARAM_RANGES = {'fast': (5, 20), 'slow': (30, 90)}
+
+
+@pytest.mark.parametrize('anchored', [False, True])
+def test_split(anchored):
+    folds = walk_forward.WalkForward(SYMBOL, INTERVAL, '10D', '3D', anchored=anchored).split(0, 20 * DAY)
+    out_of_sample = [(10, 13), (13, 16), (16, 19), (19, 20)]  # the last window is cut at the end
+    assert [(fold.out_of_sample_start, fold.out_of_sample_end) for fold in folds] == \
+           [(start * DAY, end * DAY) for start, end in out_of_sample]
+    for fold in folds:
+        assert fold.in_sample_end == fold.out_of_sample_start
+        assert fold.in_sample_start == (0 if anchored else fold.in_sample_end - 10 * DAY)
+
+
+def test_split_shorter_than_in_sample():
+    assert walk_forward.WalkForward(SYMBOL, INTERVAL, '10D', '3D').split(0, 10 * DAY) == []
+
+
+@pytest.mark.parametrize('anchored', [False, True])
+def test_workers_give_the_same_equity(anchored):
+    candles = generate_candles(24 * 120, INTERVAL, missing_every=41)
+    start, end = hlp.milliseconds_to_date(START_TS), hlp.milliseconds_to_date(START_TS + 120 * DAY)
+    reports = [walk_forward.WalkForward(SYMBOL, INTERVAL, '30D', '20D', anchored=anchored).optimize_ema(
+                   strategy.EMAStrategy, start, end, PARAM_RANGES, n_points=3, n_workers=n_workers,
+                   imported_data=candles, print_results=False)
+               for n_workers in (1, 2)]
+
+    assert len(reports[0]['folds']) == 5
+    assert len(reports[0]['equity'])
+    assert [record['params'] for record in reports[0]['folds']] == [record['params'] for record in reports[1]['folds']]
+    assert reports[0]['equity'].equals(reports[1]['equity'])
+    assert reports[0]['results'] == reports[1]['results']
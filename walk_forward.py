@@ -0,0 +1,218 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+
+import numpy as np
+import pandas as pd
+
+import backtesting
+import data
+import indicators
+import optimization
+import performance
+import btb_helpers as hlp
+
+# time ranges of a fold, ms. Windows of consecutive folds share their boundary: a candle belongs to the window
+# its close_time falls in, both ends included, and close times are never on a whole second
+Fold = namedtuple('Fold', ['in_sample_start', 'in_sample_end', 'out_of_sample_start', 'out_of_sample_end'])
+
+# state of an out of sample worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(shm_name, shape, strategy, symbol, interval, initial_capital, bet_size):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['shm'] = shm  # keep a reference, the array below is a view of its buffer
+    _worker['dataset'] = data.CandleDataset(np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+    _worker['args'] = (strategy, symbol, interval, initial_capital, bet_size)
+
+
+def _run_out_of_sample_worker(task):
+    return _run_out_of_sample(_worker['dataset'], *_worker['args'], *task)
+
+
+def _run_out_of_sample(dataset, strategy, symbol, interval, initial_capital, bet_size, kwargs, start_ts, end_ts,
+                       warm_precomputed):
+    """
+    Backtests the parameters of a fold on its out of sample window, the strategy warmed up on all the candles
+    before the window.
+    :return: backtest results (None if no trades) and the balance of every bar
+    """
+    strategy = strategy(hlp.interval_to_milliseconds(interval), **kwargs)
+    strategy.warm_up(dataset.view(end_ts=start_ts - 1), precomputed=warm_precomputed)
+    backtester = backtesting.BackTester(strategy, symbol, interval, initial_capital=initial_capital,
+                                        bet_size=bet_size)
+    results = backtester.run_test(hlp.milliseconds_to_date(start_ts), hlp.milliseconds_to_date(end_ts),
+                                  print_results=False, imported_data=dataset.view(start_ts, end_ts))
+    return results, backtester.buffer.get_all_data()['total']
+
+
+class WalkForward():
+    """
+    Walk-forward analysis: [start, end] is split into folds of an in sample window followed by an out of sample
+    window. The parameters are optimised on every in sample window, the best ones are backtested on the out of
+    sample window right after it, the out of sample equity of consecutive folds is stitched into one curve:
+    each fold goes on with the balance the previous one ended with, its open position taken as closed.
+    Rolling folds move both windows forward by the out of sample length, anchored ones keep the in sample
+    window starting at start.
+
+    Candles are loaded once and every window is a view of them. Emas of all the periods of the grid are
+    calculated once over the whole range, every backtest (in and out of sample) starts from the values they
+    had at the start of its window, as if the strategy had been running since start.
+    Out of sample backtests of all the folds run in parallel.
+    """
+
+    def __init__(self, symbol, interval, in_sample, out_of_sample, anchored=False, initial_capital=10000,
+                 bet_size=1, cache=None):
+        """
+        :param in_sample: length of the in sample windows, anything pd.Timedelta takes, e.g. '365D'
+        :param out_of_sample: length of the out of sample windows, e.g. '90D'
+        :param anchored: in sample windows all start at start and grow, instead of rolling
+        :param cache: candle_cache.CandleCache to load candles through
+        """
+        self.symbol = symbol
+        self.interval = interval
+        self.in_sample = int(pd.Timedelta(in_sample).total_seconds() * 1000)
+        self.out_of_sample = int(pd.Timedelta(out_of_sample).total_seconds() * 1000)
+        self.anchored = anchored
+        self.initial_capital = initial_capital
+        self.bet_size = bet_size
+        self.cache = cache
+        self.interval_ts = hlp.interval_to_milliseconds(interval)
+
+    def split(self, start_ts, end_ts) -> list:
+        """
+        :return: Folds covering [start_ts, end_ts], the last out of sample window may be shorter
+        """
+        folds = []
+        out_of_sample_start = start_ts + self.in_sample
+        while out_of_sample_start < end_ts:
+            in_sample_start = start_ts if self.anchored else out_of_sample_start - self.in_sample
+            folds.append(Fold(in_sample_start, out_of_sample_start, out_of_sample_start,
+                              min(out_of_sample_start + self.out_of_sample, end_ts)))
+            out_of_sample_start += self.out_of_sample
+        return folds
+
+    def optimize_ema(self, strategy, start: str, end: str, param_ranges: dict, n_points=5, engine='vectorized',
+                     score='af_score', n_workers=None, imported_data=None, print_results=True) -> dict:
+        """
+        :param strategy: strategy class, e.g. strategy.EMAStrategy
+        :param param_ranges: as in Optimizer.optimize_ema, e.g. {'fast': (5, 50), 'slow': (10, 200)}
+        :param engine: engine of the in sample optimisations, see Optimizer.optimize_ema
+        :param score: result of Optimizer.optimize_ema the best parameters are picked by
+        :param n_workers: processes for the out of sample backtests, None means one per cpu core, 1 runs them here
+        :param imported_data: CandleDataset or list of candle tuples in desc order, instead of loading them
+        :return: dict with 'folds' (a record per fold: windows, best parameters, in and out of sample results),
+        'equity' (stitched out of sample balance, pd.Series) and 'results' (performance of the stitched equity)
+        """
+        start_ts = hlp.date_to_milliseconds(start)
+        end_ts = hlp.date_to_milliseconds(end)
+        if imported_data is None:
+            dataset = data.load_dataset(self.symbol, self.interval, start_ts, end_ts, cache=self.cache)
+        elif isinstance(imported_data, data.CandleDataset):
+            dataset = imported_data
+        else:
+            dataset = data.CandleDataset.from_candles(imported_data)
+
+        candles = data.candles_to_columns(dataset)
+        spans = sorted({span for param in ('fast', 'slow') for span in hlp.span_to_list(param_ranges[param], n_points)})
+        grid = indicators.ema_grid(candles['close'], spans)
+        emas = {indicators.EMA(span).name: ema for span, ema in zip(spans, grid)}
+
+        folds = []
+        for fold in self.split(start_ts, end_ts):
+            in_sample = dataset.view(fold.in_sample_start, fold.in_sample_end)
+            out_of_sample = dataset.view(fold.out_of_sample_start, fold.out_of_sample_end)
+            if not len(in_sample) or not len(out_of_sample):
+                continue
+            # emas of all the candles up to the end of the in sample window, and up to the out of sample one
+            in_sample_end = np.searchsorted(candles['close_time'], fold.in_sample_end, side='right')
+            out_of_sample_start = np.searchsorted(candles['close_time'], fold.out_of_sample_start, side='left')
+
+            optimizer = optimization.Optimizer(self.symbol, self.interval, cache=self.cache)
+            in_sample_results = optimizer.optimize_ema(
+                strategy, hlp.milliseconds_to_date(fold.in_sample_start), hlp.milliseconds_to_date(fold.in_sample_end),
+                param_ranges, n_points=n_points, engine=engine, draw=False, imported_data=in_sample,
+                warm_up=dataset.view(end_ts=fold.in_sample_start - 1),
+                precomputed={name: ema[:in_sample_end] for name, ema in emas.items()}, verbose=False)
+            if not in_sample_results:
+                continue
+            best = max(in_sample_results, key=lambda result: result[score])
+            folds.append({
+                'fold': fold,
+                'params': {param: best[param] for param in param_ranges},
+                'in_sample': best,
+                'warm_precomputed': {name: ema[out_of_sample_start - 1:out_of_sample_start]
+                                     for name, ema in emas.items()} if out_of_sample_start else None,
+            })
+
+        tasks = [(record['params'], record['fold'].out_of_sample_start, record['fold'].out_of_sample_end,
+                  record.pop('warm_precomputed')) for record in folds]
+        args = (strategy, self.symbol, self.interval, self.initial_capital, self.bet_size)
+        if n_workers == 1 or len(tasks) < 2:
+            out_of_sample_runs = [_run_out_of_sample(dataset, *args, *task) for task in tasks]
+        else:
+            out_of_sample_runs = self._run_parallel(dataset, args, tasks, n_workers)
+
+        equity = []
+        balance = self.initial_capital
+        for record, (results, total) in zip(folds, out_of_sample_runs):
+            record['out_of_sample'] = results
+            # every fold starts with initial capital, it goes on with the balance the previous one ended with
+            total = total * (balance / self.initial_capital)
+            balance = total.iloc[-1]
+            equity.append(total)
+        equity = pd.concat(equity) if equity else pd.Series(dtype=float)
+
+        report = {'folds': folds, 'equity': equity, 'results': self.equity_performance(equity)}
+        if print_results:
+            self.print_report(report)
+        return report
+
+    def _run_parallel(self, dataset, args, tasks, n_workers) -> list:
+        # the whole dataset goes to shared memory once, the out of sample windows are views of it
+        candles = dataset.values
+        shm = shared_memory.SharedMemory(create=True, size=max(candles.nbytes, 1))
+        try:
+            np.ndarray(candles.shape, dtype=np.float64, buffer=shm.buf)[:] = candles
+            with ProcessPoolExecutor(max_workers=min(n_workers or os.cpu_count(), len(tasks)),
+                                     initializer=_init_worker, initargs=(shm.name, candles.shape, *args)) as pool:
+                return list(pool.map(_run_out_of_sample_worker, tasks))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def equity_performance(self, equity: pd.Series) -> dict:
+        """
+        :param equity: balance of every bar
+        :return: total return, sharpe ratio, max drawdown (percent) and max drawdown duration of the curve
+        """
+        if len(equity) < 2:
+            return None
+        returns = equity.pct_change().dropna()
+        periods = 86400 * 365 * 1000 / self.interval_ts  # bars in a year
+        _, underwater, max_duration = performance.calculate_drawdowns(equity)
+        return {
+            'total_return': 100 * (equity.iloc[-1] - self.initial_capital) / self.initial_capital,
+            'sharpe_ratio': np.sqrt(periods) * returns.mean() / returns.std(ddof=0) if returns.std() else 0.,
+            'max_drawdown': underwater.min(),
+            'max_drawdown_duration': max_duration,
+        }
+
+    @staticmethod
+    def print_report(report: dict):
+        for record in report['folds']:
+            fold = record['fold']
+            results = record['out_of_sample']
+            out_of_sample_return = f'{results["total_return"]:.1f}%' if results else 'no trades'
+            print(f'in sample {hlp.milliseconds_to_date(fold.in_sample_start)} - '
+                  f'{hlp.milliseconds_to_date(fold.in_sample_end)}, out of sample '
+                  f'{hlp.milliseconds_to_date(fold.out_of_sample_start)} - '
+                  f'{hlp.milliseconds_to_date(fold.out_of_sample_end)}: {record["params"]}, '
+                  f'out of sample return: {out_of_sample_return}')
+        results = report['results']
+        if results:
+            print(f'stitched out of sample: total return {results["total_return"]:.1f}%, '
+                  f'Sharpe ratio {results["sharpe_ratio"]:.2f}, max drawdown {results["max_drawdown"]:.1f}%, '
+                  f'max drawdown duration {results["max_drawdown_duration"]}')